@@ -0,0 +1,66 @@
+from fastapi import APIRouter, File, Header, HTTPException, Query, UploadFile
+from typing import Optional
+import asyncio
+import logging
+import secrets
+from app.core.config import settings
+from app.core.profiling import ProfilerBusyError, profile_call
+from app.api.routes import prediction
+from app.utils.upload import UploadError, read_upload
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+logger = logging.getLogger(__name__)
+
+
+def _check_profiling_allowed(token: Optional[str]):
+    """404 unless profiling is enabled, 403 on a wrong token when one is configured"""
+    if not settings.profiling_enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (PROFILING_ENABLED=False)")
+    if settings.profiling_token and not secrets.compare_digest(token or "", settings.profiling_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+@router.post("/profile")
+async def profile_prediction(file: UploadFile = File(...),
+                             top: int = Query(30, ge=1, le=200, description="Functions / allocation sites to report"),
+                             x_profiling_token: Optional[str] = Header(None)):
+    """
+    Predict one upload under a CPU (cProfile) and allocation (tracemalloc) profiler
+    
+    Decode, STFT and the forward pass run synchronously on one thread in this
+    process, bypassing the prediction cache, worker pool and batching queue,
+    so the profile covers the whole request. Disabled unless PROFILING_ENABLED.
+    """
+    _check_profiling_allowed(x_profiling_token)
+    prediction._validate_upload(file)
+    
+    try:
+        content, file_extension = await read_upload(
+            file, settings.max_file_size, analysis_seconds=settings.duration,
+            chunk_size=settings.upload_chunk_size
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    def run():
+        processor = prediction.audio_processor
+        spectrogram = processor.process_audio(content, file_extension)
+        timings = dict(processor.preprocessing_pipeline.last_timings)
+        return prediction.model_handler.predict(spectrogram), timings
+    
+    try:
+        (emotions, timings), report = await asyncio.to_thread(profile_call, run, top=top)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error("Profiled prediction failed", extra={"upload": file.filename, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Profiled prediction failed: {str(e)}")
+    
+    logger.info("Profiled prediction", extra={"upload": file.filename, "wall_seconds": report["wall_seconds"]})
+    return {
+        "success": True,
+        "filename": file.filename,
+        "emotions": emotions,
+        "stage_timings_ms": {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()},
+        "profile": report,
+    }
\ No newline at end of file
@@ -1,11 +1,35 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.core.startup import startup_state
 
 router = APIRouter(prefix="/health", tags=["health"])
 
 @router.get("/")
 async def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "message": "Music Emotion Recognition API is running"
-    }
\ No newline at end of file
+    """Health check endpoint, healthy once the model is loaded and warmed up"""
+    if startup_state.ready:
+        return {
+            "status": "healthy",
+            "message": "Music Emotion Recognition API is running"
+        }
+    status = "unhealthy" if startup_state.error else "starting"
+    return JSONResponse(status_code=503, content={
+        "status": status,
+        "message": startup_state.error or "Music Emotion Recognition API is starting up"
+    })
+
+@router.get("/live")
+async def liveness():
+    """Liveness: the process is up and startup hasn't failed (restart if this fails)"""
+    state = startup_state.snapshot()
+    if state["error"]:
+        return JSONResponse(status_code=503, content={"status": "failed", **state})
+    return {"status": "alive", **state}
+
+@router.get("/ready")
+async def readiness():
+    """Readiness: model loaded and warm-up done (route traffic only when this passes)"""
+    state = startup_state.snapshot()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not ready", **state})
+    return {"status": "ready", **state}
\ No newline at end of file
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException
+import asyncio
+import logging
+from app.core.config import settings
+from app.core.jobs import JobManager, JobNotFoundError, JobStateError, JobStore
+from app.api.routes import prediction
+from app.schemas.job import JobResponse
+from app.utils.upload import UploadError, read_upload
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+logger = logging.getLogger(__name__)
+
+
+async def _predict_job(content: bytes, file_extension: str, params: dict) -> dict:
+    return {"emotions": await prediction._predict_cached(content, file_extension)}
+
+
+async def _timeline_job(content: bytes, file_extension: str, params: dict) -> dict:
+    hop_seconds = params.get("hop_seconds") or settings.timeline_hop_seconds
+    timeline = await asyncio.to_thread(prediction._run_timeline, content, file_extension, hop_seconds)
+    return {"window_seconds": settings.duration, "hop_seconds": hop_seconds, **timeline}
+
+
+job_manager = JobManager(
+    JobStore(settings.jobs_dir),
+    handlers={"predict": _predict_job, "timeline": _timeline_job},
+    concurrency=settings.jobs_concurrency,
+    lease_seconds=settings.jobs_lease_seconds,
+)
+
+
+@router.post("/", response_model=JobResponse, status_code=202)
+async def create_job(file: UploadFile = File(...),
+                     kind: str = Form("predict", description="predict or timeline"),
+                     hop_seconds: float = Form(None, gt=0, description="Timeline hop, defaults to TIMELINE_HOP_SECONDS")):
+    """
+    Queue an analysis job and return its id right away
+    
+    Poll `GET /jobs/{id}` for the status; the result has the same content as
+    the synchronous `/predict` (`kind=predict`) or `/predict/timeline`
+    (`kind=timeline`) response. Jobs are persisted and survive restarts.
+    """
+    prediction._validate_upload(file)
+    if kind not in job_manager.kinds:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind {kind!r}, expected one of {job_manager.kinds}")
+    
+    try:
+        # a predict job only needs the analysed window, a timeline needs the whole track
+        content, file_extension = await read_upload(
+            file, settings.max_file_size,
+            analysis_seconds=settings.duration if kind == "predict" else None,
+            chunk_size=settings.upload_chunk_size
+        )
+    except UploadError as e:
+        logger.warning("Rejected upload", extra={"upload": file.filename, "reason": e.detail})
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    params = {"hop_seconds": hop_seconds} if kind == "timeline" and hop_seconds else {}
+    job = await job_manager.submit(kind, content, file.filename, file_extension, params)
+    logger.info("Queued job", extra={"job_id": job["id"], "kind": kind, "upload": file.filename})
+    return job
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Status of a job, with its result once it succeeded"""
+    try:
+        return await job_manager.get(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+
+@router.delete("/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued job (running and finished jobs can't be cancelled)"""
+    try:
+        job = await job_manager.cancel(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    except JobStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info("Cancelled job", extra={"job_id": job_id})
+    return job
\ No newline at end of file
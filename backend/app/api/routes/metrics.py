@@ -0,0 +1,67 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from app.core.metrics import registry
+from app.api.routes import jobs, prediction, similar
+
+router = APIRouter(tags=["metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _batching_metrics():
+    """Queue depth and batch fill of the batching scheduler"""
+    stats = prediction.batch_scheduler.stats()
+    yield ("mer_queue_size", "gauge", "Requests waiting in the batching queue",
+           [({}, stats["queue_size"])])
+    yield ("mer_queue_capacity", "gauge", "Pending requests before new ones are rejected",
+           [({}, stats["max_queue_size"])])
+
+    # the scheduler's size histogram as a Prometheus histogram with one bucket per size
+    sizes = {int(size): count for size, count in stats["batch_size_histogram"].items()}
+    samples, cumulative = [], 0
+    for size in range(1, stats["max_batch_size"] + 1):
+        cumulative += sizes.get(size, 0)
+        samples.append(("_bucket", {"le": f"{float(size)}"}, cumulative))
+    samples.append(("_bucket", {"le": "+Inf"}, stats["batches"]))
+    samples.append(("_sum", {}, stats["items"]))
+    samples.append(("_count", {}, stats["batches"]))
+    yield ("mer_batch_size", "histogram", "Spectrograms per forward pass of the batching queue", samples)
+
+
+def _cache_metrics():
+    stats = prediction.prediction_cache.stats()
+    yield ("mer_cache_entries", "gauge", "Entries in the in-memory prediction cache", [({}, stats["entries"])])
+    yield ("mer_cache_lookups_total", "counter", "Prediction cache lookups by outcome", [
+        ({"result": result}, stats[key])
+        for result, key in (("hit", "hits"), ("disk_hit", "disk_hits"), ("coalesced", "coalesced"), ("miss", "misses"))
+    ])
+
+
+def _worker_metrics():
+    stats = prediction.worker_pool.stats()
+    yield ("mer_process_pool_restarts_total", "counter", "Preprocessing pool rebuilds after a worker crash",
+           [({}, stats["process_pool_restarts"])])
+
+
+def _job_metrics():
+    counts = jobs.job_manager.stats()["jobs"]
+    yield ("mer_jobs", "gauge", "Background jobs by status",
+           [({"status": status}, count) for status, count in sorted(counts.items())])
+
+
+def _index_metrics():
+    if similar.track_index is None:
+        return
+    stats = similar.track_index.stats()
+    yield ("mer_index_tracks", "gauge", "Tracks in the similarity index", [({}, stats["vectors"])])
+    yield ("mer_index_trained", "gauge", "1 once the similarity index uses IVF lists", [({}, int(stats["trained"]))])
+
+
+for collector in (_batching_metrics, _cache_metrics, _worker_metrics, _job_metrics, _index_metrics):
+    registry.add_collector(collector)
+
+
+@router.get("/metrics")
+async def metrics():
+    """Request, stage latency, batching, cache and job metrics in Prometheus text format"""
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
\ No newline at end of file
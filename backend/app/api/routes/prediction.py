@@ -1,16 +1,114 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
-import tempfile
-import os
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from fastapi.responses import JSONResponse
+from typing import List, Tuple
+import asyncio
+import logging
 import time
+import numpy as np
+from app.core.config import settings
+from app.core import metrics
 from app.core.model_handler import ModelHandler
 from app.core.audio_processor import AudioProcessor
+from app.core.batching import BatchScheduler, QueueFullError
+from app.core.executors import WorkerPool
+from app.core.prediction_cache import PredictionCache
+from app.core.startup import startup_state
+from app.schemas.prediction import BatchPredictionResponse, EmbeddingResponse, TimelineResponse
+from app.utils.upload import TooManyFilesError, UploadError, read_upload, read_zip_members
 
 router = APIRouter(prefix="/predict", tags=["prediction"])
+logger = logging.getLogger(__name__)
 
 # Global instances (we'll improve this later with dependency injection)
 model_handler = ModelHandler()
+worker_pool = WorkerPool(
+    preprocess_workers=settings.preprocess_workers,
+    inference_threads=settings.inference_threads,
+)
+batch_scheduler = BatchScheduler(
+    model_handler.predict_batch,
+    max_batch_size=settings.batch_max_size,
+    max_wait_ms=settings.batch_max_wait_ms,
+    max_queue_size=settings.batch_queue_size,
+    executor=worker_pool.inference_executor,
+)
+prediction_cache = PredictionCache(
+    max_entries=settings.cache_max_entries,
+    ttl_seconds=settings.cache_ttl_seconds,
+    disk_dir=settings.cache_dir,
+)
+# in-process processor for the profiling endpoint, which bypasses the worker pool
 audio_processor = AudioProcessor()
 
+SUPPORTED_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+
+
+def _validate_upload(file: UploadFile):
+    """Reject unsupported formats and requests arriving before the model is ready"""
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Unsupported audio format. Please upload files with extensions: {SUPPORTED_EXTENSIONS}"
+        )
+    
+    _check_ready()
+
+
+def _check_ready():
+    """503 while the server is still starting up, 500 if the model failed to load"""
+    if not startup_state.ready and startup_state.error is None:
+        raise HTTPException(status_code=503, detail="Server is starting up, retry shortly")
+    if not model_handler.is_loaded():
+        raise HTTPException(status_code=500, detail="Model not loaded")
+
+
+async def _predict_content(content: bytes, file_extension: str) -> dict:
+    """Decode + STFT in the worker pool, then score through the batching queue"""
+    try:
+        spectrogram = await worker_pool.process_audio(content, file_extension)
+    except Exception:
+        metrics.record_error("preprocess")
+        raise
+    
+    try:
+        return await batch_scheduler.submit(spectrogram)
+    except QueueFullError:
+        metrics.record_error("queue")
+        raise
+    except Exception:
+        metrics.record_error("model_forward")
+        raise
+
+
+async def _embed_content(content: bytes, file_extension: str) -> Tuple[dict, np.ndarray]:
+    """Decode + STFT in the worker pool, then scores and embedding in one forward pass on the inference thread"""
+    try:
+        spectrogram = await worker_pool.process_audio(content, file_extension)
+    except Exception:
+        metrics.record_error("preprocess")
+        raise
+    
+    try:
+        scores, embeddings = await worker_pool.run_inference(model_handler.predict_with_embedding, spectrogram)
+    except Exception:
+        metrics.record_error("model_forward")
+        raise
+    return scores[0], embeddings[0]
+
+
+async def _predict_cached(content: bytes, file_extension: str) -> dict:
+    """_predict_content behind the prediction cache (when enabled)"""
+    if not settings.cache_enabled:
+        return await _predict_content(content, file_extension)
+    # hashing up to MAX_FILE_SIZE bytes would stall the event loop
+    key = await asyncio.to_thread(prediction_cache.key, content)
+    emotions, cached = await prediction_cache.get_or_compute(
+        key, lambda: _predict_content(content, file_extension)
+    )
+    if cached:
+        logger.debug("Served from prediction cache")
+    return emotions
+
 @router.post("/")
 async def predict_emotion(file: UploadFile = File(...)):
     """
@@ -21,58 +119,271 @@ async def predict_emotion(file: UploadFile = File(...)):
     """
     start_time = time.time()
     
-    print(f"\n🎵 Processing file: {file.filename}")
+    _validate_upload(file)
     
-    # Validate file type
-    supported_extensions = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
-    if not file.filename.lower().endswith(supported_extensions):
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Unsupported audio format. Please upload files with extensions: {supported_extensions}"
-        )
-    
-    # Check if model is loaded
-    if not model_handler.is_loaded():
-        raise HTTPException(status_code=500, detail="Model not loaded")
-    
-    temp_file_path = None
     try:
-        # Save uploaded file temporarily
-        file_extension = os.path.splitext(file.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            temp_file_path = tmp_file.name
+        # Only the bytes covering the analysed 15s are read, the format comes from the header
+        with metrics.timed("upload_read"):
+            content, file_extension = await read_upload(
+                file, settings.max_file_size, analysis_seconds=settings.duration,
+                chunk_size=settings.upload_chunk_size
+            )
         
-        print(f"📁 Saved temp file: {temp_file_path}")
+        emotions = await _predict_cached(content, file_extension)
         
-        # Process audio to spectrogram
-        print("🔄 Converting audio to spectrogram...")
-        spectrogram = audio_processor.process_audio(temp_file_path)
+        processing_time = round(time.time() - start_time, 2)
         
-        # Get emotion predictions
-        print("🧠 Running model prediction...")
-        emotions = model_handler.predict(spectrogram)
+        logger.info("Prediction completed", extra={
+            "upload": file.filename, "format": file_extension, "processing_time": processing_time
+        })
+        logger.debug("Emotions", extra={"upload": file.filename, **emotions})
         
-        processing_time = round(time.time() - start_time, 2)
+        with metrics.timed("serialization"):
+            return JSONResponse({
+                "success": True,
+                "filename": file.filename,
+                "emotions": emotions,
+                "processing_time": processing_time,
+                "message": "Emotion prediction completed successfully"
+            })
+        
+    except UploadError as e:
+        logger.warning("Rejected upload", extra={"upload": file.filename, "reason": e.detail})
+        metrics.record_error("upload_read")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    except QueueFullError as e:
+        logger.warning("Rejected upload, queue full", extra={"upload": file.filename})
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    except Exception as e:
+        logger.error("Prediction failed", extra={"upload": file.filename, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
+
+@router.post("/embedding", response_model=EmbeddingResponse)
+async def predict_embedding(file: UploadFile = File(...)):
+    """
+    Predict emotions and return the track embedding
+    
+    The embedding is the model's 256-d pooled feature that the 8 scores are
+    computed from; tracks whose embeddings point the same way (cosine
+    similarity) are emotionally alike, see /similar.
+    """
+    start_time = time.time()
+    
+    _validate_upload(file)
+    
+    try:
+        with metrics.timed("upload_read"):
+            content, file_extension = await read_upload(
+                file, settings.max_file_size, analysis_seconds=settings.duration,
+                chunk_size=settings.upload_chunk_size
+            )
         
-        print(f"✅ Prediction completed in {processing_time}s")
-        print(f"🎭 Emotions: {emotions}")
+        emotions, embedding = await _embed_content(content, file_extension)
+        
+        processing_time = round(time.time() - start_time, 2)
+        logger.info("Embedding completed", extra={
+            "upload": file.filename, "format": file_extension, "processing_time": processing_time
+        })
         
         return {
             "success": True,
             "filename": file.filename,
             "emotions": emotions,
+            "embedding": embedding.tolist(),
             "processing_time": processing_time,
-            "message": "Emotion prediction completed successfully"
         }
         
+    except UploadError as e:
+        logger.warning("Rejected upload", extra={"upload": file.filename, "reason": e.detail})
+        metrics.record_error("upload_read")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
     except Exception as e:
-        print(f"❌ Error processing {file.filename}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        logger.error("Embedding failed", extra={"upload": file.filename, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
+
+
+async def _collect_batch_items(files: List[UploadFile]) -> list:
+    """Read every upload (expanding zip archives) into (filename, (content, ext) or UploadError)"""
+    items = []
+    for file in files:
+        remaining = settings.batch_max_files - len(items)
+        try:
+            if file.filename.lower().endswith('.zip'):
+                archive, _ = await read_upload(file, settings.max_request_size,
+                                               chunk_size=settings.upload_chunk_size, audio=False)
+                members = await asyncio.to_thread(
+                    read_zip_members, archive, settings.max_file_size, settings.duration,
+                    settings.upload_chunk_size, remaining
+                )
+                items.extend((f"{file.filename}/{name}", result) for name, result in members)
+                continue
+            if remaining <= 0:
+                raise TooManyFilesError(settings.batch_max_files)
+            items.append((file.filename, await read_upload(
+                file, settings.max_file_size, analysis_seconds=settings.duration,
+                chunk_size=settings.upload_chunk_size
+            )))
+        except TooManyFilesError:
+            raise
+        except UploadError as e:
+            items.append((file.filename, e))
+    return items
+
+
+@router.post("/batch", response_model=BatchPredictionResponse)
+async def predict_batch(files: List[UploadFile] = File(...)):
+    """
+    Predict emotions for many audio files in one request
+    
+    Accepts several files and/or zip archives of audio files. Files are decoded
+    in parallel in the worker pool, BATCH_MAX_SIZE at a time with one vectorized
+    STFT, and scored in batched forward passes; each file gets its own result or
+    error, one bad file never fails the request.
+    """
+    start_time = time.time()
+    
+    _check_ready()
+    
+    try:
+        with metrics.timed("upload_read"):
+            items = await _collect_batch_items(files)
+    except UploadError as e:
+        logger.warning("Rejected batch", extra={"uploads": len(files), "reason": e.detail})
+        metrics.record_error("upload_read")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    results = [{"filename": name, "success": False} for name, _ in items]
+    
+    # Chunks of up to batch_max_size files: each is decoded in one worker process with a single
+    # vectorized STFT (chunks run in parallel across workers), then scored in one forward pass
+    readable = [(i, item) for i, (_, item) in enumerate(items) if not isinstance(item, UploadError)]
+    for i, (_, item) in enumerate(items):
+        if isinstance(item, UploadError):
+            results[i]["error"] = item.detail
+    chunks = [readable[offset:offset + settings.batch_max_size]
+              for offset in range(0, len(readable), settings.batch_max_size)]
+    processed = await asyncio.gather(
+        *(worker_pool.process_audio_batch([content for _, (content, _) in chunk],
+                                          [file_extension for _, (_, file_extension) in chunk])
+          for chunk in chunks),
+        return_exceptions=True
+    )
+    
+    for chunk, outcome in zip(chunks, processed):
+        if isinstance(outcome, Exception):
+            for i, _ in chunk:
+                metrics.record_error("preprocess")
+                results[i]["error"] = f"Audio processing failed: {str(outcome)}"
+            continue
+        spectrograms, errors = outcome
+        decoded = []
+        for (i, _), error in zip(chunk, errors):
+            if error is not None:
+                metrics.record_error("preprocess")
+                results[i]["error"] = error
+            else:
+                decoded.append(i)
+        if not decoded:
+            continue
+        try:
+            scores = await worker_pool.run_inference(model_handler.predict_batch, spectrograms)
+        except Exception as e:
+            metrics.record_error("model_forward")
+            for i in decoded:
+                results[i]["error"] = f"Prediction failed: {str(e)}"
+            continue
+        for i, emotions in zip(decoded, scores):
+            results[i].update(success=True, emotions=emotions)
+    
+    succeeded = sum(result["success"] for result in results)
+    processing_time = round(time.time() - start_time, 2)
+    logger.info("Batch prediction completed", extra={
+        "files": len(results), "succeeded": succeeded, "processing_time": processing_time
+    })
+    
+    return {
+        "success": succeeded > 0,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+        "processing_time": processing_time,
+    }
+
+
+def _run_timeline(content: bytes, file_extension: str, hop_seconds: float) -> dict:
+    """
+    Stream windows out of the track from a preprocessing worker and score them
+    batch by batch on the inference thread. Blocking: call it from a thread.
+    """
+    windows = worker_pool.iter_windows(content, file_extension, hop_seconds, settings.batch_max_size)
+    return model_handler.predict_timeline(
+        windows,
+        batch_size=settings.batch_max_size,
+        predict_fn=lambda batch: worker_pool.submit_inference(model_handler.predict_batch, batch).result(),
+    )
+
+
+@router.post("/timeline", response_model=TimelineResponse)
+async def predict_timeline(file: UploadFile = File(...),
+                           hop_seconds: float = Query(None, gt=0, description="Seconds between window starts")):
+    """
+    Predict an emotion timeline over the whole track
+    
+    The track is cut into overlapping windows of the model's 15 second input
+    length, `hop_seconds` apart, and each window gets its 8 emotion scores.
+    The aggregate is the mean over all windows.
+    """
+    start_time = time.time()
+    hop_seconds = hop_seconds or settings.timeline_hop_seconds
+    
+    _validate_upload(file)
     
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-            print(f"🗑️ Cleaned up temp file")
\ No newline at end of file
+    try:
+        # every window is scored, so the whole track is read
+        with metrics.timed("upload_read"):
+            content, file_extension = await read_upload(
+                file, settings.max_file_size, chunk_size=settings.upload_chunk_size
+            )
+        
+        timeline = await asyncio.to_thread(_run_timeline, content, file_extension, hop_seconds)
+        
+        processing_time = round(time.time() - start_time, 2)
+        logger.info("Timeline completed", extra={
+            "upload": file.filename, "windows": len(timeline["windows"]), "processing_time": processing_time
+        })
+        
+        return {
+            "success": True,
+            "filename": file.filename,
+            "window_seconds": settings.duration,
+            "hop_seconds": hop_seconds,
+            "windows": timeline["windows"],
+            "aggregate": timeline["aggregate"],
+            "processing_time": processing_time,
+        }
+        
+    except UploadError as e:
+        logger.warning("Rejected upload", extra={"upload": file.filename, "reason": e.detail})
+        metrics.record_error("upload_read")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    except Exception as e:
+        metrics.record_error("timeline")
+        logger.error("Timeline prediction failed", extra={"upload": file.filename, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Timeline prediction failed: {str(e)}")
+
+
+@router.get("/stats")
+async def prediction_stats():
+    """Batching, worker pool and prediction cache statistics"""
+    return {
+        "batching": batch_scheduler.stats(),
+        "workers": worker_pool.stats(),
+        "cache": prediction_cache.stats()
+    }
\ No newline at end of file
@@ -0,0 +1,246 @@
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from typing import Optional
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from app.core.config import settings
+from app.core import metrics
+from app.core.vector_index import ServingLock, TrackNotFoundError, VectorIndex
+from app.api.routes import prediction
+from app.schemas.similar import IndexedTrackResponse, SimilarResponse
+from app.utils.upload import UploadError, read_upload
+
+router = APIRouter(prefix="/similar", tags=["similarity"])
+logger = logging.getLogger(__name__)
+
+# built at startup once the model (and so the embedding fingerprint) is loaded
+track_index: Optional[VectorIndex] = None
+# held for as long as this process serves INDEX_PATH, tells whether others serve it too
+serving_lock: Optional[ServingLock] = None
+
+
+def load_index(weights_fingerprint: str, dim: int) -> VectorIndex:
+    """
+    Load the persisted track index, or start an empty one
+
+    Args:
+        weights_fingerprint: fingerprint of the loaded weights, embeddings of other weights aren't comparable
+        dim: embedding size of the model
+
+    Returns:
+        VectorIndex: the index served by /similar
+    """
+    global track_index, serving_lock
+    if settings.index_path and serving_lock is None:
+        try:
+            serving_lock = ServingLock(settings.index_path)
+        except OSError as e:
+            logger.warning("Can't lock the similarity index, serving it read-only",
+                           extra={"path": settings.index_path, "error": str(e)})
+    if settings.index_path and os.path.exists(settings.index_path):
+        index = VectorIndex.load(settings.index_path)
+        if index.fingerprint != weights_fingerprint:
+            raise RuntimeError(f"{settings.index_path} was built with other weights, "
+                               f"rebuild it with scripts/build_index.py")
+        index.nprobe = settings.index_nprobe
+    else:
+        index = VectorIndex(dim, settings.index_nlist, settings.index_nprobe, weights_fingerprint)
+    track_index = index
+    return index
+
+
+def read_only() -> bool:
+    """
+    The index is read-only without INDEX_PATH or with API_WORKERS > 1: every
+    server process holds its own copy, so an update would reach one of them
+    only. Other ways of running several processes (uvicorn --workers, a second
+    server on the same INDEX_PATH) are caught by the serving lock when writing.
+    """
+    return settings.api_workers > 1 or not settings.index_path or serving_lock is None
+
+
+@contextmanager
+def _sole_writer():
+    """Raises 409 unless this is the only process serving INDEX_PATH"""
+    with serving_lock.exclusive() as alone:
+        if not alone:
+            raise HTTPException(status_code=409, detail="The similarity index is read-only: other server "
+                                                        "processes serve the same INDEX_PATH")
+        yield
+
+
+def save_index():
+    """Persist inserts and removals to INDEX_PATH (no-op without changes, or when read-only)"""
+    if track_index is None or not track_index.dirty or read_only():
+        return
+    with serving_lock.exclusive() as alone:
+        if not alone:
+            logger.warning("Not saving the similarity index, other server processes serve it",
+                           extra={"path": settings.index_path})
+            return
+        track_index.save(settings.index_path)
+
+
+def _get_index() -> VectorIndex:
+    prediction._check_ready()
+    if track_index is None:
+        raise HTTPException(status_code=503, detail="Similarity index not available")
+    return track_index
+
+
+def _get_writable_index() -> VectorIndex:
+    index = _get_index()
+    if read_only():
+        raise HTTPException(status_code=409, detail="The similarity index is read-only without INDEX_PATH or "
+                                                    "with API_WORKERS > 1, update it with scripts/build_index.py "
+                                                    "and restart")
+    return index
+
+
+async def _search(index: VectorIndex, query, k: int, exact: bool, exclude: Optional[str] = None):
+    """Search off the event loop, returns (results, milliseconds spent searching)"""
+    def run():
+        start = time.perf_counter()
+        results = index.search(query, k, exact=exact, exclude=exclude)
+        seconds = time.perf_counter() - start
+        metrics.observe_stage("similarity_search", seconds)
+        return results, seconds
+
+    results, seconds = await asyncio.to_thread(run)
+    return [{"track_id": track_id, "similarity": similarity} for track_id, similarity in results], \
+        round(seconds * 1000, 3)
+
+
+async def _read_audio(file: UploadFile):
+    prediction._validate_upload(file)
+    try:
+        with metrics.timed("upload_read"):
+            return await read_upload(
+                file, settings.max_file_size, analysis_seconds=settings.duration,
+                chunk_size=settings.upload_chunk_size
+            )
+    except UploadError as e:
+        logger.warning("Rejected upload", extra={"upload": file.filename, "reason": e.detail})
+        metrics.record_error("upload_read")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@router.post("/", response_model=SimilarResponse)
+async def similar_to_upload(file: UploadFile = File(...),
+                            k: int = Query(10, ge=1, le=settings.similar_max_k),
+                            exact: bool = Query(False, description="Scan the whole index instead of the closest lists")):
+    """
+    Find the k indexed tracks most emotionally similar to an uploaded track
+
+    The upload is embedded like /predict/embedding and compared (cosine
+    similarity) with the indexed tracks' embeddings.
+    """
+    start_time = time.time()
+    index = _get_index()
+    content, file_extension = await _read_audio(file)
+
+    try:
+        emotions, embedding = await prediction._embed_content(content, file_extension)
+        results, search_ms = await _search(index, embedding, k, exact)
+    except Exception as e:
+        logger.error("Similarity search failed", extra={"upload": file.filename, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Similarity search failed: {str(e)}")
+
+    processing_time = round(time.time() - start_time, 2)
+    logger.info("Similarity search completed", extra={
+        "upload": file.filename, "k": k, "exact": exact, "search_ms": search_ms, "processing_time": processing_time
+    })
+    return {
+        "success": True,
+        "query": file.filename,
+        "emotions": emotions,
+        "exact": exact,
+        "results": results,
+        "search_ms": search_ms,
+        "processing_time": processing_time,
+    }
+
+
+@router.get("/tracks/{track_id}", response_model=SimilarResponse)
+async def similar_to_track(track_id: str,
+                           k: int = Query(10, ge=1, le=settings.similar_max_k),
+                           exact: bool = Query(False, description="Scan the whole index instead of the closest lists")):
+    """Find the k tracks most emotionally similar to an indexed track (itself excluded)"""
+    start_time = time.time()
+    index = _get_index()
+    try:
+        embedding = index.get(track_id)
+    except TrackNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Track {track_id} is not indexed")
+
+    results, search_ms = await _search(index, embedding, k, exact, exclude=track_id)
+    return {
+        "success": True,
+        "query": track_id,
+        "exact": exact,
+        "results": results,
+        "search_ms": search_ms,
+        "processing_time": round(time.time() - start_time, 4),
+    }
+
+
+@router.put("/tracks/{track_id}", response_model=IndexedTrackResponse)
+async def index_track(track_id: str, file: UploadFile = File(...)):
+    """
+    Add a track to the index, or replace its embedding
+
+    Changes are kept in memory and written to INDEX_PATH on shutdown or with
+    POST /similar/save. Only available to a single server process serving
+    INDEX_PATH (409 otherwise).
+    """
+    index = _get_writable_index()
+    content, file_extension = await _read_audio(file)
+
+    try:
+        emotions, embedding = await prediction._embed_content(content, file_extension)
+    except Exception as e:
+        logger.error("Indexing failed", extra={"upload": file.filename, "track_id": track_id, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Indexing failed: {str(e)}")
+
+    with _sole_writer():
+        replaced = track_id in index
+        # may start training the IVF lists (in the background) when the index reaches its training size
+        await asyncio.to_thread(index.add, [track_id], embedding[None])
+    logger.info("Indexed track", extra={"track_id": track_id, "upload": file.filename, "replaced": replaced})
+    return {
+        "success": True,
+        "track_id": track_id,
+        "emotions": emotions,
+        "replaced": replaced,
+        "index_size": len(index),
+    }
+
+
+@router.delete("/tracks/{track_id}")
+async def remove_track(track_id: str):
+    """Remove a track from the index (single server process only)"""
+    index = _get_writable_index()
+    with _sole_writer():
+        removed = await asyncio.to_thread(index.remove, track_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Track {track_id} is not indexed")
+    return {"success": True, "track_id": track_id, "index_size": len(index)}
+
+
+@router.post("/save")
+async def save():
+    """Write the index to INDEX_PATH now (single server process only)"""
+    if not settings.index_path:
+        raise HTTPException(status_code=400, detail="INDEX_PATH is not set")
+    index = _get_writable_index()
+    with _sole_writer():
+        await asyncio.to_thread(index.save, settings.index_path)
+    return {"success": True, "path": settings.index_path, "index_size": len(index)}
+
+
+@router.get("/stats")
+async def index_stats():
+    """Size, IVF layout and memory of the track index"""
+    return _get_index().stats()
@@ -1,61 +1,170 @@
+import logging
 import numpy as np
-from models.preprocessing import PreprocessingPipeline
+from models.preprocessing import PreprocessingPipeline, Loader, Padder, LogSpectrogramExtractor, SlidingWindowExtractor
+from app.core.config import settings
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple, Union
 import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def preprocessing_params() -> dict:
+    """Spectrogram parameters used for serving, as configured in Settings"""
+    return {
+        "sample_rate": settings.sample_rate,
+        "duration": settings.duration,
+        "mono": True,
+        "resampler": settings.resampler,
+        "resample_quality": settings.resample_quality,
+        "frame_size": settings.frame_size,
+        "hop_length": settings.hop_length,
+    }
+
+
+def build_preprocessing_pipeline() -> PreprocessingPipeline:
+    """Build a preprocessing pipeline from the configured spectrogram parameters"""
+    params = preprocessing_params()
+    pipeline = PreprocessingPipeline()
+    pipeline.loader = Loader(params["sample_rate"], params["duration"], params["mono"],
+                             params["resampler"], params["resample_quality"])
+    pipeline.padder = Padder()
+    pipeline.extractor = LogSpectrogramExtractor(params["frame_size"], params["hop_length"])
+    return pipeline
+
 
 class AudioProcessor:
     def __init__(self):
-        print("Initializing audio processor...")
         try:
-            self.preprocessing_pipeline = PreprocessingPipeline()
-            print("✅ Audio processor initialized")
-        except Exception as e:
-            print(f"❌ Failed to initialize preprocessing pipeline: {str(e)}")
+            self.preprocessing_pipeline = build_preprocessing_pipeline()
+            logger.info("Audio processor initialized")
+        except Exception:
+            logger.error("Failed to initialize preprocessing pipeline", exc_info=True)
             raise
     
-    def process_audio(self, audio_path: str) -> np.ndarray:
+    def process_audio(self, audio: Union[str, bytes, BinaryIO], file_extension: Optional[str] = None) -> np.ndarray:
         """
-        Process audio file to spectrogram format expected by model
+        Process audio to spectrogram format expected by model
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file, or the encoded audio as bytes / a binary buffer
+            file_extension: Original extension (e.g. '.mp3') when audio is in memory
             
         Returns:
             np.ndarray: Spectrogram of shape (1, 256, 1292) or similar
         """
         try:
-            print(f"Processing audio file: {audio_path}")
-            
-            # Check if file exists
-            if not os.path.exists(audio_path):
-                raise FileNotFoundError(f"Audio file not found: {audio_path}")
-            
-            # Check file size
-            file_size = os.path.getsize(audio_path)
-            print(f"File size: {file_size} bytes")
+            if isinstance(audio, str):
+                # Check if file exists
+                if not os.path.exists(audio):
+                    raise FileNotFoundError(f"Audio file not found: {audio}")
+                source, file_size = audio, os.path.getsize(audio)
+            elif isinstance(audio, (bytes, bytearray, memoryview)):
+                source, file_size = "memory", len(audio)
+            else:
+                source, file_size = "buffer", None
             
             # Use the single file processing method
-            print("Calling preprocessing pipeline...")
-            spectrogram = self.preprocessing_pipeline.process_single_file(audio_path)
-            
-            print(f"Preprocessing returned: {type(spectrogram)}")
+            spectrogram = self.preprocessing_pipeline.process_single_file(audio, file_extension)
             
             if spectrogram is None:
                 raise ValueError("Preprocessing pipeline returned None")
             
-            print(f"Spectrogram shape after preprocessing: {spectrogram.shape}")
-            print(f"Spectrogram dtype: {spectrogram.dtype}")
-            print(f"Spectrogram min/max: {spectrogram.min():.4f} / {spectrogram.max():.4f}")
-            
             # Ensure correct shape for model input
             if len(spectrogram.shape) == 2:
                 # Add channel dimension: (256, 1292) -> (1, 256, 1292)
                 spectrogram = np.expand_dims(spectrogram, axis=0)
-                print(f"Added channel dimension: {spectrogram.shape}")
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                # full passes over the spectrogram, only paid for when debugging
+                logger.debug("Processed audio", extra={
+                    "source": source,
+                    "format": file_extension,
+                    "bytes": file_size,
+                    "shape": spectrogram.shape,
+                    "dtype": str(spectrogram.dtype),
+                    "min": round(float(spectrogram.min()), 4),
+                    "max": round(float(spectrogram.max()), 4),
+                    **{f"{stage}_ms": round(seconds * 1000, 1)
+                       for stage, seconds in self.preprocessing_pipeline.last_timings.items()},
+                })
             
             return spectrogram
             
         except Exception as e:
-            print(f"❌ Audio processing error: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            raise RuntimeError(f"Audio processing failed: {str(e)}")
\ No newline at end of file
+            logger.error("Audio processing failed", exc_info=True, extra={"format": file_extension})
+            raise RuntimeError(f"Audio processing failed: {str(e)}")
+    
+    def process_audio_batch(self, audios: Sequence[Union[str, bytes]],
+                            file_extensions: Optional[Sequence[Optional[str]]] = None
+                            ) -> Tuple[np.ndarray, List[Optional[str]], List[dict]]:
+        """
+        Process several audio files with a single vectorized STFT
+        
+        Files are decoded one by one; a file that fails to decode is reported
+        in `errors` and left out instead of failing the others.
+        
+        Args:
+            audios: Paths to audio files or encoded audio bytes
+            file_extensions: Original extension of each in-memory audio
+            
+        Returns:
+            tuple: (spectrograms of shape (N_ok, 1, 256, 1292) of the decoded files in input order,
+                error message or None for every input, stage timings: one dict per decoded
+                file plus one for the batched padding and STFT)
+        """
+        if file_extensions is None:
+            file_extensions = [None] * len(audios)
+        pipeline = self.preprocessing_pipeline
+        signals, errors, timings = [], [], []
+        for audio, ext in zip(audios, file_extensions):
+            try:
+                signals.append(pipeline.loader.load(audio, ext))
+                errors.append(None)
+                timings.append(dict(pipeline.loader.last_timings))
+            except Exception as e:
+                logger.warning("Batch item failed to decode", extra={"format": ext, "error": str(e)})
+                errors.append(f"Audio processing failed: {str(e) or type(e).__name__}")
+        if not signals:
+            return np.empty((0, 1, 0, 0), dtype=np.float32), errors, timings
+        
+        try:
+            stage_start = time.perf_counter()
+            spectrograms = pipeline.process_signals(signals)
+            timings.append({"stft": time.perf_counter() - stage_start})
+            # Add channel dimension: (N, 256, 1292) -> (N, 1, 256, 1292)
+            return np.expand_dims(spectrograms, axis=1), errors, timings
+        except Exception as e:
+            logger.error("Batch audio processing failed", exc_info=True, extra={"files": len(audios)})
+            raise RuntimeError(f"Batch audio processing failed: {str(e)}")
+    
+    def iter_windows(self, audio: Union[str, bytes], file_extension: Optional[str] = None,
+                     hop_seconds: float = 5.0) -> Iterator[Tuple[float, float, np.ndarray]]:
+        """
+        Stream a whole track as overlapping analysis windows
+        
+        The track is decoded block by block and its STFT is computed once; each
+        window of `duration` seconds is sliced out of it, so memory stays bounded
+        whatever the track length.
+        
+        Args:
+            audio: Path to audio file or encoded audio bytes
+            file_extension: Original extension of in-memory audio
+            hop_seconds: Time between the starts of consecutive windows
+            
+        Yields:
+            tuple: (start seconds, end seconds, spectrogram of shape (1, 256, 1292))
+        """
+        pipeline = self.preprocessing_pipeline
+        extractor = pipeline.extractor
+        sample_rate = pipeline.loader.sample_rate
+        window_seconds = pipeline.loader.duration
+        # frames per window, same as the STFT of a padded `duration` clip
+        window_frames = 1 + int(sample_rate * window_seconds) // extractor.hop_length
+        hop_frames = max(1, int(round(hop_seconds * sample_rate / extractor.hop_length)))
+        
+        sliding = SlidingWindowExtractor(extractor, window_frames, hop_frames)
+        chunks = pipeline.loader.stream(audio, file_extension)
+        for start_frame, window in sliding.windows(chunks):
+            start = start_frame * extractor.hop_length / sample_rate
+            yield round(start, 3), round(start + window_seconds, 3), np.expand_dims(window, axis=0)
\ No newline at end of file
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the batching queue cannot accept more requests"""
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching queue in front of the model.
+
+    Requests are queued and coalesced until either `max_batch_size` items are
+    waiting or `max_wait_ms` has passed since the first item of the batch arrived.
+    The whole batch is then run as a single forward pass and each caller gets
+    its own result back.
+
+    Args:
+        predict_fn: callable taking a (B, 1, 256, 1292) array and returning B results
+        max_batch_size: largest number of spectrograms per forward pass
+        max_wait_ms: how long the first request of a batch may wait for company
+        max_queue_size: number of pending requests before new ones are rejected
+        executor: executor the forward pass runs on (default: the loop's default executor)
+    """
+    def __init__(self, predict_fn: Callable[[np.ndarray], List[dict]],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 64, executor: Optional[Executor] = None) -> None:
+        self.predict_fn = predict_fn
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue_size = max_queue_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # batch statistics
+        self._batches = 0
+        self._items = 0
+        self._size_histogram = Counter()
+        self._last_batch_size = 0
+
+    async def start(self):
+        """Start the background batching loop (must be called inside the event loop)"""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+        logger.info("Batch scheduler started", extra={
+            "max_batch": self.max_batch_size, "max_wait_ms": round(self.max_wait * 1000, 1),
+            "queue_size": self.max_queue_size,
+        })
+
+    async def stop(self):
+        """Stop the batching loop and fail any request still waiting in the queue"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    async def submit(self, spectrogram: np.ndarray) -> dict:
+        """
+        Queue a single spectrogram and wait for its prediction
+
+        Args:
+            spectrogram: numpy array of shape (1, 256, 1292) or (256, 1292)
+
+        Returns:
+            dict: emotion scores for this spectrogram
+        """
+        if self._worker is None:
+            raise RuntimeError("Batch scheduler not started")
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((spectrogram, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Prediction queue is full ({self.max_queue_size} pending requests)")
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch):
+        # callers that went away (client disconnect) don't need a slot in the batch
+        batch = [(spec, future, queued_at) for spec, future, queued_at in batch if not future.done()]
+        if not batch:
+            return
+
+        start_time = time.perf_counter()
+        for _, _, queued_at in batch:
+            metrics.observe_stage("queue_wait", start_time - queued_at)
+        try:
+            inputs = np.stack([spec if spec.ndim == 3 else np.expand_dims(spec, 0)
+                               for spec, _, _ in batch])
+            start_time = time.perf_counter()
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.predict_fn, inputs)
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._record(len(batch))
+        logger.debug("Batch ran", extra={
+            "batch_size": len(batch), "max_batch_size": self.max_batch_size, "elapsed_ms": round(elapsed_ms, 1)
+        })
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _record(self, batch_size: int):
+        self._batches += 1
+        self._items += batch_size
+        self._size_histogram[batch_size] += 1
+        self._last_batch_size = batch_size
+
+    def stats(self) -> dict:
+        """Return batch fill statistics collected since startup"""
+        mean_size = self._items / self._batches if self._batches else 0.0
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_size": self.max_queue_size,
+            "batches": self._batches,
+            "items": self._items,
+            "mean_batch_size": round(mean_size, 2),
+            "mean_fill_ratio": round(mean_size / self.max_batch_size, 3),
+            "last_batch_size": self._last_batch_size,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self._size_histogram.items())},
+        }
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
 
 class Settings(BaseSettings):
@@ -8,27 +8,80 @@ class Settings(BaseSettings):
     api_version: str = "1.0.0"
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    api_workers: int = 1  # server processes, `python -m app.main` launches this many
+    torch_threads: int = 0  # intra-op threads per server process, 0 splits the cores across api_workers
     debug: bool = False
     
     # Model Settings
-    model_path: str = "best.pth"
+    model_path: str = "best.pth"  # plain state dict or a folded file from models.shared_weights
+    mmap_weights: bool = True  # map weights from the file, shared by all server processes (CPU)
+    folded_weights_dir: Optional[str] = None  # where serving writes folded side files, defaults to next to the weights
     device: str = "auto"  # auto, cpu, cuda
+    inference_backend: str = "torch"  # torch, onnx, quantized
+    optimize_model: bool = True  # torch backend: fold BatchNorm, drop Dropout, script + freeze
+    channels_last: str = "auto"  # auto (kept only if faster), on, off
+    onnx_path: Optional[str] = None  # defaults to the weights path with .onnx, exported when missing or stale
+    onnx_intra_op_threads: int = 0  # 0 lets ONNX Runtime decide
+    onnx_inter_op_threads: int = 1
+    warmup_enabled: bool = True  # synthetic request through decode -> STFT -> predict before reporting ready
+    parity_tolerance: float = 1e-3  # max raw score difference accepted from an alternative backend
+    quantized_path: Optional[str] = None  # int8 artifact from scripts/quantize.py, defaults to <weights>.int8.pt
+    quantized_tolerance: float = 0.05  # int8 trades some precision, checked against this instead
     
     # Audio Processing Settings
     sample_rate: int = 22050
     duration: int = 15
     frame_size: int = 512
     hop_length: int = 256
+    resampler: str = "auto"  # auto, soxr, scipy, librosa
+    resample_quality: str = "hq"  # low, medium, hq, vhq
+    
+    # Batching Settings
+    batch_max_size: int = 8  # spectrograms per forward pass
+    batch_max_wait_ms: float = 5.0  # how long a request waits for others to join its batch
+    batch_queue_size: int = 64  # pending requests before new ones get 503
+    batch_max_files: int = 64  # files per /predict/batch request, zip members included
+    
+    # Timeline Settings
+    timeline_hop_seconds: float = 5.0  # default hop between 15s analysis windows
+    
+    # Worker Pool Settings
+    preprocess_workers: int = 2  # decode/STFT processes, 0 runs them in a thread instead
+    inference_threads: int = 1  # threads dedicated to torch forward passes
+    
+    # Prediction Cache Settings
+    cache_enabled: bool = True
+    cache_max_entries: int = 4096  # in-memory LRU size
+    cache_ttl_seconds: int = 7 * 24 * 3600  # 0 keeps entries until evicted
+    cache_dir: Optional[str] = None  # persistent disk tier, disabled when unset
+    
+    # Job Queue Settings
+    jobs_dir: str = "jobs"  # SQLite job table and queued upload payloads
+    jobs_concurrency: int = 2  # jobs processed at the same time
+    jobs_lease_seconds: float = 60.0  # a running job whose process stopped renewing it for this long is re-queued
+    
+    # Similarity Index Settings (/similar)
+    index_path: Optional[str] = None  # persisted track index (scripts/build_index.py), loaded at startup, saved on shutdown
+    index_nlist: int = 1024  # IVF lists of a new index, trained once it holds 40 tracks per list; 0 keeps it exact
+    index_nprobe: int = 16  # lists scanned per approximate query, more is slower and closer to exact
+    similar_max_k: int = 100
     
     # File Settings
     max_file_size: int = 50 * 1024 * 1024  # 50MB
+    max_request_size: int = 200 * 1024 * 1024  # whole body of /predict/batch and /jobs, others get max_file_size
+    upload_chunk_size: int = 64 * 1024  # bytes per read when ingesting uploads
     allowed_extensions: List[str] = [".mp3", ".wav", ".flac", ".m4a", ".ogg"]
     upload_dir: str = "uploads"
     
     # Logging
-    log_level: str = "INFO"
+    log_level: str = "INFO"  # DEBUG adds per-request diagnostics (shapes, value ranges, scores)
+    log_format: str = "text"  # text (key=value) or json (one object per line)
     log_file: str = "logs/app.log"
     
+    # Profiling (POST /admin/profile)
+    profiling_enabled: bool = False
+    profiling_token: Optional[str] = None  # required X-Profiling-Token header when set
+    
     class Config:
         env_file = ".env"
 
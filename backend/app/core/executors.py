@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.core.audio_processor import AudioProcessor
+from app.core.config import settings
+from app.core.log import configure_logging
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-process audio processor, created once in each pool worker
+_worker_processor: Optional[AudioProcessor] = None
+
+
+def _init_worker():
+    global _worker_processor
+    # spawned processes start with unconfigured logging
+    configure_logging(settings.log_level, settings.log_format)
+    _worker_processor = AudioProcessor()
+
+
+def _share(array: np.ndarray):
+    """Copy an array into a new shared memory block, returns (name, shape, dtype) to rebuild it"""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    if not array.nbytes:
+        # blocks can't be empty
+        return None, array.shape, array.dtype.str
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        return shm.name, array.shape, array.dtype.str
+    finally:
+        shm.close()
+
+
+def _process_in_worker(audio: Union[str, bytes], file_extension: Optional[str]):
+    """
+    Decode + STFT inside a pool worker. The spectrogram is written into a shared
+    memory block and only its name, shape and dtype travel back to the parent,
+    together with the stage timings of the preprocessing pipeline.
+    """
+    spectrogram = _worker_processor.process_audio(audio, file_extension)
+    timings = dict(_worker_processor.preprocessing_pipeline.last_timings)
+    return (*_share(spectrogram), [timings])
+
+
+def _process_batch_in_worker(audios: Sequence[Union[str, bytes]], file_extensions: Sequence[Optional[str]]):
+    """Decode several files + one batched STFT inside a pool worker, returned like _process_in_worker plus the errors"""
+    spectrograms, errors, timings = _worker_processor.process_audio_batch(audios, file_extensions)
+    return (*_share(spectrograms), timings, errors)
+
+
+def _windows_in_worker(audio: Union[str, bytes], file_extension: Optional[str], hop_seconds: float,
+                       batch_size: int, channel, stop):
+    """
+    Stream a track's analysis windows out of a pool worker: every batch_size
+    windows go into one shared memory block whose name is put on channel.
+    channel is bounded, so the worker waits for the reader instead of
+    holding the whole track's windows; stop ends the stream early.
+    """
+    batch, spans = [], []
+
+    def send():
+        channel.put(("windows", *_share(np.stack(batch)), list(spans)))
+        batch.clear()
+        spans.clear()
+
+    for start, end, spectrogram in _worker_processor.iter_windows(audio, file_extension, hop_seconds):
+        if stop.is_set():
+            return
+        batch.append(spectrogram)
+        spans.append((start, end))
+        if len(batch) == batch_size:
+            send()
+    if batch and not stop.is_set():
+        send()
+    channel.put(("done", dict(_worker_processor.preprocessing_pipeline.last_timings)))
+
+
+def _process_inline(processor: AudioProcessor, audio: Union[str, bytes], file_extension: Optional[str]):
+    spectrogram = processor.process_audio(audio, file_extension)
+    return spectrogram, dict(processor.preprocessing_pipeline.last_timings)
+
+
+def _take_shared(name: Optional[str], shape, dtype) -> np.ndarray:
+    """Copy a spectrogram out of a shared memory block and release the block"""
+    if name is None:
+        return np.empty(shape, dtype=np.dtype(dtype))
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _release_abandoned(future: Future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    name = future.result()[0]
+    if name is None:
+        return
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+
+class WorkerPool:
+    """
+    Executor layer that keeps CPU-heavy work off the asyncio event loop.
+
+    Decoding and STFT run in a process pool; spectrograms come back through
+    shared memory instead of being pickled. Torch forward passes run on a
+    small dedicated thread pool. A process pool whose worker crashed is
+    rebuilt and the failed task is retried once. Timeline windows stream
+    from a worker in bounded batches.
+
+    Args:
+        preprocess_workers: number of decode/STFT processes, 0 runs them on a thread in this process
+        inference_threads: number of threads dedicated to model forward passes
+    """
+    def __init__(self, preprocess_workers: int = 2, inference_threads: int = 1) -> None:
+        self.preprocess_workers = max(0, preprocess_workers)
+        self.inference_threads = max(1, inference_threads)
+        self.inference_executor = ThreadPoolExecutor(max_workers=self.inference_threads,
+                                                     thread_name_prefix="inference")
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._inline_processor: Optional[AudioProcessor] = None
+        # started on the first timeline, carries window batches from the workers
+        self._manager = None
+        self.restarts = 0
+
+    def start(self):
+        """Create the preprocessing process pool"""
+        if self.preprocess_workers == 0:
+            self._inline_processor = AudioProcessor()
+            logger.info("Worker pool started", extra={"preprocess_workers": 0})
+            return
+        with self._pool_lock:
+            self._process_pool = self._new_process_pool()
+        logger.info("Worker pool started", extra={"preprocess_workers": self.preprocess_workers})
+
+    def shutdown(self):
+        """Stop all workers, waiting for running tasks to finish"""
+        with self._pool_lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=True, cancel_futures=True)
+                self._process_pool = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+        self.inference_executor.shutdown(wait=True)
+
+    def _new_process_pool(self) -> ProcessPoolExecutor:
+        # spawn keeps torch/OpenMP state of the server process out of the workers
+        return ProcessPoolExecutor(max_workers=self.preprocess_workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+
+    def _restart_process_pool(self, broken: ProcessPoolExecutor):
+        with self._pool_lock:
+            # another request may already have replaced it
+            if self._process_pool is broken:
+                logger.warning("Preprocessing worker crashed, restarting pool", extra={"restarts": self.restarts + 1})
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._process_pool = self._new_process_pool()
+                self.restarts += 1
+
+    async def process_audio(self, audio: Union[str, bytes], file_extension: Optional[str] = None) -> np.ndarray:
+        """
+        Decode audio and compute its spectrogram off the event loop
+
+        Args:
+            audio: Path to audio file, or the encoded audio bytes
+            file_extension: Original extension (e.g. '.mp3') of in-memory audio
+
+        Returns:
+            np.ndarray: Spectrogram of shape (1, 256, 1292)
+        """
+        loop = asyncio.get_running_loop()
+        if self._process_pool is None:
+            if self._inline_processor is None:
+                raise RuntimeError("Worker pool not started")
+            spectrogram, timings = await loop.run_in_executor(None, _process_inline, self._inline_processor,
+                                                              audio, file_extension)
+            metrics.observe_stages(timings)
+            return spectrogram
+
+        name, shape, dtype, timings = await self._run_in_pool(_process_in_worker, audio, file_extension)
+        for stage_timings in timings:
+            metrics.observe_stages(stage_timings)
+        return _take_shared(name, shape, dtype)
+
+    async def process_audio_batch(self, audios: Sequence[Union[str, bytes]],
+                                  file_extensions: Sequence[Optional[str]]) -> Tuple[np.ndarray, List[Optional[str]]]:
+        """
+        Decode several files and compute their spectrograms with one vectorized
+        STFT, in a single worker, off the event loop
+
+        Args:
+            audios: encoded audio bytes (or paths)
+            file_extensions: original extension of each audio
+
+        Returns:
+            tuple: (spectrograms of shape (N_ok, 1, 256, 1292) of the files that decoded, in input order,
+                error message or None for every input)
+        """
+        if self._process_pool is None:
+            if self._inline_processor is None:
+                raise RuntimeError("Worker pool not started")
+            spectrograms, errors, timings = await asyncio.get_running_loop().run_in_executor(
+                None, self._inline_processor.process_audio_batch, audios, file_extensions
+            )
+        else:
+            name, shape, dtype, timings, errors = await self._run_in_pool(
+                _process_batch_in_worker, audios, file_extensions
+            )
+            spectrograms = _take_shared(name, shape, dtype)
+        for stage_timings in timings:
+            metrics.observe_stages(stage_timings)
+        return spectrograms, errors
+
+    def iter_windows(self, audio: Union[str, bytes], file_extension: Optional[str] = None,
+                     hop_seconds: float = 5.0, batch_size: int = 8) -> Iterator[Tuple[float, float, np.ndarray]]:
+        """
+        Stream a whole track as overlapping analysis windows, decoded and
+        transformed in a pool worker. Blocking: iterate it from a thread.
+        At most two batches of windows are in flight at a time.
+
+        Args:
+            audio: Path to audio file, or the encoded audio bytes
+            file_extension: Original extension (e.g. '.mp3') of in-memory audio
+            hop_seconds: Time between the starts of consecutive windows
+            batch_size: windows per shared memory block
+
+        Yields:
+            tuple: (start seconds, end seconds, spectrogram of shape (1, 256, 1292))
+        """
+        if self._process_pool is None:
+            if self._inline_processor is None:
+                raise RuntimeError("Worker pool not started")
+            yield from self._inline_processor.iter_windows(audio, file_extension, hop_seconds)
+            metrics.observe_stages(self._inline_processor.preprocessing_pipeline.last_timings)
+            return
+
+        with self._pool_lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+            channel, stop = self._manager.Queue(maxsize=2), self._manager.Event()
+        pool = self._process_pool
+        try:
+            future = pool.submit(_windows_in_worker, audio, file_extension, hop_seconds,
+                                 batch_size, channel, stop)
+        except BrokenProcessPool:
+            self._restart_process_pool(pool)
+            future = self._process_pool.submit(_windows_in_worker, audio, file_extension, hop_seconds,
+                                               batch_size, channel, stop)
+
+        def receive(timeout: float = 0.1):
+            """Next message from the worker, None once it ended without sending one"""
+            while True:
+                try:
+                    return channel.get(timeout=timeout)
+                except queue.Empty:
+                    # the worker puts its last message before returning
+                    if future.done() and channel.empty():
+                        return None
+
+        finished = False
+        try:
+            while True:
+                message = receive()
+                if message is None:
+                    try:
+                        future.result()
+                    except BrokenProcessPool:
+                        self._restart_process_pool(pool)
+                        raise RuntimeError("Audio processing failed: preprocessing worker crashed")
+                    raise RuntimeError("Audio processing failed: window stream ended early")
+                if message[0] == "done":
+                    finished = True
+                    metrics.observe_stages(message[1])
+                    return
+                _, name, shape, dtype, spans = message
+                batch = _take_shared(name, shape, dtype)
+                for (start, end), spectrogram in zip(spans, batch):
+                    yield start, end, spectrogram
+        finally:
+            if not finished:
+                # stopped early (error, client gone): end the worker and release what it already sent
+                stop.set()
+                while (message := receive()) is not None and message[0] != "done":
+                    _take_shared(*message[1:4])
+
+    async def _run_in_pool(self, fn: Callable, *args):
+        """Run fn in the process pool, rebuilding the pool and retrying once if a worker crashed"""
+        for attempt in range(2):
+            pool = self._process_pool
+            try:
+                future = pool.submit(fn, *args)
+                try:
+                    return await asyncio.wrap_future(future)
+                except asyncio.CancelledError:
+                    # the worker may still finish: make sure its block gets released
+                    future.add_done_callback(_release_abandoned)
+                    raise
+            except BrokenProcessPool:
+                self._restart_process_pool(pool)
+                if attempt == 1:
+                    raise RuntimeError("Audio processing failed: preprocessing worker crashed")
+
+    def submit_inference(self, fn: Callable, *args) -> Future:
+        """Schedule a model call on the inference thread (usable from any thread)"""
+        return self.inference_executor.submit(fn, *args)
+
+    async def run_inference(self, fn: Callable, *args):
+        """Run a model call on the inference thread and await its result"""
+        return await asyncio.get_running_loop().run_in_executor(self.inference_executor, fn, *args)
+
+    def stats(self) -> dict:
+        """Pool sizes and how many times the process pool had to be rebuilt"""
+        return {
+            "preprocess_workers": self.preprocess_workers,
+            "inference_threads": self.inference_threads,
+            "process_pool_restarts": self.restarts,
+        }
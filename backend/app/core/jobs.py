@@ -0,0 +1,355 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+JobHandler = Callable[[bytes, str, dict], Awaitable[dict]]
+
+
+class JobNotFoundError(KeyError):
+    pass
+
+
+class JobStateError(RuntimeError):
+    """Operation not allowed in the job's current state"""
+    pass
+
+
+class JobStore:
+    """
+    SQLite-backed job table. Upload payloads are kept as files next to the
+    database so rows stay small; both survive restarts.
+
+    Every call opens its own connection, so the store can be used from
+    `asyncio.to_thread` workers without sharing a connection across threads,
+    and several server processes can share one store. A running job belongs
+    to the process that claimed it (`owner`) for as long as that process keeps
+    renewing its `heartbeat_at`; only jobs whose lease expired are re-queued.
+
+    Args:
+        jobs_dir: directory holding `jobs.db` and the `payloads/` directory
+    """
+    DB_FILE = "jobs.db"
+    PAYLOAD_DIR = "payloads"
+
+    def __init__(self, jobs_dir: str) -> None:
+        self.jobs_dir = jobs_dir
+        self.db_path = os.path.join(jobs_dir, self.DB_FILE)
+        self.payload_dir = os.path.join(jobs_dir, self.PAYLOAD_DIR)
+
+    def initialize(self):
+        """Create the directories and the jobs table if needed"""
+        os.makedirs(self.payload_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    file_extension TEXT,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    owner TEXT,
+                    heartbeat_at REAL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            # tables created before job leases
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                    except sqlite3.OperationalError as e:
+                        # another process starting at the same time added it first
+                        if "duplicate column" not in str(e):
+                            raise
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _payload_path(self, job_id: str) -> str:
+        return os.path.join(self.payload_dir, f"{job_id}.bin")
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, kind: str, content: bytes, filename: str, file_extension: str,
+               params: Optional[dict] = None) -> dict:
+        """Persist the payload and add a queued job"""
+        job_id = uuid.uuid4().hex
+        # payload first: a queued row always has its file
+        with open(self._payload_path(job_id), "wb") as f:
+            f.write(content)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, filename, file_extension, params, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, filename, file_extension, json.dumps(params or {}), time.time()),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFoundError(job_id)
+        return self._to_dict(row)
+
+    def claim_next(self, owner: str = "") -> Optional[dict]:
+        """Atomically move the oldest queued job to running, owned by `owner`, and return it"""
+        with self._connect() as conn:
+            # write lock up front so two claimers never pick the same row
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ? WHERE id = ?",
+                         (RUNNING, now, owner, now, row["id"]))
+        return self.get(row["id"])
+
+    def heartbeat(self, job_ids: List[str], owner: str = ""):
+        """Renew the lease of running jobs"""
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                             [(time.time(), job_id, RUNNING, owner) for job_id in job_ids])
+
+    def load_payload(self, job_id: str) -> bytes:
+        with open(self._payload_path(job_id), "rb") as f:
+            return f.read()
+
+    def finish(self, job_id: str, result: Optional[dict] = None, error: Optional[str] = None,
+               owner: str = ""):
+        """Record the outcome of a job running under `owner` and drop its payload"""
+        with self._connect() as conn:
+            # a job re-queued after its lease expired belongs to someone else now
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND status = ? AND owner = ?",
+                (FAILED if error is not None else SUCCEEDED,
+                 json.dumps(result) if result is not None else None, error, time.time(), job_id, RUNNING, owner),
+            ).rowcount
+        if updated:
+            self._remove_payload(job_id)
+
+    def cancel(self, job_id: str) -> dict:
+        """Cancel a queued job"""
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            ).rowcount
+        job = self.get(job_id)
+        if not updated:
+            raise JobStateError(f"Job {job_id} is {job['status']}, only queued jobs can be cancelled")
+        self._remove_payload(job_id)
+        return job
+
+    def requeue_expired(self, lease_seconds: float) -> int:
+        """Put running jobs whose owner stopped renewing their lease (crashed process) back in the queue"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (QUEUED, RUNNING, time.time() - lease_seconds),
+            ).rowcount
+
+    def requeue_owned(self, owner: str) -> int:
+        """Put the running jobs of a stopping owner back in the queue"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND owner = ?",
+                (QUEUED, RUNNING, owner),
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _remove_payload(self, job_id: str):
+        try:
+            os.unlink(self._payload_path(job_id))
+        except OSError:
+            pass
+
+
+class JobManager:
+    """
+    Background workers processing the persistent job queue.
+
+    `concurrency` asyncio workers claim queued jobs from the store and run the
+    handler registered for the job kind; the heavy lifting inside the handlers
+    already happens in the worker pool, so the workers only bound how many jobs
+    are in flight at once. Workers sleep until a job is submitted (or
+    `poll_interval` passes) instead of hammering the database.
+
+    Several server processes can share one store: each renews the lease of its
+    running jobs every `lease_seconds / 3`, and re-queues the running jobs of
+    processes whose lease expired (they crashed), so no job runs twice.
+
+    Args:
+        store: persistent job store
+        handlers: job kind -> coroutine function (content, file_extension, params) -> result dict
+        concurrency: number of jobs processed at the same time
+        poll_interval: seconds between queue checks when idle
+        lease_seconds: how long a running job stays claimed without a heartbeat
+    """
+    def __init__(self, store: JobStore, handlers: Dict[str, JobHandler], concurrency: int = 2,
+                 poll_interval: float = 1.0, lease_seconds: float = 60.0) -> None:
+        self.store = store
+        self.handlers = handlers
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._running: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def kinds(self):
+        return tuple(self.handlers)
+
+    async def start(self):
+        if self._workers:
+            return
+        await asyncio.to_thread(self.store.initialize)
+        # jobs other live processes are running keep their lease
+        requeued = await asyncio.to_thread(self.store.requeue_expired, self.lease_seconds)
+        if requeued:
+            logger.warning("Re-queued jobs interrupted by the last shutdown", extra={"jobs": requeued})
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        logger.info("Job workers started", extra={"concurrency": self.concurrency, "owner": self.owner})
+
+    async def stop(self):
+        tasks = self._workers + ([self._heartbeat_task] if self._heartbeat_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat_task = None
+        self._running.clear()
+        # interrupted jobs go back to the queue right away instead of when their lease expires
+        try:
+            await asyncio.to_thread(self.store.requeue_owned, self.owner)
+        except sqlite3.Error as e:
+            logger.warning("Failed to re-queue running jobs", extra={"error": str(e)})
+
+    async def submit(self, kind: str, content: bytes, filename: str, file_extension: str,
+                     params: Optional[dict] = None) -> dict:
+        """Persist a new job and wake a worker"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind {kind!r}, expected one of {self.kinds}")
+        job = await asyncio.to_thread(self.store.create, kind, content, filename, file_extension, params)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> dict:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id: str) -> dict:
+        return await asyncio.to_thread(self.store.cancel, job_id)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, list(self._running), self.owner)
+                requeued = await asyncio.to_thread(self.store.requeue_expired, self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.warning("Job heartbeat failed", extra={"error": str(e)})
+                continue
+            if requeued:
+                logger.warning("Re-queued jobs of a stopped worker", extra={"jobs": requeued})
+                self._wakeup.set()
+
+    async def _work(self):
+        while True:
+            # cleared before looking, so a submit racing with an empty claim still wakes us
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.store.claim_next, self.owner)
+            except sqlite3.Error as e:
+                # e.g. "database is locked" while other processes write to the same store
+                logger.warning("Failed to claim a job, retrying", extra={"error": str(e)})
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._running.add(job["id"])
+            try:
+                await self._run(job)
+            except sqlite3.Error as e:
+                # its lease expires and another worker picks it up again
+                logger.error("Failed to record job outcome", extra={"job_id": job["id"], "error": str(e)})
+            finally:
+                self._running.discard(job["id"])
+
+    async def _run(self, job: dict):
+        logger.info("Running job", extra={"job_id": job["id"], "kind": job["kind"], "upload": job["filename"]})
+        try:
+            content = await asyncio.to_thread(self.store.load_payload, job["id"])
+            result = await self.handlers[job["kind"]](content, job["file_extension"], job["params"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Job failed", extra={"job_id": job["id"], "error": str(e)})
+            await asyncio.to_thread(self.store.finish, job["id"], None, str(e), self.owner)
+            return
+        await asyncio.to_thread(self.store.finish, job["id"], result, None, self.owner)
+        logger.info("Job completed", extra={"job_id": job["id"]})
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running_workers": sum(not worker.done() for worker in self._workers),
+            "running_jobs": len(self._running),
+            "jobs": self.store.counts(),
+        }
@@ -0,0 +1,321 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# seconds, from sub-millisecond tensor conversion up to multi-second decodes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (metric name, type, help, samples) produced by a collector at scrape time; a sample is
+# (labels, value) or (suffix, labels, value), e.g. ("_bucket", {"le": "4.0"}, 12) for histograms
+Sample = Tuple
+CollectedMetric = Tuple[str, str, str, List[Sample]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class: a named metric with a fixed set of label names and one child per label combination"""
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # an unlabelled metric has a sample (0) from the first scrape on
+            self.labels()
+
+    @property
+    def family(self) -> str:
+        """Name in the HELP/TYPE lines, which must match the sample names"""
+        return self.name
+
+    def labels(self, *values):
+        """Child metric for one combination of label values"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.family} {self.documentation}", f"# TYPE {self.family} {self.type}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.family}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter, e.g. requests or errors"""
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    @property
+    def family(self) -> str:
+        # samples are named <name>_total, so is the family (as prometheus_client does)
+        return f"{self.name}_total"
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield "", dict(zip(self.labelnames, key)), child.value
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. in-flight requests"""
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield "", dict(zip(self.labelnames, key)), child.value
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # per-bucket (non-cumulative) counts, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in fixed buckets. Observing is a bisect and
+    two additions under a lock, cheap enough for every request stage.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", {**labels, "le": _format_value(float(bound))}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process plus collectors that read existing statistics
+    (batching, cache, ...) at scrape time, rendered in Prometheus text format.
+    With several server workers every process exposes its own values.
+    """
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[CollectedMetric]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[CollectedMetric]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {str(e)}")
+                continue
+            for name, metric_type, documentation, samples in collected:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for sample in samples:
+                    suffix, labels, value = sample if len(sample) == 3 else ("",) + tuple(sample)
+                    lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "mer_stage_seconds", "Seconds spent per request stage", ["stage"]
+)
+REQUEST_SECONDS = registry.histogram(
+    "mer_request_seconds", "End-to-end request latency", ["route"]
+)
+REQUESTS = registry.counter(
+    "mer_requests", "Requests handled", ["route", "method", "status"]
+)
+ERRORS = registry.counter(
+    "mer_errors", "Failed requests by the stage that failed", ["stage"]
+)
+IN_FLIGHT = registry.gauge(
+    "mer_requests_in_flight", "Requests currently being handled"
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_stages(timings: Optional[Dict[str, float]]):
+    """Record a dict of stage -> seconds, e.g. a preprocessing pipeline's last_timings"""
+    if not timings:
+        return
+    for stage, seconds in timings.items():
+        if stage != "total":
+            STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_error(stage: str):
+    ERRORS.labels(stage).inc()
+
+
+class timed:
+    """Context manager timing a block into mer_stage_seconds{stage=...}"""
+    __slots__ = ("stage", "_start")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.labels(self.stage).observe(time.perf_counter() - self._start)
+        return False
+
+
+def _route_template(scope) -> str:
+    """Path template of the matched route (/jobs/{job_id}), keeps label cardinality bounded"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # older Starlette versions don't put the matched route into the scope
+    from starlette.routing import Match
+    router = getattr(scope.get("app"), "router", None)
+    for candidate in getattr(router, "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests by route template and status code,
+    timing them and tracking how many are in flight
+    """
+    def __init__(self, app, excluded_paths: Sequence[str] = ("/metrics",)) -> None:
+        self.app = app
+        self.excluded_paths = tuple(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            route = _route_template(scope)
+            REQUEST_SECONDS.labels(route).observe(time.perf_counter() - start)
+            REQUESTS.labels(route, scope["method"], status).inc()
\ No newline at end of file
@@ -1,37 +1,201 @@
 import torch
 import numpy as np
-from models.torch_models import Audio2EmotionModel
+import logging
+import os
+from typing import Callable, Iterable, List, Optional, Tuple
+from models.shared_weights import build_model, ensure_folded_weights, load_weights, weights_fingerprint
+from app.core.config import settings
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def configure_torch_threads(api_workers: int = 1, torch_threads: int = 0) -> int:
+    """
+    Set torch intra-op threads for this process so that `api_workers` serving
+    processes together don't oversubscribe the cores
+    
+    Args:
+        api_workers: number of server processes sharing the machine
+        torch_threads: explicit thread count, 0 splits the cores evenly
+        
+    Returns:
+        int: threads used by this process
+    """
+    threads = torch_threads or max(1, (os.cpu_count() or 1) // max(1, api_workers))
+    torch.set_num_threads(threads)
+    try:
+        # forward passes are already serialised on the inference thread(s)
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # can only be set before any inter-op parallel work has started
+        pass
+    return threads
+
 
 class ModelHandler:
     def __init__(self):
         self.model = None
+        self.weights_fingerprint = None
+        self.backend = None
+        self._runner = None
+        self._inference_model = None
+        self.shared_weights = False
+        self.folded_weights = False
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.emotion_labels = ['valence', 'energy', 'tension', 'anger', 'fear', 'happy', 'sad', 'tender']
-        print(f"Using device: {self.device}")
+        logger.info("Using device", extra={"device": str(self.device)})
     
-    def load_model(self, weights_path: str = "best.pth"):
-        """Load the Audio2EmotionModel with trained weights"""
+    def load_model(self, weights_path: str = "best.pth", backend: Optional[str] = None):
+        """
+        Load the Audio2EmotionModel with trained weights
+        
+        Args:
+            weights_path: trained state dict
+            backend: 'torch', 'onnx' or 'quantized', defaults to settings.inference_backend.
+                Alternative backends fall back to torch if they can't be set up
+                or their outputs don't match the torch model.
+        """
+        backend = backend or settings.inference_backend
+        if backend not in ("torch", "onnx", "quantized"):
+            raise ValueError(f"Unknown inference backend {backend!r}, expected 'torch', 'onnx' or 'quantized'")
         try:
-            print(f"Loading model from {weights_path}...")
+            logger.info("Loading model", extra={"weights": weights_path})
             
-            # Initialize your model
-            self.model = Audio2EmotionModel()
+            # Load weights: memory-mapped on CPU so every worker process shares the same pages
+            self.shared_weights = settings.mmap_weights and self.device.type == "cpu"
+            serving_path = weights_path
+            if self.shared_weights and settings.optimize_model:
+                serving_path = self._folded_side_file(weights_path)
+            state_dict, self.folded_weights = load_weights(serving_path, map_location=self.device,
+                                                           mmap=self.shared_weights)
             
-            # Load weights
-            state_dict = torch.load(weights_path, map_location=self.device)
-            self.model.load_state_dict(state_dict)
+            # Initialize your model (plain or BatchNorm-folded layout, as stored)
+            self.model = build_model(self.folded_weights)
+            # assign: parameters become the mapped tensors instead of copies of them
+            self.model.load_state_dict(state_dict, assign=self.shared_weights)
+            # recorded in folded files, so workers don't each read (and hash) the whole weights file
+            self.weights_fingerprint = weights_fingerprint(weights_path, serving_path)
             
             # Set to evaluation mode and move to device
             self.model.eval()
             self.model.to(self.device)
+            self.backend = "torch"
+            self._runner = None
+            self._inference_model = None
+            
+            logger.info("Model loaded", extra={"device": str(self.device), "memory_mapped": self.shared_weights,
+                                               "folded": self.folded_weights, "weights": serving_path})
             
-            print(f"✅ Model loaded successfully on {self.device}")
+            if settings.optimize_model:
+                self._optimize()
+            
+            if backend == "onnx":
+                self._load_onnx(weights_path)
+            elif backend == "quantized":
+                self._load_quantized(weights_path)
             
         except Exception as e:
-            print(f"❌ Failed to load model: {str(e)}")
+            logger.error("Failed to load model", exc_info=True, extra={"weights": weights_path})
             self.model = None
             raise
     
+    @staticmethod
+    def _folded_side_file(weights_path: str) -> str:
+        """Map folded weights (written to FOLDED_WEIGHTS_DIR on first use), so optimizing copies nothing"""
+        try:
+            return ensure_folded_weights(weights_path, settings.folded_weights_dir, settings.parity_tolerance)
+        except Exception as e:
+            logger.warning("No folded weights, serving the plain weights "
+                           "(set FOLDED_WEIGHTS_DIR to a writable directory if it is read-only)",
+                           extra={"weights": weights_path, "error": str(e)})
+            return weights_path
+    
+    def _optimize(self):
+        """Swap in a BatchNorm-folded, frozen model for torch forward passes"""
+        if self.shared_weights and not self.folded_weights:
+            # folding would give every worker a private copy of the mapped weights
+            logger.warning("Skipping inference optimization to keep the memory-mapped weights shared; "
+                           "fold them once with `python -m models.shared_weights` and serve the folded file")
+            return
+        try:
+            from models.onnx_backend import max_abs_difference, sample_inputs
+            from models.optimization import optimize_for_inference
+            
+            channels_last = {"on": True, "off": False}.get(settings.channels_last, "auto")
+            # shared (so folded): build on the mapped weights themselves, a copy
+            # (or a channels_last re-layout) would make them private to this process
+            inplace = self.shared_weights
+            if inplace and channels_last == "auto":
+                channels_last = False
+            sample = torch.from_numpy(sample_inputs(1)).to(self.device)
+            optimized, info = optimize_for_inference(self.model, sample, channels_last=channels_last,
+                                                     inplace=inplace)
+            
+            def plain_forward(x):
+                with torch.no_grad():
+                    return self.model(torch.from_numpy(x).to(self.device)).cpu().numpy()
+            
+            def optimized_forward(x):
+                with torch.no_grad():
+                    return optimized(torch.from_numpy(x).to(self.device)).cpu().numpy()
+            
+            error = max_abs_difference(plain_forward, optimized_forward, sample_inputs())
+            if error > settings.parity_tolerance:
+                raise RuntimeError(f"outputs differ from the plain model by {error:.2e}")
+            
+            self._inference_model = optimized
+            logger.info("Inference-optimized model ready", extra={**info, "parity_error": f"{error:.2e}"})
+        except Exception as e:
+            logger.warning("Model optimization failed, using the plain model", extra={"error": str(e)})
+    
+    def _load_onnx(self, weights_path: str):
+        """Serve through ONNX Runtime, exporting the model first if needed"""
+        try:
+            from models.onnx_backend import OnnxRunner, export_onnx
+            
+            onnx_path = settings.onnx_path or os.path.splitext(weights_path)[0] + ".onnx"
+            if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(weights_path):
+                logger.info("Exporting ONNX model", extra={"path": onnx_path})
+                export_onnx(self.model, onnx_path)
+            
+            runner = OnnxRunner(onnx_path, settings.onnx_intra_op_threads, settings.onnx_inter_op_threads)
+            self._use_runner("onnx", runner, settings.parity_tolerance)
+        except Exception as e:
+            logger.warning("ONNX backend unavailable, serving with torch", extra={"error": str(e)})
+    
+    def _load_quantized(self, weights_path: str):
+        """Serve the int8 artifact written by scripts/quantize.py"""
+        try:
+            from models.quantization import load_quantized
+            
+            quantized_path = settings.quantized_path or os.path.splitext(weights_path)[0] + ".int8.pt"
+            if not os.path.exists(quantized_path):
+                raise FileNotFoundError(f"{quantized_path} not found, create it with scripts/quantize.py")
+            if os.path.getmtime(quantized_path) < os.path.getmtime(weights_path):
+                raise RuntimeError(f"{quantized_path} is older than {weights_path}, re-run scripts/quantize.py")
+            
+            self._use_runner("quantized", load_quantized(quantized_path), settings.quantized_tolerance)
+        except Exception as e:
+            logger.warning("Quantized backend unavailable, serving with torch", extra={"error": str(e)})
+    
+    def _use_runner(self, backend: str, runner: Callable[[np.ndarray], np.ndarray], tolerance: float):
+        """Switch forward passes to runner if its outputs match the torch model"""
+        from models.onnx_backend import max_abs_difference, sample_inputs
+        
+        error = max_abs_difference(lambda x: self._torch_forward(torch.from_numpy(x)), runner, sample_inputs())
+        if error > tolerance:
+            raise RuntimeError(f"outputs differ from torch by {error:.2e} (tolerance {tolerance:.0e})")
+        
+        self._runner = runner
+        self.backend = backend
+        logger.info("Inference backend ready", extra={"backend": backend, "parity_error": f"{error:.2e}"})
+    
+    @property
+    def fingerprint(self) -> str:
+        """Identifies what produces predictions: the weights and the backend running them"""
+        return f"{self.weights_fingerprint}:{self.backend}"
+    
     def is_loaded(self) -> bool:
         """Check if model is loaded"""
         return self.model is not None
@@ -54,47 +218,172 @@ class ModelHandler:
             raise RuntimeError("Model not loaded")
         
         try:
-            print(f"Input spectrogram shape: {spectrogram.shape}")
-            
             # Ensure correct shape (B, C, H, W) = (1, 1, 256, 1292)
-            if len(spectrogram.shape) == 2:
-                # Shape is (256, 1292), add batch and channel dimensions
-                input_tensor = torch.FloatTensor(spectrogram).unsqueeze(0).unsqueeze(0)
-            elif len(spectrogram.shape) == 3:
-                # Shape is (1, 256, 1292), add batch dimension
-                input_tensor = torch.FloatTensor(spectrogram).unsqueeze(0)
-            else:
-                # Already has batch dimension
-                input_tensor = torch.FloatTensor(spectrogram)
-            
-            print(f"Model input tensor shape: {input_tensor.shape}")
-            
-            # Move to device
-            input_tensor = input_tensor.to(self.device)
+            with metrics.timed("tensor_conversion"):
+                if len(spectrogram.shape) == 2:
+                    # Shape is (256, 1292), add batch and channel dimensions
+                    input_tensor = torch.FloatTensor(spectrogram).unsqueeze(0).unsqueeze(0)
+                elif len(spectrogram.shape) == 3:
+                    # Shape is (1, 256, 1292), add batch dimension
+                    input_tensor = torch.FloatTensor(spectrogram).unsqueeze(0)
+                else:
+                    # Already has batch dimension
+                    input_tensor = torch.FloatTensor(spectrogram)
             
             # Make prediction
-            with torch.no_grad():
-                prediction = self.model(input_tensor)  # [B, 8]
-                prediction = prediction.cpu().numpy()
-                
-                # Handle batch dimension
-                if prediction.shape[0] == 1:
-                    prediction = prediction[0]  # Get first batch item
+            with metrics.timed("model_forward"):
+                prediction = self._forward(input_tensor)  # [B, 8]
             
-            print(f"Raw prediction: {prediction}")
+            # Handle batch dimension
+            if prediction.shape[0] == 1:
+                prediction = prediction[0]  # Get first batch item
             
             # Rescale predictions to original range (1 to 7.83)
             emotions_rescaled = self.rescale(prediction)
-            print(f"Rescaled emotions: {emotions_rescaled}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Prediction", extra={
+                    "input_shape": tuple(input_tensor.shape),
+                    "raw": np.round(prediction, 4).tolist(),
+                    "rescaled": np.round(emotions_rescaled, 2).tolist(),
+                })
             
             # Create emotion dictionary
-            emotion_scores = {
-                label: round(float(score), 2) 
-                for label, score in zip(self.emotion_labels, emotions_rescaled)
-            }
+            emotion_scores = self._to_scores(emotions_rescaled)
             
             return emotion_scores
             
         except Exception as e:
-            print(f"❌ Prediction error: {str(e)}")
-            raise RuntimeError(f"Prediction failed: {str(e)}")
\ No newline at end of file
+            logger.error("Prediction failed", exc_info=True)
+            raise RuntimeError(f"Prediction failed: {str(e)}")
+    
+    def predict_batch(self, spectrograms: np.ndarray) -> List[dict]:
+        """
+        Predict emotions for a batch of spectrograms in a single forward pass
+        
+        Args:
+            spectrograms: numpy array of shape (B, 1, 256, 1292) or (B, 256, 1292)
+            
+        Returns:
+            list: one emotion score dict per batch item, in input order
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        
+        try:
+            with metrics.timed("tensor_conversion"):
+                input_tensor = torch.from_numpy(np.ascontiguousarray(spectrograms, dtype=np.float32))
+                if input_tensor.dim() == 3:
+                    # Shape is (B, 256, 1292), add channel dimension
+                    input_tensor = input_tensor.unsqueeze(1)
+            
+            with metrics.timed("model_forward"):
+                raw = self._forward(input_tensor)
+            predictions = self.rescale(raw)
+            return [self._to_scores(row) for row in predictions]
+            
+        except Exception as e:
+            logger.error("Batch prediction failed", exc_info=True, extra={"batch_shape": spectrograms.shape})
+            raise RuntimeError(f"Batch prediction failed: {str(e)}")
+    
+    def predict_with_embedding(self, spectrograms: np.ndarray) -> Tuple[List[dict], np.ndarray]:
+        """
+        Predict emotions and extract track embeddings in the same forward pass
+        
+        Embeddings always come from the torch model (the inference-optimized one
+        when available), whatever the serving backend: ONNX / int8 graphs only
+        output the scores, and the embeddings of a catalog must stay comparable
+        across backend changes.
+        
+        Args:
+            spectrograms: numpy array of shape (B, 1, 256, 1292), (B, 256, 1292) or (256, 1292)
+            
+        Returns:
+            tuple: (one emotion score dict per batch item, float32 embeddings of shape (B, 256))
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        
+        try:
+            with metrics.timed("tensor_conversion"):
+                input_tensor = torch.from_numpy(np.ascontiguousarray(spectrograms, dtype=np.float32))
+                if input_tensor.dim() == 2:
+                    input_tensor = input_tensor.unsqueeze(0)
+                if input_tensor.dim() == 3:
+                    # Shape is (B, 256, 1292), add channel dimension
+                    input_tensor = input_tensor.unsqueeze(1)
+            
+            with metrics.timed("model_forward"):
+                model = self._inference_model or self.model
+                with torch.no_grad():
+                    raw, embeddings = model.forward_with_embedding(input_tensor.to(self.device))
+            predictions = self.rescale(raw.cpu().numpy())
+            return [self._to_scores(row) for row in predictions], embeddings.cpu().numpy()
+            
+        except Exception as e:
+            logger.error("Embedding prediction failed", exc_info=True, extra={"batch_shape": spectrograms.shape})
+            raise RuntimeError(f"Embedding prediction failed: {str(e)}")
+    
+    def predict_timeline(self, windows: Iterable[Tuple[float, float, np.ndarray]], batch_size: int = 8,
+                         predict_fn: Optional[Callable[[np.ndarray], List[dict]]] = None) -> dict:
+        """
+        Predict emotions for a stream of analysis windows, batch by batch
+        
+        Args:
+            windows: iterable of (start seconds, end seconds, spectrogram (1, 256, 1292))
+            batch_size: windows per forward pass
+            predict_fn: batch prediction function, defaults to predict_batch
+                (lets callers route forward passes to a dedicated thread)
+            
+        Returns:
+            dict: per-window emotion series and the mean over all windows
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        predict_fn = predict_fn or self.predict_batch
+        
+        series = []
+        batch, spans = [], []
+        
+        def flush():
+            for (start, end), emotions in zip(spans, predict_fn(np.stack(batch))):
+                series.append({"start": start, "end": end, "emotions": emotions})
+            batch.clear()
+            spans.clear()
+        
+        # windows are consumed lazily, only one batch is held at a time
+        for start, end, spectrogram in windows:
+            batch.append(spectrogram)
+            spans.append((start, end))
+            if len(batch) == batch_size:
+                flush()
+        if batch:
+            flush()
+        
+        if not series:
+            raise RuntimeError("Track produced no analysis windows")
+        aggregate = {
+            label: round(float(np.mean([window["emotions"][label] for window in series])), 2)
+            for label in self.emotion_labels
+        }
+        return {"windows": series, "aggregate": aggregate}
+    
+    def _forward(self, input_tensor: torch.Tensor) -> np.ndarray:
+        """Run the model on a (B, 1, 256, 1292) tensor and return (B, 8) raw scores"""
+        if self._runner is not None:
+            return self._runner(input_tensor.cpu().numpy())
+        return self._torch_forward(input_tensor)
+    
+    def _torch_forward(self, input_tensor: torch.Tensor) -> np.ndarray:
+        input_tensor = input_tensor.to(self.device)
+        model = self._inference_model or self.model
+        with torch.no_grad():
+            prediction = model(input_tensor)
+        # the model squeezes away the batch dimension when B == 1
+        return prediction.cpu().numpy().reshape(-1, len(self.emotion_labels))
+    
+    def _to_scores(self, emotions_rescaled) -> dict:
+        """Map a vector of 8 rescaled scores to the emotion label dictionary"""
+        return {
+            label: round(float(score), 2)
+            for label, score in zip(self.emotion_labels, emotions_rescaled)
+        }
\ No newline at end of file
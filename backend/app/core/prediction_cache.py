@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def build_fingerprint(weights_fingerprint: str, preprocessing_params: dict) -> str:
+    """
+    Fingerprint of everything besides the audio that determines a prediction:
+    the loaded weights and the spectrogram parameters
+    """
+    payload = json.dumps({"weights": weights_fingerprint, "preprocessing": preprocessing_params},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _Inflight:
+    """A computation shared by every request for the same key, and how many are waiting on it"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of emotion predictions.
+
+    Entries are keyed by the SHA-256 of the uploaded audio bytes combined with
+    the model/preprocessing fingerprint, so new weights or new STFT parameters
+    never serve stale scores. Lookups go through a bounded in-memory LRU with TTL,
+    then an optional on-disk tier (one JSON file per entry) that survives restarts.
+    Identical concurrent uploads are computed once (single-flight).
+
+    Args:
+        max_entries: size of the in-memory LRU
+        ttl_seconds: lifetime of an entry, 0 keeps entries until evicted
+        disk_dir: directory of the persistent tier, None disables it
+    """
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 0,
+                 disk_dir: Optional[str] = None) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.fingerprint = ""
+
+        self._memory: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._inflight: Dict[str, _Inflight] = {}
+
+        # statistics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def set_fingerprint(self, fingerprint: str):
+        """Set the model/preprocessing fingerprint mixed into every key"""
+        self.fingerprint = fingerprint
+
+    def key(self, content: bytes) -> str:
+        """Cache key for a piece of encoded audio"""
+        digest = hashlib.sha256(content).hexdigest()
+        return hashlib.sha256(f"{self.fingerprint}:{digest}".encode()).hexdigest()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """
+        Return the cached prediction for key, computing it if needed
+
+        Args:
+            key: cache key from `key()`
+            compute: coroutine function producing the prediction on a miss
+
+        Returns:
+            tuple: (prediction, True if it was served from cache)
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return dict(value), True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # identical upload already being computed, share its result
+            self.coalesced += 1
+            value, _ = await self._wait(inflight)
+            return dict(value), True
+
+        # detached from the request that started it, so its disconnect doesn't fail the others
+        task = asyncio.create_task(self._lookup_or_compute(key, compute))
+        inflight = self._inflight[key] = _Inflight(task)
+        task.add_done_callback(lambda _: self._finish(key, inflight))
+        value, cached = await self._wait(inflight)
+        return dict(value), cached
+
+    async def _wait(self, inflight: "_Inflight") -> Tuple[dict, bool]:
+        """Await a shared computation; the last waiter to give up cancels it"""
+        inflight.waiters += 1
+        try:
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            if inflight.waiters == 0 and not inflight.task.done():
+                inflight.task.cancel()
+
+    async def _lookup_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        value = await asyncio.to_thread(self._get_disk, key) if self.disk_dir else None
+        cached = value is not None
+        if cached:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            value = await compute()
+            if self.disk_dir:
+                await asyncio.to_thread(self._put_disk, key, value)
+        self._put_memory(key, value)
+        return value, cached
+
+    def _finish(self, key: str, inflight: "_Inflight"):
+        if self._inflight.get(key) is inflight:
+            del self._inflight[key]
+        if not inflight.task.cancelled():
+            # waiters re-raise it; when they all left, nobody else needs to retrieve it
+            inflight.task.exception()
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl_seconds if self.ttl_seconds > 0 else float("inf")
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _put_memory(self, key: str, value: dict):
+        self._memory[key] = (self._expires_at(), value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _get_disk(self, key: str) -> Optional[dict]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        expires_at = entry.get("expires_at")
+        if expires_at is not None and expires_at < time.time():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return entry["value"]
+
+    def _put_disk(self, key: str, value: dict):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        expires_at = self._expires_at()
+        entry = {"expires_at": None if expires_at == float("inf") else expires_at, "value": value}
+        # write then rename so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to write cache entry", extra={"key": key, "error": str(e)})
+
+    def clear(self):
+        """Drop all in-memory entries (the disk tier is kept)"""
+        self._memory.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss statistics collected since startup"""
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_tier": bool(self.disk_dir),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,103 @@
+import cProfile
+import io
+import linecache
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+# one profiled request at a time: tracemalloc is process-wide and both profilers slow everything down
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when another request is already being profiled"""
+
+
+def _cpu_report(profiler: cProfile.Profile, top: int) -> Tuple[list, str]:
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    functions = []
+    for (filename, line, name), (_, calls, total, cumulative, _) in stats.stats.items():
+        functions.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "total_seconds": round(total, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        })
+    functions.sort(key=lambda f: f["cumulative_seconds"], reverse=True)
+
+    # the familiar pstats table as well, for pasting into an issue
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return functions[:top], text.getvalue()
+
+
+def _allocation_report(snapshot: tracemalloc.Snapshot, top: int) -> list:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    allocations = []
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        allocations.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "code": linecache.getline(frame.filename, frame.lineno).strip(),
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        })
+    return allocations
+
+
+def profile_call(fn: Callable, *args, top: int = 30):
+    """
+    Run fn(*args) under cProfile and tracemalloc
+
+    cProfile only sees the calling thread, so fn should do all of its work
+    synchronously in that thread. tracemalloc is process-wide: allocations of
+    requests served at the same time show up in the allocation report too.
+
+    Args:
+        fn: the work to profile
+        top: number of functions / allocation sites to report
+
+    Returns:
+        tuple: (fn's return value, report dict with wall time, cpu and allocation profiles)
+
+    Raises:
+        ProfilerBusyError: another profile is running
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("Another request is being profiled, retry shortly")
+    try:
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                result = fn(*args)
+            finally:
+                profiler.disable()
+            wall_seconds = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not already_tracing:
+                tracemalloc.stop()
+
+        functions, text = _cpu_report(profiler, top)
+        return result, {
+            "wall_seconds": round(wall_seconds, 4),
+            "peak_traced_memory_kb": round(peak / 1024, 1),
+            "cpu": functions,
+            "cpu_text": text,
+            "allocations": _allocation_report(snapshot, top),
+        }
+    finally:
+        _profile_lock.release()
\ No newline at end of file
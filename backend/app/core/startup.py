@@ -0,0 +1,105 @@
+import asyncio
+import io
+import time
+import wave
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class StartupState:
+    """
+    Tracks server startup: time spent per phase, whether the model is loaded,
+    whether warm-up finished, and the error that stopped startup if any.
+    Backs the liveness and readiness endpoints.
+    """
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.model_loaded = False
+        self.warmed_up = False
+        self.ready = False
+        self.error: Optional[str] = None
+        self.startup_seconds: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a startup phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 3)
+
+    def mark_ready(self):
+        self.ready = True
+        self.startup_seconds = round(time.perf_counter() - self._start, 3)
+
+    def mark_failed(self, error: str):
+        self.ready = False
+        self.error = error
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "model_loaded": self.model_loaded,
+            "warmed_up": self.warmed_up,
+            "error": self.error,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "startup_seconds": self.startup_seconds,
+            "phases": dict(self.phases),
+        }
+
+
+startup_state = StartupState()
+
+
+def synthetic_audio(seconds: float, sample_rate: int = 22050) -> bytes:
+    """A chord plus noise encoded as 16-bit stereo WAV, at a rate other than sample_rate"""
+    # two channels and another rate, so warm-up also exercises down-mixing and resampling
+    rate = 44100 if sample_rate != 44100 else 48000
+    t = np.arange(int(seconds * rate)) / rate
+    rng = np.random.default_rng(0)
+    signal = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.2, 329.6)) / 4
+    signal = signal + 0.05 * rng.standard_normal(len(t))
+    pcm = (np.clip(signal, -1, 1) * 32767).astype('<i2')
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(pcm, 2).tobytes())
+    return buffer.getvalue()
+
+
+async def warm_up(model_handler, worker_pool, batch_scheduler, state: StartupState,
+                  preprocess_workers: int, batch_size: int, duration: float, hop_seconds: float):
+    """
+    Send synthetic audio through the serving paths so first requests don't pay
+    for lazy imports, JIT compilation and kernel initialisation:
+
+    - decode + STFT in every preprocessing worker
+    - a single request through the batching queue and the inference thread
+    - a full batch forward pass (other batch sizes pick different kernels)
+    - the streaming decode + STFT in a worker used by the timeline endpoint
+    """
+    audio = synthetic_audio(duration)
+
+    with state.phase("warmup_preprocess"):
+        # one task per worker process so each one imports and compiles its stack
+        spectrograms = await asyncio.gather(
+            *(worker_pool.process_audio(audio, ".wav") for _ in range(max(1, preprocess_workers)))
+        )
+
+    with state.phase("warmup_inference"):
+        await batch_scheduler.submit(spectrograms[0])
+        full_batch = np.repeat(spectrograms[0], batch_size, axis=0)
+        await worker_pool.run_inference(model_handler.predict_batch, full_batch)
+
+    with state.phase("warmup_timeline"):
+        def all_windows():
+            return sum(1 for _ in worker_pool.iter_windows(audio, ".wav", hop_seconds, batch_size))
+        await asyncio.to_thread(all_windows)
@@ -0,0 +1,423 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = "vector-index-v1"
+# vectors per list needed before k-means gives usable IVF lists
+MIN_VECTORS_PER_LIST = 40
+# k-means runs on at most this many vectors per list
+TRAIN_VECTORS_PER_LIST = 256
+# rows scored at once when assigning vectors to lists, bounds the temporary score matrix
+_ASSIGN_CHUNK = 65536
+
+
+class TrackNotFoundError(KeyError):
+    """Raised when a track id is not in the index"""
+
+
+def normalize(vectors) -> np.ndarray:
+    """L2-normalized float32 rows, so inner products are cosine similarities"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _InvertedList:
+    """Ids and vectors of one list, stored contiguously and grown by doubling"""
+    def __init__(self, dim: int, vectors: Optional[np.ndarray] = None, ids: Optional[List[str]] = None) -> None:
+        self.vectors = vectors if vectors is not None else np.empty((0, dim), dtype=np.float32)
+        self.ids = ids if ids is not None else []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, track_id: str, vector: np.ndarray) -> int:
+        row = len(self.ids)
+        if row == len(self.vectors):
+            grown = np.empty((max(16, 2 * row), self.vectors.shape[1]), dtype=np.float32)
+            grown[:row] = self.vectors[:row]
+            self.vectors = grown
+        self.vectors[row] = vector
+        self.ids.append(track_id)
+        return row
+
+    def remove(self, row: int) -> Optional[str]:
+        """Remove a row by moving the last one into its place, returns the moved id"""
+        last = len(self.ids) - 1
+        moved = None
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.ids[row] = moved = self.ids[last]
+        self.ids.pop()
+        return moved
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        return self.vectors[:len(self.ids)] @ query
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (highest cosine similarity) of every row"""
+    return np.concatenate([
+        np.argmax(vectors[start:start + _ASSIGN_CHUNK] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), _ASSIGN_CHUNK)
+    ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Spherical k-means: centroids are unit vectors, points go to the most similar one"""
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        # empty lists restart from a random point instead of staying empty
+        empty = np.bincount(assignment, minlength=k) == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Cosine-similarity nearest-neighbour index over track embeddings.
+
+    Vectors are L2-normalized on insert and kept in numpy arrays. Until it is
+    trained the index is a single flat list searched exhaustively. Training
+    (k-means into `nlist` lists, IVF) makes approximate search scan only the
+    `nprobe` lists whose centroids are closest to the query; exact search is
+    still available. Training happens on its own, in a background thread, once
+    the index holds MIN_VECTORS_PER_LIST vectors per list, or explicitly with
+    `train()`. Inserts, replacements, removals and searches work before, during
+    and after training: k-means runs on a snapshot outside the lock, the lists
+    are swapped in at the end.
+
+    Args:
+        dim: embedding size
+        nlist: number of IVF lists, 0 keeps the index flat (exact search only)
+        nprobe: lists scanned per approximate query
+        fingerprint: identifies the weights that produced the embeddings
+    """
+    def __init__(self, dim: int = 256, nlist: int = 0, nprobe: int = 16, fingerprint: str = "") -> None:
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.fingerprint = fingerprint
+        self.centroids: Optional[np.ndarray] = None
+        self.dirty = False
+
+        self._lists = [_InvertedList(dim)]
+        self._where: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.RLock()
+        # one training at a time; ids changed while it runs are re-placed when its lists are swapped in
+        self._train_lock = threading.Lock()
+        self._changed_while_training: Optional[set] = None
+        self._trainer: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._where
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, ids: Sequence[str], vectors) -> None:
+        """
+        Insert vectors, replacing those of ids already in the index
+
+        Args:
+            ids: track ids
+            vectors: array of shape (len(ids), dim)
+        """
+        vectors = self._check(vectors)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors")
+        with self._lock:
+            lists = _assign(vectors, self.centroids) if self.trained else np.zeros(len(ids), dtype=np.int64)
+            for track_id, vector, list_no in zip(ids, vectors, lists):
+                if track_id in self._where:
+                    self._remove(track_id)
+                row = self._lists[list_no].append(track_id, vector)
+                self._where[track_id] = (int(list_no), row)
+                self._mark_changed(track_id)
+            self.dirty = True
+
+            if self.nlist and not self.trained and len(self) >= self.nlist * MIN_VECTORS_PER_LIST:
+                self._train_in_background()
+
+    def remove(self, track_id: str) -> bool:
+        """Remove a track, returns False if it was not in the index"""
+        with self._lock:
+            if track_id not in self._where:
+                return False
+            self._remove(track_id)
+            self._mark_changed(track_id)
+            self.dirty = True
+            return True
+
+    def _mark_changed(self, track_id: str):
+        if self._changed_while_training is not None:
+            self._changed_while_training.add(track_id)
+
+    def _remove(self, track_id: str):
+        list_no, row = self._where.pop(track_id)
+        moved = self._lists[list_no].remove(row)
+        if moved is not None:
+            self._where[moved] = (list_no, row)
+
+    def get(self, track_id: str) -> np.ndarray:
+        """Stored (normalized) vector of a track"""
+        with self._lock:
+            if track_id not in self._where:
+                raise TrackNotFoundError(track_id)
+            list_no, row = self._where[track_id]
+            return self._lists[list_no].vectors[row].copy()
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """
+        Cluster the indexed vectors into `nlist` lists (k-means on a sample of
+        them) and redistribute every vector into its list
+
+        Clustering runs on a snapshot without holding the index lock, so
+        searches and updates go on meanwhile; vectors added, replaced or
+        removed in the meantime are placed in the new lists when they are
+        swapped in.
+
+        Args:
+            iterations: k-means iterations
+            seed: sampling / initialisation seed
+        """
+        if not self.nlist:
+            raise ValueError("nlist is 0, the index is flat")
+        with self._train_lock:
+            with self._lock:
+                ids, vectors = self._all()
+                nlist = self.nlist
+                self._changed_while_training = set()
+            try:
+                if len(ids) < nlist:
+                    raise ValueError(f"Training {nlist} lists needs at least as many vectors, got {len(ids)}")
+                rng = np.random.default_rng(seed)
+                sample_size = min(len(ids), nlist * TRAIN_VECTORS_PER_LIST)
+                sample = vectors[rng.choice(len(ids), sample_size, replace=False)]
+                centroids = _kmeans(sample, nlist, iterations, rng)
+                assignment = _assign(vectors, centroids)
+            except BaseException:
+                with self._lock:
+                    self._changed_while_training = None
+                raise
+
+            with self._lock:
+                changed, self._changed_while_training = self._changed_while_training, None
+                if changed:
+                    # drop the snapshot rows of changed ids, take their current vectors instead
+                    keep = [i for i, track_id in enumerate(ids) if track_id not in changed]
+                    current = [track_id for track_id in changed if track_id in self._where]
+                    current_vectors = np.stack([self.get(track_id) for track_id in current]) if current \
+                        else np.empty((0, self.dim), dtype=np.float32)
+                    ids = [ids[i] for i in keep] + current
+                    vectors = np.concatenate([vectors[keep], current_vectors])
+                    assignment = np.concatenate([assignment[keep], _assign(current_vectors, centroids)])
+                self._rebuild(ids, vectors, assignment, nlist)
+                self.centroids = centroids
+                self.dirty = True
+        logger.info("Trained vector index", extra={
+            "vectors": len(ids), "lists": nlist, "sample": sample_size, "iterations": iterations,
+            "changed_while_training": len(changed)
+        })
+
+    def _train_in_background(self):
+        """Start training in a daemon thread unless it is already running (called with the lock held)"""
+        if self._trainer is not None and self._trainer.is_alive():
+            return
+        self._trainer = threading.Thread(target=self._auto_train, name="vector-index-train", daemon=True)
+        self._trainer.start()
+
+    def _auto_train(self):
+        try:
+            if not self.trained:
+                self.train()
+        except Exception as e:
+            logger.error("Vector index training failed", extra={"error": str(e)})
+
+    def join_training(self, timeout: Optional[float] = None) -> bool:
+        """Wait for background training, returns False if it is still running after timeout"""
+        trainer = self._trainer
+        if trainer is not None:
+            trainer.join(timeout)
+            return not trainer.is_alive()
+        return True
+
+    def _rebuild(self, ids: List[str], vectors: np.ndarray, assignment: np.ndarray, nlists: int):
+        """Fill `nlists` lists from every vector and its list number"""
+        order = np.argsort(assignment, kind="stable")
+        sizes = np.bincount(assignment, minlength=nlists)
+        self._lists, self._where = [], {}
+        start = 0
+        for list_no, size in enumerate(sizes):
+            rows = order[start:start + size]
+            start += size
+            list_ids = [ids[i] for i in rows]
+            self._lists.append(_InvertedList(self.dim, vectors[rows], list_ids))
+            self._where.update((track_id, (list_no, row)) for row, track_id in enumerate(list_ids))
+
+    def _all(self) -> Tuple[List[str], np.ndarray]:
+        ids = [track_id for inverted in self._lists for track_id in inverted.ids]
+        vectors = np.concatenate([inverted.vectors[:len(inverted)] for inverted in self._lists])
+        return ids, vectors
+
+    def search(self, query, k: int = 10, exact: bool = False, nprobe: Optional[int] = None,
+               exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Most similar tracks to a query embedding
+
+        Args:
+            query: embedding of shape (dim,)
+            k: number of results
+            exact: scan every vector instead of the nprobe closest lists
+            nprobe: lists scanned, defaults to the index setting
+            exclude: track id left out of the results (e.g. the query track itself)
+
+        Returns:
+            list: (track id, cosine similarity) pairs, most similar first
+        """
+        query = self._check(query)[0]
+        wanted = k + (exclude is not None)
+        candidates_ids, candidates_scores = [], []
+        with self._lock:
+            if exact or not self.trained:
+                probed = self._lists
+            else:
+                nprobe = min(nprobe or self.nprobe, self.nlist)
+                closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+                probed = [self._lists[list_no] for list_no in closest]
+            for inverted in probed:
+                if not len(inverted):
+                    continue
+                scores = inverted.scores(query)
+                # each list contributes at most its own top k
+                top = np.argpartition(-scores, wanted - 1)[:wanted] if len(scores) > wanted else np.arange(len(scores))
+                candidates_ids.extend(inverted.ids[i] for i in top)
+                candidates_scores.append(scores[top])
+        if not candidates_ids:
+            return []
+
+        scores = np.concatenate(candidates_scores)
+        results = []
+        for i in np.argsort(-scores, kind="stable"):
+            if candidates_ids[i] != exclude:
+                results.append((candidates_ids[i], round(float(scores[i]), 6)))
+                if len(results) == k:
+                    break
+        return results
+
+    def _check(self, vectors) -> np.ndarray:
+        vectors = normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of size {self.dim}, got {vectors.shape[1]}")
+        return vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = [len(inverted) for inverted in self._lists]
+            return {
+                "vectors": len(self),
+                "dim": self.dim,
+                "trained": self.trained,
+                "lists": len(self._lists),
+                "nprobe": self.nprobe if self.trained else None,
+                "largest_list": max(sizes),
+                "memory_mb": round(sum(inverted.vectors.nbytes for inverted in self._lists) / 2 ** 20, 1),
+            }
+
+    def save(self, path: str):
+        """Write the index to a .npz file (written then renamed, so readers never see a partial file)"""
+        with self._lock:
+            ids, vectors = self._all()
+            sizes = np.array([len(inverted) for inverted in self._lists], dtype=np.int64)
+            centroids = self.centroids if self.trained else np.empty((0, self.dim), dtype=np.float32)
+            dirty = self.dirty
+            self.dirty = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, format=np.array(INDEX_FORMAT), dim=np.array(self.dim), nlist=np.array(self.nlist),
+                         nprobe=np.array(self.nprobe), fingerprint=np.array(self.fingerprint),
+                         centroids=centroids, list_sizes=sizes, ids=np.array(ids, dtype=str), vectors=vectors)
+            os.replace(tmp_path, path)
+        except Exception:
+            self.dirty = self.dirty or dirty
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logger.info("Saved vector index", extra={"path": path, "vectors": len(ids)})
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Read an index written by `save`"""
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["format"]) != INDEX_FORMAT:
+                raise ValueError(f"{path} is not a vector index ({INDEX_FORMAT})")
+            index = cls(int(data["dim"]), int(data["nlist"]), int(data["nprobe"]), str(data["fingerprint"]))
+            ids = data["ids"].tolist()
+            vectors = data["vectors"]
+            sizes = data["list_sizes"]
+            if len(data["centroids"]):
+                index.centroids = data["centroids"]
+        index._rebuild(ids, vectors, np.repeat(np.arange(len(sizes)), sizes), len(sizes))
+        return index
+
+
+class ServingLock:
+    """
+    Detects other processes serving the same index file.
+
+    Every serving process holds a shared POSIX lock on `<path>.lock` for as
+    long as it serves the index. Changing the index takes the lock exclusively,
+    which only succeeds when no other process holds it: otherwise (several
+    uvicorn workers, or a second server on the same INDEX_PATH) each process
+    has its own copy, and a change would reach one of them only. POSIX locks
+    belong to the process, are released when it exits, and a shared -> exclusive
+    conversion that fails keeps the shared lock.
+
+    Args:
+        path: index file
+    """
+    def __init__(self, path: str) -> None:
+        import fcntl
+
+        self._fcntl = fcntl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(f"{path}.lock", "a+")
+        # blocks only while another process holds it exclusively, i.e. during one of its writes
+        fcntl.lockf(self._file, fcntl.LOCK_SH)
+
+    @contextmanager
+    def exclusive(self):
+        """Yields True while this process is the only one serving the index, False if it isn't"""
+        try:
+            self._fcntl.lockf(self._file, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._fcntl.lockf(self._file, self._fcntl.LOCK_SH)
+
+    def close(self):
+        self._file.close()
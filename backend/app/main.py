@@ -1,25 +1,95 @@
+import time
+_import_start = time.perf_counter()
+
+import asyncio
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
-from app.api.routes import health, prediction
+from app.core.log import configure_logging
+from app.core.model_handler import configure_torch_threads
+from app.core.audio_processor import preprocessing_params
+from app.core.prediction_cache import build_fingerprint
+from app.core.startup import startup_state, warm_up
+from app.core.metrics import MetricsMiddleware
+from app.utils.upload import MULTIPART_OVERHEAD, RequestSizeLimitMiddleware
+from app.api.routes import admin, health, jobs, metrics, prediction, similar
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
+startup_state.phases["imports"] = round(time.perf_counter() - _import_start, 3)
+
+configure_logging(settings.log_level, settings.log_format)
+logger = logging.getLogger(__name__)
+
+
+async def startup():
+    """Load, start and warm up everything; the server is ready once this returns"""
     try:
-        # Load model on startup through the prediction router
-        prediction.model_handler.load_model(settings.model_path)
-        print("🚀 Server started successfully!")
+        threads = configure_torch_threads(settings.api_workers, settings.torch_threads)
+        logger.info("Configured torch threads", extra={"torch_threads": threads, "api_workers": settings.api_workers})
+        
+        with startup_state.phase("load_model"):
+            # Load model on startup through the prediction router
+            await asyncio.to_thread(prediction.model_handler.load_model, settings.model_path)
+        startup_state.model_loaded = True
+        prediction.prediction_cache.set_fingerprint(
+            build_fingerprint(prediction.model_handler.fingerprint, preprocessing_params())
+        )
+        
+        with startup_state.phase("load_index"):
+            try:
+                index = await asyncio.to_thread(
+                    similar.load_index, prediction.model_handler.weights_fingerprint,
+                    prediction.model_handler.model.head.in_features
+                )
+                logger.info("Similarity index ready", extra={"tracks": len(index)})
+            except Exception as e:
+                # /similar answers 503, everything else is served
+                logger.warning("Similarity index unavailable", extra={"error": str(e)})
+        
+        with startup_state.phase("start_workers"):
+            prediction.worker_pool.start()
+            await prediction.batch_scheduler.start()
+            await jobs.job_manager.start()
+        
+        if settings.warmup_enabled:
+            await warm_up(
+                prediction.model_handler, prediction.worker_pool, prediction.batch_scheduler, startup_state,
+                preprocess_workers=settings.preprocess_workers,
+                batch_size=settings.batch_max_size,
+                duration=settings.duration,
+                hop_seconds=settings.timeline_hop_seconds,
+            )
+            startup_state.warmed_up = True
+        
+        startup_state.mark_ready()
+        logger.info("Server ready", extra={"startup_seconds": startup_state.startup_seconds,
+                                            "phases": startup_state.phases})
     except Exception as e:
-        print(f"❌ Failed to start server: {str(e)}")
-        raise
+        logger.error("Failed to start server", exc_info=True)
+        startup_state.mark_failed(str(e))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup runs in the background: liveness answers right away,
+    # readiness only once the model is loaded and warmed up
+    startup_task = asyncio.create_task(startup())
     
     yield
     
     # Shutdown
-    print("🛑 Server shutting down...")
+    startup_task.cancel()
+    await asyncio.gather(startup_task, return_exceptions=True)
+    await jobs.job_manager.stop()
+    await prediction.batch_scheduler.stop()
+    prediction.worker_pool.shutdown()
+    try:
+        await asyncio.to_thread(similar.save_index)
+    except Exception as e:
+        logger.error("Failed to save similarity index", extra={"error": str(e)})
+    logger.info("Server shut down")
 
 # Initialize FastAPI app with lifespan
 app = FastAPI(
@@ -38,9 +108,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized bodies while they are still arriving: one file (plus multipart framing)
+# per request, except on the routes taking several files or archives
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_bytes=settings.max_file_size + MULTIPART_OVERHEAD,
+    path_limits={"/predict/batch": settings.max_request_size, "/jobs": settings.max_request_size},
+)
+
+# Request counts, latency and in-flight requests (outermost, so rejected requests are counted too)
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(health.router)
 app.include_router(prediction.router)
+app.include_router(jobs.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
+app.include_router(similar.router)
 
 @app.get("/")
 async def root():
@@ -50,11 +135,25 @@ async def root():
         "version": settings.api_version,
         "endpoints": {
             "predict": "POST /predict - Upload audio file to get emotion predictions",
-            "health": "GET /health - Check API health"
+            "batch": "POST /predict/batch - Upload many audio files or a zip archive, one result per file",
+            "timeline": "POST /predict/timeline - Emotion scores for overlapping 15s windows over the whole track",
+            "embedding": "POST /predict/embedding - Emotion scores plus the 256-d track embedding",
+            "similar": "POST /similar - Most emotionally similar indexed tracks to an upload, GET /similar/tracks/{id} to an indexed track",
+            "index": "PUT /similar/tracks/{id} - Add or replace a track in the similarity index, DELETE to remove it",
+            "stats": "GET /predict/stats - Batching, worker pool and cache statistics",
+            "jobs": "POST /jobs - Queue a predict/timeline job, GET /jobs/{id} for status and result, DELETE to cancel",
+            "metrics": "GET /metrics - Request, per-stage latency, batching and cache metrics (Prometheus)",
+            "profile": "POST /admin/profile - CPU and allocation profile of one prediction (PROFILING_ENABLED)",
+            "health": "GET /health - Check API health",
+            "live": "GET /health/live - Liveness (process up, startup not failed)",
+            "ready": "GET /health/ready - Readiness (model loaded and warmed up) with startup phase timings"
         }
     }
 
 if __name__ == "__main__":
     import uvicorn
     print("Starting Music Emotion Recognition API...")
-    uvicorn.run("app.main:app", host=settings.api_host, port=settings.api_port, reload=settings.debug)
\ No newline at end of file
+    # several worker processes map the same weights file; reload only supports one
+    workers = 1 if settings.debug else settings.api_workers
+    uvicorn.run("app.main:app", host=settings.api_host, port=settings.api_port, reload=settings.debug,
+                workers=workers)
\ No newline at end of file
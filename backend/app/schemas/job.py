@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str  # queued, running, succeeded, failed, cancelled
+    filename: Optional[str] = None
+    params: Dict[str, Any] = {}
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
\ No newline at end of file
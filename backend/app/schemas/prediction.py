@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, List, Optional
 
 class EmotionScores(BaseModel):
     valence: float
@@ -16,4 +16,41 @@ class PredictionResponse(BaseModel):
     filename: str
     emotions: EmotionScores
     processing_time: float
-    message: str = "Emotion prediction completed successfully"
\ No newline at end of file
+    message: str = "Emotion prediction completed successfully"
+
+class EmbeddingResponse(BaseModel):
+    success: bool
+    filename: str
+    emotions: EmotionScores
+    embedding: List[float]  # 256-d pooled features the scores are computed from
+    processing_time: float
+
+class BatchItemResult(BaseModel):
+    filename: str
+    success: bool
+    emotions: Optional[EmotionScores] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    success: bool
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+    processing_time: float
+    message: str = "Batch emotion prediction completed"
+
+class TimelineWindow(BaseModel):
+    start: float
+    end: float
+    emotions: EmotionScores
+
+class TimelineResponse(BaseModel):
+    success: bool
+    filename: str
+    window_seconds: float
+    hop_seconds: float
+    windows: List[TimelineWindow]
+    aggregate: EmotionScores
+    processing_time: float
+    message: str = "Emotion timeline completed successfully"
\ No newline at end of file
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from app.schemas.prediction import EmotionScores
+
+class SimilarTrack(BaseModel):
+    track_id: str
+    similarity: float  # cosine similarity of the embeddings, 1.0 is identical
+
+class SimilarResponse(BaseModel):
+    success: bool
+    query: str  # uploaded filename or indexed track id
+    emotions: Optional[EmotionScores] = None
+    exact: bool
+    results: List[SimilarTrack]
+    search_ms: float
+    processing_time: float
+
+class IndexedTrackResponse(BaseModel):
+    success: bool
+    track_id: str
+    emotions: EmotionScores
+    replaced: bool
+    index_size: int
\ No newline at end of file
@@ -0,0 +1,373 @@
+import io
+import os
+import struct
+import zipfile
+import zlib
+from typing import Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException, UploadFile
+
+
+class UploadError(Exception):
+    """Upload rejected before decoding (too large, unsupported or corrupt)"""
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class TooManyFilesError(UploadError):
+    """More files in one request than accepted, rejects the whole request"""
+    def __init__(self, max_files: int) -> None:
+        super().__init__(413, f"Too many files, at most {max_files} are accepted per request")
+
+
+# MPEG audio bitrates in kbps, by (mpeg1?, layer)
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# multipart boundaries, part headers and small form fields on top of a single file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# safety margin on top of the estimated compressed size of the analysis window
+_ESTIMATE_MARGIN = 1.25
+_ESTIMATE_SLACK = 64 * 1024
+
+
+def _id3_size(header: bytes) -> int:
+    """Size of a leading ID3v2 tag (0 if there is none)"""
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    # footer present
+    if header[5] & 0x10:
+        size += 10
+    return 10 + size
+
+
+def _mp3_frame(header: bytes, offset: int) -> Optional[Tuple[bool, int, int]]:
+    """Parse the MPEG frame header at offset: (mpeg1, layer, bitrate index) or None"""
+    if offset + 4 > len(header):
+        return None
+    b1, b2, b3 = header[offset + 1], header[offset + 2], header[offset + 3]
+    if header[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    # reserved values mean this is not a frame header
+    if version == 1 or layer == 4 or bitrate_index == 15 or sample_rate_index == 3:
+        return None
+    return version == 3, layer, bitrate_index
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """
+    Identify the container from the first bytes of an upload
+
+    Returns:
+        str: extension of the detected format ('.wav', '.flac', '.ogg', '.mp3', '.m4a') or None
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return '.wav'
+    if header[:4] == b'fLaC':
+        return '.flac'
+    if header[:4] == b'OggS':
+        return '.ogg'
+    if header[4:8] == b'ftyp':
+        return '.m4a'
+    id3_size = _id3_size(header)
+    if id3_size:
+        # tag could be followed by anything, the frame may also lie past the first chunk
+        frame = _mp3_frame(header, id3_size)
+        if frame is not None or id3_size + 4 > len(header):
+            return '.mp3'
+        return None
+    if _mp3_frame(header, 0) is not None:
+        return '.mp3'
+    return None
+
+
+def _wav_bytes_needed(header: bytes, seconds: float) -> Optional[int]:
+    offset = 12
+    byte_rate = None
+    while offset + 8 <= len(header):
+        chunk_id = header[offset:offset + 4]
+        chunk_size = struct.unpack('<I', header[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ' and offset + 20 <= len(header):
+            byte_rate = struct.unpack('<I', header[offset + 16:offset + 20])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            return offset + 8 + int(byte_rate * seconds)
+        # chunks are word aligned
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _mp3_bytes_needed(header: bytes, seconds: float) -> int:
+    id3_size = _id3_size(header)
+    frame = _mp3_frame(header, id3_size)
+    if frame is None:
+        # frame header beyond the first chunk, bound by the highest MPEG-1 layer III bitrate
+        kbps = 320
+    else:
+        mpeg1, layer, bitrate_index = frame
+        table = _MP3_BITRATES[(mpeg1, layer)]
+        frame_start = header[id3_size:id3_size + 200]
+        if bitrate_index == 0 or b'Xing' in frame_start or b'VBRI' in frame_start:
+            # free format or VBR: no constant rate, use the highest one of this layer
+            kbps = max(table)
+        else:
+            kbps = table[bitrate_index]
+    return id3_size + int(kbps * 1000 / 8 * seconds)
+
+
+def _flac_bytes_needed(header: bytes, seconds: float) -> Optional[int]:
+    # walk metadata block headers to find where audio frames start
+    offset = 4
+    sample_rate = channels = bits_per_sample = None
+    while offset + 4 <= len(header):
+        is_last = header[offset] & 0x80
+        block_type = header[offset] & 0x7F
+        length = int.from_bytes(header[offset + 1:offset + 4], 'big')
+        if block_type == 0 and offset + 4 + 18 <= len(header):
+            info = int.from_bytes(header[offset + 4 + 10:offset + 4 + 18], 'big')
+            sample_rate = info >> 44
+            channels = ((info >> 41) & 0x07) + 1
+            bits_per_sample = ((info >> 36) & 0x1F) + 1
+        offset += 4 + length
+        if is_last:
+            if not sample_rate:
+                return None
+            # FLAC frames are never meaningfully larger than the raw PCM they encode
+            return offset + int(sample_rate * channels * bits_per_sample / 8 * seconds)
+    return None
+
+
+def estimate_bytes_needed(header: bytes, file_format: str, seconds: float) -> Optional[int]:
+    """
+    Upper estimate of how many bytes of the upload cover the first `seconds` of audio
+
+    Returns:
+        int: byte count, or None when it can't be bounded (the whole upload is needed)
+    """
+    if file_format == '.wav':
+        needed = _wav_bytes_needed(header, seconds)
+    elif file_format == '.mp3':
+        needed = _mp3_bytes_needed(header, seconds)
+    elif file_format == '.flac':
+        needed = _flac_bytes_needed(header, seconds)
+    else:
+        # ogg pages and mp4 boxes (moov may sit at the end) need the whole file
+        needed = None
+    if needed is None:
+        return None
+    return int(needed * _ESTIMATE_MARGIN) + _ESTIMATE_SLACK
+
+
+def _too_large(max_bytes: int) -> UploadError:
+    return UploadError(413, f"File too large, the limit is {max_bytes // (1024 * 1024)}MB")
+
+
+class _IngestBuffer:
+    """
+    Accumulates the chunks of one upload: sniffs the format from the first chunk,
+    enforces the size limit and tells when enough bytes have been read
+    """
+    def __init__(self, max_bytes: int, analysis_seconds: Optional[float] = None, audio: bool = True) -> None:
+        self.max_bytes = max_bytes
+        self.analysis_seconds = analysis_seconds
+        self.audio = audio
+        self.file_format = None
+        self.bytes_needed = None
+        self.content = bytearray()
+
+    def feed(self, chunk: bytes) -> bool:
+        """Add a chunk, returns True once no more data is needed"""
+        if not self.content and self.audio:
+            self.file_format = sniff_format(chunk)
+            if self.file_format is None:
+                raise UploadError(415, "Unrecognised or corrupt audio file")
+            if self.analysis_seconds is not None:
+                self.bytes_needed = estimate_bytes_needed(chunk, self.file_format, self.analysis_seconds)
+        self.content.extend(chunk)
+        if len(self.content) > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        return self.bytes_needed is not None and len(self.content) >= self.bytes_needed
+
+    def result(self) -> Tuple[bytes, Optional[str]]:
+        if not self.content:
+            raise UploadError(400, "Uploaded file is empty")
+        return bytes(self.content), self.file_format
+
+
+def _upload_size(file: UploadFile) -> int:
+    """Size of the spooled upload, without reading it"""
+    if getattr(file, "size", None) is not None:
+        return file.size
+    # older Starlette doesn't record it: measure the spooled file
+    position = file.file.tell()
+    size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(position)
+    return size
+
+
+async def read_upload(file: UploadFile, max_bytes: int, analysis_seconds: Optional[float] = None,
+                      chunk_size: int = 64 * 1024, audio: bool = True) -> Tuple[bytes, Optional[str]]:
+    """
+    Read an uploaded audio file chunk by chunk
+
+    Starlette has spooled the whole multipart part (to memory or a temp file) before
+    the handler runs, so the per-file limit is checked against its size up front; the
+    network and the spool are bounded by RequestSizeLimitMiddleware (to about
+    `max_bytes` on single-file routes). The container is
+    sniffed from the first chunk so unsupported or corrupt uploads are rejected before
+    anything is decoded. When `analysis_seconds` is given only the bytes covering that
+    window are copied out of the spool.
+
+    Args:
+        file: uploaded file
+        max_bytes: largest accepted upload
+        analysis_seconds: seconds of audio needed from the start, None reads everything
+        chunk_size: bytes per read
+        audio: sniff the audio format, False reads any content (e.g. archives)
+
+    Returns:
+        tuple: (content, extension of the sniffed format, None when audio=False)
+    """
+    if _upload_size(file) > max_bytes:
+        raise _too_large(max_bytes)
+    buffer = _IngestBuffer(max_bytes, analysis_seconds, audio)
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk or buffer.feed(chunk):
+            break
+    return buffer.result()
+
+
+def _skip_archive_member(info: zipfile.ZipInfo) -> bool:
+    # directories and OS metadata (macOS resource forks, dotfiles)
+    base_name = os.path.basename(info.filename)
+    return info.is_dir() or info.filename.startswith('__MACOSX/') or base_name.startswith('.')
+
+
+def read_zip_members(archive: bytes, max_bytes: int, analysis_seconds: Optional[float] = None,
+                     chunk_size: int = 64 * 1024, max_members: Optional[int] = None
+                     ) -> List[Tuple[str, Union[Tuple[bytes, str], UploadError]]]:
+    """
+    Read the audio files of a zip archive with the same checks as single uploads
+
+    The declared size of each member is checked against the per-file limit and
+    members are decompressed chunk by chunk, so a forged declared size can't smuggle
+    a zip bomb past it; like read_upload(), only the analysed window is decompressed
+    when `analysis_seconds` is given (the size checks still apply to what is read).
+
+    Args:
+        archive: zip file content
+        max_bytes: largest accepted member (uncompressed)
+        analysis_seconds: seconds of audio needed from the start, None reads everything
+        chunk_size: bytes per read
+        max_members: most audio members accepted
+
+    Returns:
+        list: (member name, (content, extension) or the UploadError rejecting it)
+    """
+    try:
+        zip_file = zipfile.ZipFile(io.BytesIO(archive))
+    except zipfile.BadZipFile:
+        raise UploadError(400, "Corrupt zip archive")
+
+    with zip_file:
+        members = [info for info in zip_file.infolist() if not _skip_archive_member(info)]
+        if max_members is not None and len(members) > max_members:
+            raise TooManyFilesError(max_members)
+
+        results = []
+        for info in members:
+            try:
+                if info.file_size > max_bytes:
+                    raise _too_large(max_bytes)
+                buffer = _IngestBuffer(max_bytes, analysis_seconds)
+                with zip_file.open(info) as member:
+                    while True:
+                        chunk = member.read(chunk_size)
+                        if not chunk or buffer.feed(chunk):
+                            break
+                results.append((info.filename, buffer.result()))
+            except UploadError as e:
+                results.append((info.filename, e))
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError, zlib.error, EOFError) as e:
+                # encrypted, unsupported compression or truncated member
+                results.append((info.filename, UploadError(400, f"Unreadable archive member: {str(e)}")))
+    return results
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies larger than the limit of their path with 413.
+
+    Content-Length is checked before anything is read; chunked bodies are counted
+    as they arrive and aborted as soon as they cross the limit, so an oversized
+    upload is never spooled to the end.
+
+    Args:
+        app: ASGI application
+        max_bytes: limit of every request whose path has no entry in path_limits
+        path_limits: path prefix -> limit, e.g. larger ones for multi-file routes
+    """
+    def __init__(self, app, max_bytes: int, path_limits: Optional[Dict[str, int]] = None) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    def limit(self, path: str) -> int:
+        """Body size limit of a request path"""
+        for prefix, max_bytes in self.path_limits.items():
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return max_bytes
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.limit(scope["path"])
+        too_large = HTTPException(status_code=413,
+                                  detail=f"Request too large, the limit is {max_bytes // (1024 * 1024)}MB")
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+                await self._reject(send, too_large.detail)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # surfaces through the body parser as a 413 response
+                    raise too_large
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send, detail: str):
+        body = ('{"detail": "%s"}' % detail).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
@@ -6,10 +6,13 @@ License: MIT
 """
 
 import os
+import time
 import pandas as pd
 import numpy as np
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.distributed import DistributedSampler
 
+from models.feature_store import FeatureStore
 
 
 class AudioEmotionDataset(Dataset):
@@ -18,40 +21,77 @@ class AudioEmotionDataset(Dataset):
 
     Args:
         data_list: A list of file names for this dataset (filename ONLY)
-        data_path: spectrograms files folder path
-        anno_path: annotation files path (full path)
+        data_path: spectrograms files folder path, or a packed feature store
+            (see models/feature_store.py) which is read through np.memmap
+        anno_path: annotation files path (full path), optional for feature
+            stores packed with their annotations
+        lazy: load spectrograms on demand in __getitem__ instead of all at init
+            (feature stores are always read on demand)
 
     """
-    def __init__(self, data_list:list, data_path:str, anno_path:str) -> None:
+    def __init__(self, data_list:list, data_path:str, anno_path:str=None, lazy:bool=False) -> None:
         super().__init__()
         self.data_list = data_list
         self.data_path = data_path
         self.anno_path = anno_path
+        self.lazy = lazy
 
         self.audio_spec = []
         self.emotion_anno = []
 
-        self._load_data()
+        self.store = FeatureStore(data_path) if FeatureStore.is_store(data_path) else None
+        self.store_positions = None
+
+        if self.store is not None:
+            self._open_store()
+        elif lazy:
+            self.emotion_anno = self._lookup_annotations()
+        else:
+            self._load_data()
     
-    def _load_data(self):
+    def _open_store(self):
         """
-        Helper function, load data into memory according to data list
+        Helper function, map samples to feature store positions. Nothing is read
+        into memory, spectrograms are paged in from the shards on access
+        """
+        self.store_positions = np.array([self.store.index_of(str(sample)) for sample in self.data_list],
+                                        dtype=np.int64)
+        if self.anno_path is not None:
+            self.emotion_anno = self._lookup_annotations()
+        else:
+            annos = self.store.annotations()
+            if annos is None:
+                raise ValueError(f"Feature store {self.data_path} has no annotations, pass anno_path")
+            # scale by 0.1 (as paper)
+            self.emotion_anno = np.asarray(annos[self.store_positions], dtype=np.float32) * np.float32(0.1)
+
+    def _lookup_annotations(self) -> np.ndarray:
+        """
+        Helper function, annotations of every sample in data list as one (N, 8)
+        float32 array (a single fancy-index instead of one iloc per sample)
         """
-        # load annotation
         annos = pd.read_csv(self.anno_path, index_col=0)
         # drop last col
         annos = annos.drop(columns=['TARGET'])
         # scale by 0.1 (as paper)
-        annos = annos * 0.1
+        annos = annos.to_numpy(dtype=np.float32) * np.float32(0.1)
+        rows = np.array([int(sample) - 1 for sample in self.data_list], dtype=np.int64)
+        return annos[rows]
+
+    def _load_spectrogram(self, sample) -> np.ndarray:
+        spectrogram = np.load(os.path.join(self.data_path, f'{sample}.mp3.npy'))
+        # add chanel dim
+        return np.expand_dims(spectrogram, 0)
+
+    def _load_data(self):
+        """
+        Helper function, load data into memory according to data list
+        """
+        # load annotation
+        self.emotion_anno = self._lookup_annotations()
         
         print('Loading dataset...')
-        for sample in self.data_list:
-            spectrogram = np.load(os.path.join(self.data_path, f'{sample}.mp3.npy'))
-            # add chanel dim
-            spectrogram = np.expand_dims(spectrogram, 0)
-            sample_anno = annos.iloc[int(sample)-1].to_numpy(dtype=np.float32)
-            self.audio_spec.append(spectrogram)
-            self.emotion_anno.append(sample_anno)
+        self.audio_spec = [self._load_spectrogram(sample) for sample in self.data_list]
 
     
     def __len__(self):
@@ -62,19 +102,159 @@ class AudioEmotionDataset(Dataset):
         Get item will return tuples of audio spectrograms(np array, float32) and
         emotion annotation of this sample(np array, float32)
         """
+        if self.store is not None:
+            spectrogram = self.store.features(self.store_positions[index])
+            if spectrogram.dtype != np.float32:
+                # float16 stores are widened per sample
+                spectrogram = spectrogram.astype(np.float32)
+            # add chanel dim
+            return np.expand_dims(spectrogram, 0), self.emotion_anno[index]
+        if self.lazy:
+            return self._load_spectrogram(self.data_list[index]), self.emotion_anno[index]
         return self.audio_spec[index], self.emotion_anno[index]
 
 
-def build_default_dataloader(data_list:list) -> DataLoader:
+class SyntheticEmotionDataset(Dataset):
+    """
+    Random spectrograms and annotations with the shapes and value ranges of the
+    real data, for trainer smoke tests and throughput measurements without the
+    dataset. Sample i is the same on every access and in every worker.
+
+    Args:
+        num_samples: dataset length
+        shape: spectrogram shape without the channel dim
+        seed: base seed, sample i uses seed + i
+    """
+    def __init__(self, num_samples:int, shape:tuple=(256, 1292), seed:int=0) -> None:
+        super().__init__()
+        self.num_samples = num_samples
+        self.shape = tuple(shape)
+        self.seed = seed
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        rng = np.random.default_rng(self.seed + index)
+        # log spectrogram in dB (see LogSpectrogramExtractor), with chanel dim
+        spectrogram = rng.uniform(-80.0, 0.0, size=(1,) + self.shape).astype(np.float32)
+        # ratings 1 ~ 7.83 scaled by 0.1, like AudioEmotionDataset
+        annotation = rng.uniform(0.1, 0.783, size=8).astype(np.float32)
+        return spectrogram, annotation
+
+
+class TimedDataLoader:
+    """
+    Thin wrapper around a DataLoader that measures how long the consumer waits
+    for each batch (data-loading stall) and reports it at the end of every epoch.
+    Any other attribute is forwarded to the wrapped DataLoader.
+
+    Args:
+        loader: the DataLoader to wrap
+        name: label used in the epoch report
+        report: print the stall report after each epoch
+    """
+    def __init__(self, loader:DataLoader, name:str='data', report:bool=True) -> None:
+        self.loader = loader
+        self.name = name
+        self.report = report
+        self.last_stall_time = 0.0
+        self.last_epoch_time = 0.0
+        self.last_num_samples = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def set_epoch(self, epoch:int):
+        """Reseed the shuffling of a DistributedSampler, call before every epoch"""
+        if hasattr(self.loader.sampler, 'set_epoch'):
+            self.loader.sampler.set_epoch(epoch)
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the wrapper itself
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __iter__(self):
+        stall_time = 0.0
+        num_samples = 0
+        epoch_start = time.perf_counter()
+        iterator = iter(self.loader)
+        while True:
+            wait_start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            stall_time += time.perf_counter() - wait_start
+            num_samples += len(batch[0])
+            yield batch
+
+        self.last_stall_time = stall_time
+        self.last_epoch_time = time.perf_counter() - epoch_start
+        self.last_num_samples = num_samples
+        if self.report:
+            print(f'[{self.name}] data-loading stall {stall_time:.2f}s of {self.last_epoch_time:.2f}s '
+                  f'({self.stall_ratio:.1%}), {num_samples} samples')
+
+    @property
+    def stall_ratio(self) -> float:
+        """Fraction of the last epoch spent waiting for data"""
+        return self.last_stall_time / self.last_epoch_time if self.last_epoch_time > 0 else 0.0
+
+
+def build_default_dataloader(data_list:list, data_path:str='data/spectrograms',
+                             anno_path:str='data/mean_ratings_set1.csv', batch_size:int=8,
+                             shuffle:bool=True, num_workers:int=0, persistent_workers:bool=False,
+                             prefetch_factor:int=None, pin_memory:bool=False, lazy:bool=False,
+                             name:str='data', distributed:bool=False, seed:int=0) -> TimedDataLoader:
     """
     Get data loader for training with default setting from paper
 
     Args: 
         data_list: a list of data names for dataset init
+        data_path: spectrograms folder or packed feature store
+        anno_path: annotation csv, None to use the annotations of a feature store
+        batch_size: samples per batch (8 in the paper)
+        shuffle: reshuffle every epoch
+        num_workers: loader worker processes, 0 loads in the main process
+        persistent_workers: keep workers alive between epochs (needs num_workers > 0)
+        prefetch_factor: batches prefetched per worker (needs num_workers > 0)
+        pin_memory: return batches in pinned memory for faster host to device copies
+        lazy: load spectrograms on demand instead of all at dataset init
+        name: label used in the per-epoch stall report
+        distributed: give every rank of the process group its own shard of the
+            data (DistributedSampler), call set_epoch() before each epoch
+        seed: shuffling seed of the distributed sampler, the same on every rank
 
     Returns:
-        A dataloader class
+        A dataloader class, wrapped to report data-loading stall time per epoch
     """
 
-    dataset = AudioEmotionDataset(data_list, 'data/spectrograms', 'data/mean_ratings_set1.csv')
-    return DataLoader(dataset, 8, shuffle=True)
\ No newline at end of file
+    dataset = AudioEmotionDataset(data_list, data_path, anno_path, lazy=lazy)
+    return wrap_dataloader(dataset, batch_size, shuffle, num_workers, persistent_workers,
+                           prefetch_factor, pin_memory, name, distributed, seed)
+
+
+def wrap_dataloader(dataset:Dataset, batch_size:int=8, shuffle:bool=True, num_workers:int=0,
+                    persistent_workers:bool=False, prefetch_factor:int=None, pin_memory:bool=False,
+                    name:str='data', distributed:bool=False, seed:int=0) -> TimedDataLoader:
+    """
+    DataLoader over any dataset with the options of build_default_dataloader,
+    wrapped to report data-loading stall time per epoch
+    """
+    worker_options = {}
+    if num_workers > 0:
+        # both options are rejected by DataLoader without workers
+        worker_options['persistent_workers'] = persistent_workers
+        if prefetch_factor is not None:
+            worker_options['prefetch_factor'] = prefetch_factor
+    sampler = None
+    if distributed:
+        # shuffling moves into the sampler, DataLoader rejects both
+        sampler = DistributedSampler(dataset, shuffle=shuffle, seed=seed)
+        shuffle = False
+    loader = DataLoader(dataset, batch_size, shuffle=shuffle, sampler=sampler, num_workers=num_workers,
+                        pin_memory=pin_memory, **worker_options)
+    return TimedDataLoader(loader, name)
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Packed, memory-mapped spectrogram store.
+
+Spectrograms of a fixed shape (default (256, 1292)) are appended to contiguous
+shard files (`shard_00000.bin`, ...) holding `shard_size` raw arrays each. An
+`index.json` file records shape, dtype, shard layout and the sample names in
+storage order; optional annotations are kept next to it in `annotations.npy`,
+one row per sample. Readers map the shards with `np.memmap`, so opening a store
+is a single small JSON read and samples are paged in from disk on access.
+
+Usage (pack an existing directory of per-track .npy files):
+    python -m models.feature_store data/spectrograms data/feature_store \
+        --anno data/mean_ratings_set1.csv --float16
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+class FeatureStoreWriter:
+    """
+    Writes spectrograms into a packed feature store
+
+    Args:
+        store_dir: output directory (created if missing)
+        shape: shape of every stored array
+        dtype: storage dtype, float16 halves the size on disk
+        shard_size: number of arrays per shard file
+    """
+    def __init__(self, store_dir:str, shape:tuple=(256, 1292), dtype:str='float32', shard_size:int=512) -> None:
+        self.store_dir = store_dir
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.shard_size = shard_size
+
+        self.names = []
+        self.annotations = []
+        self.annotation_columns = None
+        self.shards = []
+        self._shard_file = None
+
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def add(self, name:str, feature:np.ndarray, annotation=None):
+        """
+        Append one spectrogram (and optionally its annotation row) to the store
+        """
+        feature = np.asarray(feature)
+        if feature.shape != self.shape:
+            raise ValueError(f"Feature {name} has shape {feature.shape}, store expects {self.shape}")
+        if self.names and (annotation is not None) != bool(self.annotations):
+            raise ValueError("Either every sample or no sample must have an annotation")
+
+        if self._shard_file is None or self.shards[-1]['rows'] == self.shard_size:
+            self._open_new_shard()
+        self._shard_file.write(np.ascontiguousarray(feature, dtype=self.dtype).tobytes())
+        self.shards[-1]['rows'] += 1
+
+        self.names.append(name)
+        if annotation is not None:
+            self.annotations.append(np.asarray(annotation, dtype=np.float32))
+
+    def _open_new_shard(self):
+        if self._shard_file is not None:
+            self._shard_file.close()
+        file_name = f'shard_{len(self.shards):05d}.bin'
+        self._shard_file = open(os.path.join(self.store_dir, file_name), 'wb')
+        self.shards.append({'file': file_name, 'rows': 0})
+
+    def close(self):
+        """Flush the last shard and write the index and annotations"""
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+
+        if self.annotations:
+            np.save(os.path.join(self.store_dir, FeatureStore.ANNOTATIONS_FILE), np.stack(self.annotations))
+
+        index = {
+            'version': 1,
+            'shape': list(self.shape),
+            'dtype': self.dtype.str,
+            'shard_size': self.shard_size,
+            'shards': self.shards,
+            'names': self.names,
+            'annotations': bool(self.annotations),
+            'annotation_columns': self.annotation_columns,
+        }
+        # the index is written last, a store without one is incomplete
+        with open(os.path.join(self.store_dir, FeatureStore.INDEX_FILE), 'w') as f:
+            json.dump(index, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FeatureStore:
+    """
+    Read-only view of a packed feature store. Arrays returned by `features()`
+    are views into memory-mapped shards, nothing is loaded up front.
+
+    Args:
+        store_dir: directory written by FeatureStoreWriter
+    """
+    INDEX_FILE = 'index.json'
+    ANNOTATIONS_FILE = 'annotations.npy'
+
+    def __init__(self, store_dir:str) -> None:
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, self.INDEX_FILE), 'r') as f:
+            index = json.load(f)
+
+        self.shape = tuple(index['shape'])
+        self.dtype = np.dtype(index['dtype'])
+        self.shard_size = index['shard_size']
+        self.shards = index['shards']
+        self.names = index['names']
+        self.annotation_columns = index.get('annotation_columns')
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        self._has_annotations = index.get('annotations', False)
+
+        # opened lazily (and per process, see __getstate__)
+        self._memmaps = {}
+        self._annotations = None
+
+    @classmethod
+    def is_store(cls, path:str) -> bool:
+        """True if path is a feature store directory"""
+        return os.path.isfile(os.path.join(path, cls.INDEX_FILE))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def index_of(self, name:str) -> int:
+        """Storage position of a sample name"""
+        return self._positions[name]
+
+    def _shard(self, shard_id:int) -> np.memmap:
+        shard = self._memmaps.get(shard_id)
+        if shard is None:
+            info = self.shards[shard_id]
+            # copy-on-write: views are writable (torch.as_tensor is happy) but the store is never modified
+            shard = np.memmap(os.path.join(self.store_dir, info['file']), dtype=self.dtype, mode='c',
+                              shape=(info['rows'],) + self.shape)
+            self._memmaps[shard_id] = shard
+        return shard
+
+    def features(self, position:int) -> np.ndarray:
+        """Memory-mapped view of the array stored at position (no copy)"""
+        if position < 0 or position >= len(self.names):
+            raise IndexError(f"Feature store position {position} out of range")
+        return self._shard(position // self.shard_size)[position % self.shard_size]
+
+    def annotations(self):
+        """(N, D) float32 annotation rows in storage order, or None"""
+        if not self._has_annotations:
+            return None
+        if self._annotations is None:
+            self._annotations = np.load(os.path.join(self.store_dir, self.ANNOTATIONS_FILE), mmap_mode='r')
+        return self._annotations
+
+    def __getstate__(self):
+        # dataloader workers started with spawn re-open their own maps instead of
+        # receiving pickled copies of the arrays
+        state = self.__dict__.copy()
+        state['_memmaps'] = {}
+        state['_annotations'] = None
+        return state
+
+
+def pack_npy_directory(spectrogram_dir:str, store_dir:str, anno_path:str=None,
+                       dtype:str='float32', shard_size:int=512) -> FeatureStore:
+    """
+    Pack a directory of per-track `<id>.<ext>.npy` spectrograms into a feature store
+
+    Args:
+        spectrogram_dir: directory written by the preprocessing Saver
+        store_dir: output feature store directory
+        anno_path: annotation csv (index column = track id), stored alongside if given
+        dtype: storage dtype ('float32' or 'float16')
+        shard_size: number of arrays per shard file
+
+    Returns:
+        The packed FeatureStore
+    """
+    files = sorted(f for f in os.listdir(spectrogram_dir) if f.endswith('.npy'))
+    if not files:
+        raise ValueError(f"No .npy spectrograms found in {spectrogram_dir}")
+
+    annos = None
+    if anno_path is not None:
+        import pandas as pd
+        annos = pd.read_csv(anno_path, index_col=0)
+        # drop last col, same as AudioEmotionDataset
+        annos = annos.drop(columns=['TARGET'])
+
+    first = np.load(os.path.join(spectrogram_dir, files[0]))
+    with FeatureStoreWriter(store_dir, first.shape, dtype, shard_size) as writer:
+        if annos is not None:
+            writer.annotation_columns = list(annos.columns)
+        for i, file_name in enumerate(files, 1):
+            name = file_name.split('.')[0]
+            feature = np.load(os.path.join(spectrogram_dir, file_name))
+            annotation = None
+            if annos is not None:
+                annotation = annos.iloc[int(name) - 1].to_numpy(dtype=np.float32)
+            writer.add(name, feature, annotation)
+            if i % 100 == 0:
+                print(f"Packed {i}/{len(files)} spectrograms")
+    print(f"Packed {len(files)} spectrograms into {store_dir} ({writer.dtype.name})")
+    return FeatureStore(store_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack .npy spectrograms into a memory-mapped feature store")
+    parser.add_argument('spectrogram_dir')
+    parser.add_argument('store_dir')
+    parser.add_argument('--anno', default=None, help='annotation csv to store alongside the features')
+    parser.add_argument('--float16', action='store_true', help='store features as float16')
+    parser.add_argument('--shard-size', type=int, default=512)
+    args = parser.parse_args()
+
+    pack_npy_directory(args.spectrogram_dir, args.store_dir, args.anno,
+                       'float16' if args.float16 else 'float32', args.shard_size)
@@ -0,0 +1,107 @@
+"""
+ONNX export and ONNX Runtime inference for Audio2EmotionModel.
+
+Audio2EmotionModel.forward squeezes the pooled features, which drops the batch
+axis when B == 1 and bakes that shape into a traced graph. The export goes
+through ExportWrapper, which flattens instead, so the exported graph has a
+dynamic batch axis and always returns (B, 8).
+
+Usage (export best.pth and check it against the torch model):
+    python -m scripts.export_onnx weights/best.pth weights/best.onnx
+"""
+import copy
+import os
+
+import numpy as np
+import torch
+from torch import nn
+
+INPUT_NAME = 'spectrogram'
+OUTPUT_NAME = 'scores'
+INPUT_SHAPE = (1, 256, 1292)
+
+
+class ExportWrapper(nn.Module):
+    """
+    Audio2EmotionModel with a flatten in place of the squeeze, the output is
+    (B, 8) for every batch size
+    """
+    def __init__(self, model) -> None:
+        super().__init__()
+        self.layers = model.layers
+        self.head = model.head
+
+    def forward(self, x):
+        x = self.layers(x)              # [B, 256, 1, 1]
+        x = torch.flatten(x, 1)         # [B, 256]
+        return self.head(x)             # [B, 8]
+
+
+def export_onnx(model, onnx_path:str, opset:int=17) -> str:
+    """
+    Export a trained Audio2EmotionModel to ONNX with a dynamic batch axis
+
+    Args:
+        model: Audio2EmotionModel with weights loaded
+        onnx_path: output file
+        opset: ONNX opset version
+
+    Returns:
+        The path of the exported model
+    """
+    # copy: exporting on CPU must not move the serving model off its device
+    wrapper = ExportWrapper(copy.deepcopy(model)).cpu().eval()
+    # batch of 2 so nothing in the trace specialises on B == 1
+    dummy = torch.randn((2,) + INPUT_SHAPE)
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper, dummy, onnx_path,
+            input_names=[INPUT_NAME],
+            output_names=[OUTPUT_NAME],
+            dynamic_axes={INPUT_NAME: {0: 'batch'}, OUTPUT_NAME: {0: 'batch'}},
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    return onnx_path
+
+
+class OnnxRunner:
+    """
+    ONNX Runtime session running the exported model on CPU
+
+    Args:
+        onnx_path: exported model
+        intra_op_threads: threads inside one op (convolutions), 0 lets ONNX Runtime decide
+        inter_op_threads: threads running independent ops in parallel
+    """
+    def __init__(self, onnx_path:str, intra_op_threads:int=0, inter_op_threads:int=1) -> None:
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # the graph is a single chain, parallel execution only adds overhead
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, spectrograms:np.ndarray) -> np.ndarray:
+        """(B, 1, 256, 1292) float32 -> (B, 8) raw scores"""
+        inputs = np.ascontiguousarray(spectrograms, dtype=np.float32)
+        return self.session.run([OUTPUT_NAME], {INPUT_NAME: inputs})[0]
+
+
+def sample_inputs(batch_size:int=2, seed:int=0) -> np.ndarray:
+    """Random inputs in the range of real log spectrograms (dB, [-80, 0]) for parity checks"""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-80.0, 0.0, size=(batch_size,) + INPUT_SHAPE).astype(np.float32)
+
+
+def max_abs_difference(reference_fn, candidate_fn, inputs:np.ndarray) -> float:
+    """Largest absolute difference between the (B, 8) outputs of two forward functions"""
+    reference = np.asarray(reference_fn(inputs)).reshape(len(inputs), -1)
+    candidate = np.asarray(candidate_fn(inputs)).reshape(len(inputs), -1)
+    return float(np.max(np.abs(reference - candidate)))
@@ -0,0 +1,125 @@
+"""
+Inference-time rewrites of a trained Audio2EmotionModel.
+
+- every Conv2d -> BatchNorm2d pair is folded into a single conv (eval-mode
+  statistics baked into the conv weights and bias)
+- Dropout layers, identities at inference, are removed from the graph
+- the result is scripted and frozen, so TorchScript can inline the weights
+  and run its own fusions
+- channels_last memory format is used when it is measurably faster on this
+  machine ('auto'), or forced on/off
+
+The caller keeps the plain model and should check outputs of the optimized one
+against it (see app.core.model_handler.ModelHandler).
+"""
+import copy
+import time
+
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+def fold_batchnorm(layers:nn.Sequential) -> tuple:
+    """
+    Rebuild an eval-mode Sequential with BatchNorm folded into the preceding convs
+    and Dropout removed
+
+    Returns:
+        tuple: (new Sequential, number of folded BatchNorms, number of removed Dropouts)
+    """
+    modules = list(layers)
+    optimized = []
+    folded = dropped = 0
+    i = 0
+    while i < len(modules):
+        module = modules[i]
+        following = modules[i + 1] if i + 1 < len(modules) else None
+        if isinstance(module, nn.Conv2d) and isinstance(following, nn.BatchNorm2d):
+            optimized.append(fuse_conv_bn_eval(module.eval(), following.eval()))
+            folded += 1
+            i += 2
+            continue
+        if isinstance(module, nn.Dropout):
+            dropped += 1
+        else:
+            optimized.append(module)
+        i += 1
+    return nn.Sequential(*optimized).eval(), folded, dropped
+
+
+class OptimizedModel:
+    """
+    Frozen TorchScript module plus the input memory format it was built for
+
+    Args:
+        module: scripted and frozen model
+        channels_last: convert inputs to channels_last before the forward pass
+    """
+    def __init__(self, module, channels_last:bool) -> None:
+        self.module = module
+        self.channels_last = channels_last
+
+    def __call__(self, x:torch.Tensor) -> torch.Tensor:
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return self.module(x)
+
+    def forward_with_embedding(self, x:torch.Tensor) -> tuple:
+        """Emotion scores and 256-d embeddings, see Audio2EmotionModel.forward_with_embedding"""
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return self.module.forward_with_embedding(x)
+
+
+def _build(model, channels_last:bool, freeze:bool):
+    if channels_last:
+        model = copy.deepcopy(model).to(memory_format=torch.channels_last)
+    module = torch.jit.script(model)
+    if freeze:
+        # freezing keeps only forward unless told otherwise
+        module = torch.jit.freeze(module, preserved_attrs=['forward_with_embedding'])
+    return OptimizedModel(module, channels_last)
+
+
+def _time_forward(forward_fn, sample:torch.Tensor, repeats:int=2) -> float:
+    with torch.no_grad():
+        # first calls run the TorchScript profiling passes
+        forward_fn(sample)
+        forward_fn(sample)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            forward_fn(sample)
+    return (time.perf_counter() - start) / repeats
+
+
+def optimize_for_inference(model, sample:torch.Tensor, channels_last='auto', freeze:bool=True, inplace:bool=False):
+    """
+    Build an inference-optimized copy of a trained Audio2EmotionModel
+
+    Args:
+        model: model with weights loaded, on its serving device (left untouched)
+        sample: representative input batch on the same device, used for 'auto'
+        channels_last: True, False or 'auto' (keep it only if it is faster here)
+        freeze: freeze the scripted module (weights become constants)
+        inplace: rewrite `model` itself instead of a copy, keeps memory-mapped weights shared
+
+    Returns:
+        tuple: (OptimizedModel, dict describing what was applied)
+    """
+    optimized = model.eval() if inplace else copy.deepcopy(model).eval()
+    optimized.layers, folded, dropped = fold_batchnorm(optimized.layers)
+    info = {'folded_batchnorm': folded, 'removed_dropout': dropped, 'frozen': freeze}
+
+    if channels_last == 'auto':
+        contiguous = _build(optimized, False, freeze)
+        candidate = _build(optimized, True, freeze)
+        contiguous_time = _time_forward(contiguous, sample)
+        candidate_time = _time_forward(candidate, sample)
+        info['channels_last_speedup'] = round(contiguous_time / candidate_time, 3)
+        result = candidate if candidate_time < contiguous_time else contiguous
+    else:
+        result = _build(optimized, bool(channels_last), freeze)
+
+    info['channels_last'] = result.channels_last
+    return result, info
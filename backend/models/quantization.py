@@ -0,0 +1,189 @@
+"""
+Post-training static int8 quantization of Audio2EmotionModel for CPU inference.
+
+Every Conv2d -> BatchNorm2d -> ReLU block is fused into a single quantized
+ConvReLU2d, activations are observed on a calibration sample of real
+spectrograms, and the converted model is saved as a TorchScript artifact that
+loads without the model code. The linear head stays in float32: it is tiny
+and keeps the output precision.
+
+Usage (calibrate on 64 training spectrograms, report error and speedup):
+    python -m scripts.quantize weights/best.pth weights/best.int8.pt --data data/spectrograms
+"""
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao import quantization as tq
+
+from models.onnx_backend import INPUT_SHAPE
+
+EMOTION_LABELS = ['valence', 'energy', 'tension', 'anger', 'fear', 'happy', 'sad', 'tender']
+
+
+class QuantizableAudio2Emotion(nn.Module):
+    """
+    Audio2EmotionModel between quant/dequant stubs. The pooled features are
+    flattened (not squeezed) so the traced artifact accepts any batch size.
+    """
+    def __init__(self, model) -> None:
+        super().__init__()
+        self.quant = tq.QuantStub()
+        self.layers = model.layers
+        self.dequant = tq.DeQuantStub()
+        self.head = model.head
+
+    def forward(self, x):
+        x = self.quant(x)
+        x = self.layers(x)              # [B, 256, 1, 1], int8
+        x = self.dequant(x)
+        x = torch.flatten(x, 1)         # [B, 256]
+        return self.head(x)             # [B, 8]
+
+
+def _explicit_padding(conv:nn.Conv2d):
+    # quantized convs only take numeric padding
+    if conv.padding == 'valid':
+        conv.padding = (0, 0)
+    elif conv.padding == 'same':
+        # odd kernels, stride 1: same as symmetric k // 2 padding
+        conv.padding = tuple(k // 2 for k in conv.kernel_size)
+
+
+def fuse_blocks(layers:nn.Sequential) -> nn.Sequential:
+    """Fuse every Conv2d -> BatchNorm2d -> ReLU run of an eval-mode Sequential in place"""
+    modules = list(layers.named_children())
+    groups = []
+    for i in range(len(modules) - 2):
+        (conv_name, conv), (bn_name, bn), (relu_name, relu) = modules[i:i + 3]
+        if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d) and isinstance(relu, nn.ReLU):
+            _explicit_padding(conv)
+            groups.append([conv_name, bn_name, relu_name])
+    return tq.fuse_modules(layers, groups, inplace=True)
+
+
+def load_calibration_set(spectrogram_dir:str, num_samples:int=64, offset:int=0, seed:int=0) -> np.ndarray:
+    """
+    Draw spectrograms from a preprocessed directory (per-track .npy files or a feature store)
+
+    Args:
+        spectrogram_dir: data/spectrograms or a packed feature store
+        num_samples: number of spectrograms
+        offset: skip this many from the shuffled order (held-out evaluation samples)
+        seed: shuffle seed
+
+    Returns:
+        np.ndarray: (N, 1, 256, 1292) float32
+    """
+    from models.feature_store import FeatureStore
+
+    rng = np.random.default_rng(seed)
+    if FeatureStore.is_store(spectrogram_dir):
+        store = FeatureStore(spectrogram_dir)
+        positions = rng.permutation(len(store))[offset:offset + num_samples]
+        samples = [store.features(int(p)) for p in positions]
+    else:
+        files = sorted(f for f in os.listdir(spectrogram_dir) if f.endswith('.npy'))
+        chosen = [files[i] for i in rng.permutation(len(files))[offset:offset + num_samples]]
+        samples = [np.load(os.path.join(spectrogram_dir, f)) for f in chosen]
+    if not samples:
+        raise ValueError(f"No spectrograms to sample from {spectrogram_dir}")
+    return np.stack(samples).astype(np.float32)[:, None]
+
+
+def quantize_static(model, calibration:np.ndarray, backend:str='x86', batch_size:int=8):
+    """
+    Post-training static quantization of a trained Audio2EmotionModel
+
+    Args:
+        model: float model with weights loaded (left untouched)
+        calibration: (N, 1, 256, 1292) spectrograms used to observe activation ranges
+        backend: quantized engine, 'x86'/'fbgemm' on Intel/AMD, 'qnnpack' on ARM
+        batch_size: calibration batch size
+
+    Returns:
+        The converted int8 model (eager mode)
+    """
+    torch.backends.quantized.engine = backend
+    quantizable = QuantizableAudio2Emotion(copy.deepcopy(model).cpu().eval()).eval()
+    fuse_blocks(quantizable.layers)
+
+    quantizable.qconfig = tq.get_default_qconfig(backend)
+    # the float head is not quantized
+    quantizable.head.qconfig = None
+    tq.prepare(quantizable, inplace=True)
+
+    with torch.no_grad():
+        for start in range(0, len(calibration), batch_size):
+            quantizable(torch.from_numpy(calibration[start:start + batch_size]))
+
+    return tq.convert(quantizable, inplace=True)
+
+
+def save_quantized(quantized_model, path:str, backend:str='x86') -> str:
+    """Trace the int8 model and save it as a TorchScript artifact"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with torch.no_grad():
+        scripted = torch.jit.trace(quantized_model, torch.randn((2,) + INPUT_SHAPE))
+    scripted = torch.jit.freeze(scripted.eval())
+    torch.jit.save(scripted, path, _extra_files={'quantized_engine': backend})
+    return path
+
+
+def load_quantized(path:str):
+    """
+    Load a saved int8 artifact as a forward function (B, 1, 256, 1292) float32 -> (B, 8)
+    """
+    extra_files = {'quantized_engine': ''}
+    scripted = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    engine = extra_files['quantized_engine']
+    engine = engine.decode() if isinstance(engine, bytes) else engine
+    # the quantized kernels must come from the engine the model was calibrated for
+    if engine:
+        torch.backends.quantized.engine = engine
+    scripted.eval()
+
+    def forward(inputs:np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return scripted(torch.from_numpy(np.ascontiguousarray(inputs, dtype=np.float32))).numpy()
+
+    return forward
+
+
+def compare(float_fn, quant_fn, inputs:np.ndarray, batch_size:int=8, scale:float=7.83 - 1) -> dict:
+    """
+    Per-dimension error and speed of the int8 model against the float model
+
+    Args:
+        float_fn, quant_fn: forward functions (B, 1, 256, 1292) -> (B, 8) raw scores
+        inputs: held-out spectrograms
+        batch_size: forward pass batch size
+        scale: raw score -> rating scale factor, errors are reported in rating units
+
+    Returns:
+        dict: mean/max absolute error per emotion, timings and speedup
+    """
+    float_out, quant_out = [], []
+    timings = {'float': 0.0, 'int8': 0.0}
+    # warm-up pass outside the timings
+    float_fn(inputs[:batch_size])
+    quant_fn(inputs[:batch_size])
+    for start in range(0, len(inputs), batch_size):
+        batch = inputs[start:start + batch_size]
+        for name, fn, outputs in (('float', float_fn, float_out), ('int8', quant_fn, quant_out)):
+            tic = time.perf_counter()
+            outputs.append(np.asarray(fn(batch)).reshape(len(batch), -1))
+            timings[name] += time.perf_counter() - tic
+
+    error = np.abs(np.concatenate(float_out) - np.concatenate(quant_out)) * scale
+    return {
+        'samples': len(inputs),
+        'mean_abs_error': dict(zip(EMOTION_LABELS, np.round(error.mean(axis=0), 4).tolist())),
+        'max_abs_error': dict(zip(EMOTION_LABELS, np.round(error.max(axis=0), 4).tolist())),
+        'float_seconds_per_sample': timings['float'] / len(inputs),
+        'int8_seconds_per_sample': timings['int8'] / len(inputs),
+        'speedup': timings['float'] / timings['int8'] if timings['int8'] else None,
+    }
@@ -0,0 +1,236 @@
+"""
+Weights files that several serving processes can share.
+
+`torch.load(..., mmap=True)` maps the tensor storages of a checkpoint straight
+from the file instead of reading them into private memory, and
+`load_state_dict(..., assign=True)` makes the model parameters those mapped
+tensors. Every worker loading the same file then uses the same physical pages
+(the OS page cache), and pages are only read from disk when first touched.
+
+Anything that rewrites the weights after loading (BatchNorm folding,
+channels_last) creates private copies again, so the folding can be done once
+offline: a folded weights file holds the Conv+BN-folded model, which is served
+as is. It is only written if its outputs match the plain model, and records
+the SHA-256 of the plain weights it was made from, so serving it identifies
+the trained weights without reading them.
+
+Usage (fold best.pth into a serving weights file):
+    python -m models.shared_weights weights/best.pth weights/best.folded.pth
+"""
+import argparse
+import copy
+import hashlib
+import logging
+import os
+from typing import Optional
+
+import torch
+
+from models.torch_models import Audio2EmotionModel
+from models.optimization import fold_batchnorm
+
+logger = logging.getLogger(__name__)
+
+FOLDED_FORMAT = 'audio2emotion-folded-v1'
+# max raw score difference accepted between the folded and the plain model
+DEFAULT_TOLERANCE = 1e-3
+
+
+def build_model(folded:bool=False) -> Audio2EmotionModel:
+    """Audio2EmotionModel with the layout of a plain or a folded weights file"""
+    model = Audio2EmotionModel().eval()
+    if folded:
+        # same layout as the folded checkpoint: Conv2d with bias, no BatchNorm/Dropout
+        model.layers, _, _ = fold_batchnorm(model.layers)
+    return model
+
+
+def load_weights(path:str, map_location='cpu', mmap:bool=True):
+    """
+    Load a plain state dict or a folded weights file
+
+    Args:
+        path: weights file
+        map_location: device of the loaded tensors
+        mmap: map the storages from the file (CPU only) instead of reading them
+
+    Returns:
+        tuple: (state dict, True if the file holds folded weights)
+    """
+    try:
+        checkpoint = torch.load(path, map_location=map_location, mmap=mmap, weights_only=True)
+    except RuntimeError:
+        if not mmap:
+            raise
+        # legacy (pre zip format) checkpoints can't be mapped, re-save them with torch.save
+        logger.warning("Weights can't be memory-mapped, loading them into memory", extra={"weights": path})
+        checkpoint = torch.load(path, map_location=map_location, weights_only=True)
+    if isinstance(checkpoint, dict) and checkpoint.get('format') == FOLDED_FORMAT:
+        return checkpoint['state_dict'], True
+    return checkpoint, False
+
+
+def file_sha256(path:str) -> str:
+    """SHA-256 of a file, read in 1MB chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_info(path:str) -> dict:
+    """What a folded file records about the plain weights it was made from"""
+    stat = os.stat(path)
+    return {'sha256': file_sha256(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def folded_source(path:str) -> Optional[dict]:
+    """Source record of a folded weights file, None for plain weights (or folded files without one)"""
+    try:
+        checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except Exception:
+        return None
+    if isinstance(checkpoint, dict) and checkpoint.get('format') == FOLDED_FORMAT:
+        return checkpoint.get('source')
+    return None
+
+
+def _is_source_of(source:dict, path:str) -> bool:
+    stat = os.stat(path)
+    return source.get('size') == stat.st_size and source.get('mtime_ns') == stat.st_mtime_ns
+
+
+def weights_fingerprint(path:str, serving_path:Optional[str]=None) -> str:
+    """
+    SHA-256 of the trained weights, identifies the loaded model
+
+    Taken from the source record of the folded file being served (or of `path`
+    itself when it is folded) instead of reading the whole weights file, when
+    that record still describes `path`.
+
+    Args:
+        path: weights file the server was configured with
+        serving_path: file actually loaded, e.g. the folded side file of `path`
+    """
+    source = folded_source(path)
+    if source and source.get('sha256'):
+        return source['sha256']
+    if serving_path and serving_path != path:
+        source = folded_source(serving_path)
+        if source and source.get('sha256') and _is_source_of(source, path):
+            return source['sha256']
+    return file_sha256(path)
+
+
+def save_folded_weights(model:Audio2EmotionModel, path:str, tolerance:Optional[float]=DEFAULT_TOLERANCE,
+                        source:Optional[dict]=None) -> str:
+    """
+    Fold BatchNorm into the convs, drop Dropout and save the result for serving
+
+    Args:
+        model: trained model (plain layout)
+        path: folded weights file to write
+        tolerance: max raw score difference from `model`, None skips the check
+        source: `source_info()` of the plain weights, recorded in the file
+
+    Raises:
+        RuntimeError: the folded model's outputs differ from `model` by more than tolerance
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    folded = copy.deepcopy(model)
+    folded.layers, n_folded, _ = fold_batchnorm(folded.layers)
+    error = None
+    if tolerance is not None:
+        from models.onnx_backend import max_abs_difference, sample_inputs
+
+        def forward(module):
+            def run(x):
+                with torch.no_grad():
+                    return module(torch.from_numpy(x)).numpy()
+            return run
+
+        error = max_abs_difference(forward(model), forward(folded), sample_inputs())
+        if error > tolerance:
+            raise RuntimeError(f"folded outputs differ from the plain model by {error:.2e} "
+                               f"(tolerance {tolerance:.0e}), {path} not written")
+    state_dict = {name: tensor.contiguous() for name, tensor in folded.state_dict().items()}
+    checkpoint = {'format': FOLDED_FORMAT, 'state_dict': state_dict}
+    if source is not None:
+        checkpoint['source'] = source
+    # written then renamed, a process mapping the file never sees it half written
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info("Saved folded weights", extra={
+        "path": path, "folded_batchnorm": n_folded,
+        "parity_error": f"{error:.2e}" if error is not None else None,
+    })
+    return path
+
+
+def folded_path(path:str, directory:Optional[str]=None) -> str:
+    """Side file holding the folded version of a plain weights file, next to it unless directory is given"""
+    root, ext = os.path.splitext(path)
+    side_path = f"{root}.folded{ext or '.pth'}"
+    return os.path.join(directory, os.path.basename(side_path)) if directory else side_path
+
+
+def ensure_folded_weights(path:str, directory:Optional[str]=None, tolerance:float=DEFAULT_TOLERANCE) -> str:
+    """
+    Folded weights for `path`, written as a side file on first use
+
+    Serving processes that map plain weights and then fold them each end up
+    with a private folded copy. They map this file instead, so the folded
+    weights are shared too. The side file is rewritten when it wasn't made
+    from the current `path` (size and mtime recorded in it); a lock makes
+    concurrently starting workers write it only once (and map the same file).
+
+    Args:
+        path: plain (or already folded) weights
+        directory: where the side file and its lock go, defaults to next to `path`
+        tolerance: max raw score difference between the folded and the plain model
+
+    Returns:
+        str: `path` itself when it is already folded, else the side file
+
+    Raises:
+        RuntimeError: folding changes the outputs beyond tolerance (no side file is left behind)
+    """
+    import fcntl
+
+    side_path = folded_path(path, directory)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{side_path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(side_path):
+            source = folded_source(side_path)
+            if source is not None and _is_source_of(source, path):
+                return side_path
+        state_dict, folded = load_weights(path, mmap=False)
+        if folded:
+            return path
+        model = Audio2EmotionModel()
+        model.load_state_dict(state_dict)
+        try:
+            return save_folded_weights(model.eval(), side_path, tolerance, source_info(path))
+        except RuntimeError:
+            # a stale side file must not be picked up by the next worker either
+            if os.path.exists(side_path):
+                os.remove(side_path)
+            raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold BatchNorm of trained weights into a shareable serving file")
+    parser.add_argument('weights', help='trained state dict (best.pth)')
+    parser.add_argument('output', help='folded weights file to write')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='max raw score difference from the plain model')
+    args = parser.parse_args()
+
+    model = Audio2EmotionModel()
+    model.load_state_dict(torch.load(args.weights, map_location='cpu', weights_only=True))
+    path = save_folded_weights(model.eval(), args.output, args.tolerance, source_info(args.weights))
+    print(f"Saved folded weights to {path}")
@@ -18,6 +18,9 @@ class Audio2EmotionModel(nn.Module):
 
     Outputs:
         Batch of emotion scores in (B, 8)
+
+    `embed` / `forward_with_embedding` also expose the 256-d pooled feature the
+    head scores, as a track embedding.
     """
     def __init__(self) -> None:
         super().__init__()
@@ -85,4 +88,15 @@ class Audio2EmotionModel(nn.Module):
         # reshape for linear head
         x = torch.squeeze(x)    # [B, 256]
         x = self.head(x)        # [B, 8]
-        return x
\ No newline at end of file
+        return x
+
+    def embed(self, x):
+        """Pooled 256-d features of a batch of spectrograms, [B, 256] (also for B == 1)"""
+        return torch.flatten(self.layers(x), 1)
+
+    # exported so scripted (and frozen) copies of the model keep it, see models/optimization.py
+    @torch.jit.export
+    def forward_with_embedding(self, x):
+        """Emotion scores [B, 8] and embeddings [B, 256] from a single pass through the conv layers"""
+        embedding = self.embed(x)
+        return self.head(embedding), embedding
\ No newline at end of file
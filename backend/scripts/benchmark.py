@@ -0,0 +1,364 @@
+"""
+Microbenchmarks of the preprocessing and inference pipeline on deterministic
+synthetic audio.
+
+Times Loader.load and AudioProcessor.process_audio for every format/duration,
+Padder.right_pad and LogSpectrogramExtractor.extract on decoded signals, and
+ModelHandler.predict / predict_batch at several batch sizes, and exact vs IVF
+search of the /similar vector index (with recall@10) on synthetic embeddings. Every case reports
+latency percentiles, throughput and peak memory; results are written as JSON
+and a later run can be compared against a stored baseline.
+
+Usage (from backend/):
+    python -m scripts.benchmark run --output bench/baseline.json
+    python -m scripts.benchmark run --output bench/current.json --compare bench/baseline.json
+    python -m scripts.benchmark compare bench/baseline.json bench/current.json --threshold 0.1
+    python -m scripts.benchmark run --only vector_index --index-size 1000000 --output bench/index.json
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+FORMATS = ('.wav', '.flac', '.ogg', '.mp3')
+# soundfile format / subtype used to encode each synthetic file
+_ENCODINGS = {
+    '.wav': ('WAV', 'PCM_16'),
+    '.flac': ('FLAC', 'PCM_16'),
+    '.ogg': ('OGG', 'VORBIS'),
+    '.mp3': ('MP3', 'MPEG_LAYER_III'),
+}
+
+
+def synthetic_signal(seconds: float, sample_rate: int = SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Stereo chord with vibrato plus noise, identical for the same arguments"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    vibrato = 1 + 0.002 * np.sin(2 * np.pi * 5 * t)
+    left = sum(np.sin(2 * np.pi * f * vibrato * t) for f in (220.0, 277.2, 329.6)) / 4
+    right = sum(np.sin(2 * np.pi * f * t) for f in (164.8, 246.9)) / 3
+    stereo = np.stack([left, right], axis=1) + 0.02 * rng.standard_normal((len(t), 2))
+    return np.clip(stereo, -1, 1).astype(np.float32)
+
+
+def encode(signal: np.ndarray, fmt: str, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Encode a (samples, channels) float signal in one of FORMATS"""
+    import soundfile as sf
+    container, subtype = _ENCODINGS[fmt]
+    buffer = io.BytesIO()
+    sf.write(buffer, signal, sample_rate, format=container, subtype=subtype)
+    return buffer.getvalue()
+
+
+def synthetic_corpus(formats, durations, seed: int = 0) -> dict:
+    """{(format, seconds): encoded bytes}, formats this libsndfile can't write are skipped"""
+    corpus = {}
+    for seconds in durations:
+        signal = synthetic_signal(seconds, seed=seed)
+        for fmt in formats:
+            try:
+                corpus[(fmt, seconds)] = encode(signal, fmt)
+            except Exception as e:
+                print(f"⚠️ Skipping {fmt} ({seconds}s): {str(e)}")
+    return corpus
+
+
+def _max_rss_kb() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def measure(fn, repeats: int, warmup: int = 2, items: int = 1) -> dict:
+    """
+    Time fn() and summarise
+
+    Args:
+        fn: zero-argument callable, one call is one measured operation
+        repeats: timed calls
+        warmup: untimed calls first (lazy imports, caches, JIT)
+        items: items processed per call, for throughput
+
+    Returns:
+        dict: latency percentiles (ms), throughput (items/s) and peak memory
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    # separate traced call: tracemalloc would distort the timings above
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies_ms = np.array(latencies) * 1000
+    mean = float(latencies_ms.mean())
+    return {
+        "repeats": repeats,
+        "items": items,
+        "mean_ms": round(mean, 4),
+        "min_ms": round(float(latencies_ms.min()), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p90_ms": round(float(np.percentile(latencies_ms, 90)), 4),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+        "max_ms": round(float(latencies_ms.max()), 4),
+        "throughput_per_s": round(items / (mean / 1000), 3) if mean else None,
+        # python/numpy allocations of one call (torch's allocator is not traced)
+        "peak_traced_kb": round(peak / 1024, 1),
+        "max_rss_kb": _max_rss_kb(),
+    }
+
+
+def write_dummy_weights(path: str, seed: int = 0) -> str:
+    """Randomly initialised weights: same compute as trained ones, no best.pth needed"""
+    import torch
+    from models.torch_models import Audio2EmotionModel
+    torch.manual_seed(seed)
+    torch.save(Audio2EmotionModel().state_dict(), path)
+    return path
+
+
+def run_benchmarks(args) -> dict:
+    from app.core.audio_processor import AudioProcessor, preprocessing_params
+    from models.preprocessing import Loader, LogSpectrogramExtractor, Padder
+
+    params = preprocessing_params()
+    corpus = synthetic_corpus(args.formats, args.durations, args.seed)
+    results = {}
+
+    def record(name, result):
+        results[name] = result
+        print(f"{name:<48} p50 {result['p50_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms  "
+              f"{result['throughput_per_s']:>9.2f}/s  peak {result['peak_traced_kb']:>9.1f} KB")
+
+    loader = Loader(params['sample_rate'], params['duration'], params['mono'],
+                    params['resampler'], params['resample_quality'])
+    padder = Padder()
+    extractor = LogSpectrogramExtractor(params['frame_size'], params['hop_length'])
+    processor = AudioProcessor()
+    expected_samples = int(params['sample_rate'] * params['duration'])
+
+    if _selected(args, 'loader'):
+        for (fmt, seconds), audio in sorted(corpus.items()):
+            record(f"loader.load[{fmt[1:]},{seconds:g}s]",
+                   measure(lambda: loader.load(audio, fmt), args.repeats, args.warmup))
+
+    # signals as the pipeline sees them: decoded, mono, at most `duration` long
+    wav = {seconds: encode(synthetic_signal(seconds, seed=args.seed), '.wav') for seconds in args.durations}
+    for seconds, audio in sorted(wav.items()):
+        signal = loader.load(audio, '.wav')
+        missing = expected_samples - len(signal)
+        if missing > 0 and _selected(args, 'padder'):
+            record(f"padder.right_pad[{seconds:g}s]",
+                   measure(lambda: padder.right_pad(signal, missing), args.repeats, args.warmup))
+        if _selected(args, 'extractor'):
+            padded = padder.right_pad(signal, missing) if missing > 0 else signal
+            record(f"extractor.extract[{seconds:g}s]",
+                   measure(lambda: extractor.extract(padded), args.repeats, args.warmup))
+
+    if _selected(args, 'audio_processor'):
+        for (fmt, seconds), audio in sorted(corpus.items()):
+            record(f"audio_processor.process_audio[{fmt[1:]},{seconds:g}s]",
+                   measure(lambda: processor.process_audio(audio, fmt), args.repeats, args.warmup))
+
+    if _selected(args, 'model'):
+        from app.core.model_handler import ModelHandler
+        spectrogram = processor.process_audio(wav[max(wav)], '.wav')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            handler = ModelHandler()
+            handler.load_model(args.weights or write_dummy_weights(os.path.join(tmp_dir, 'weights.pth')),
+                               backend=args.backend)
+            record("model_handler.predict[batch=1]",
+                   measure(lambda: handler.predict(spectrogram), args.repeats, args.warmup))
+            for batch_size in args.batch_sizes:
+                batch = np.repeat(spectrogram[np.newaxis], batch_size, axis=0)
+                record(f"model_handler.predict_batch[batch={batch_size}]",
+                       measure(lambda: handler.predict_batch(batch), args.repeats, args.warmup, items=batch_size))
+
+    if _selected(args, 'vector_index'):
+        from app.core.vector_index import VectorIndex
+        vectors = synthetic_embeddings(args.index_size, seed=args.seed)
+        index = VectorIndex(vectors.shape[1], nlist=args.index_nlist)
+        start = time.perf_counter()
+        index.add([str(i) for i in range(len(vectors))], vectors)
+        # the IVF lists are trained in the background once the index is big enough
+        index.join_training()
+        print(f"vector index: {len(index)} vectors indexed in {time.perf_counter() - start:.1f}s ({index.stats()})")
+        # queries near indexed tracks, as for real catalogs
+        rng = np.random.default_rng(args.seed + 1)
+        queries = itertools.cycle(queries_sample(vectors, rng, 64))
+        record(f"vector_index.search[exact,n={len(index)}]",
+               measure(lambda: index.search(next(queries), 10, exact=True), args.repeats, args.warmup))
+        for nprobe in args.nprobes:
+            result = measure(lambda: index.search(next(queries), 10, nprobe=nprobe), args.repeats, args.warmup)
+            result['recall_at_10'] = round(np.mean([
+                len({i for i, _ in index.search(q, 10, nprobe=nprobe)} & {i for i, _ in index.search(q, 10, exact=True)})
+                / 10 for q in queries_sample(vectors, rng)
+            ]), 3)
+            record(f"vector_index.search[nprobe={nprobe},n={len(index)}]", result)
+            print(f"{'':<48} recall@10 {result['recall_at_10']:.3f}")
+
+    return {"meta": _metadata(args, params), "results": results}
+
+
+def synthetic_embeddings(count: int, dim: int = 256, clusters: int = 512, seed: int = 0) -> np.ndarray:
+    """Embeddings scattered around cluster centres, closer to real catalogs than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)]
+    vectors += 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors
+
+
+def queries_sample(vectors: np.ndarray, rng: np.random.Generator, count: int = 50) -> np.ndarray:
+    return vectors[rng.integers(0, len(vectors), count)] + 0.05 * rng.standard_normal((count, vectors.shape[1]))
+
+
+def _selected(args, group: str) -> bool:
+    return not args.only or group in args.only
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _metadata(args, params) -> dict:
+    meta = {
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "preprocessing": params,
+        "repeats": args.repeats,
+        "seed": args.seed,
+    }
+    try:
+        import torch
+        meta["torch"] = torch.__version__
+        meta["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return meta
+
+
+def compare_results(baseline: dict, current: dict, metric: str = 'p50_ms', threshold: float = 0.1) -> list:
+    """
+    Compare two benchmark runs case by case
+
+    Args:
+        baseline: stored run
+        current: new run
+        metric: latency field to compare
+        threshold: relative change beyond which a case counts as regressed / improved
+
+    Returns:
+        list: one dict per case present in both runs, with the ratio current / baseline and a status
+    """
+    rows = []
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or not reference.get(metric):
+            continue
+        ratio = result[metric] / reference[metric]
+        status = 'REGRESSION' if ratio > 1 + threshold else 'improved' if ratio < 1 - threshold else 'ok'
+        rows.append({"case": name, "baseline": reference[metric], "current": result[metric],
+                     "ratio": round(ratio, 3), "status": status})
+    return rows
+
+
+def print_comparison(rows: list, metric: str) -> int:
+    """Print the comparison table and return the number of regressions"""
+    for row in rows:
+        print(f"{row['case']:<48} {row['baseline']:>10.2f} -> {row['current']:>10.2f} {metric} "
+              f"(x{row['ratio']:.2f}) {row['status']}")
+    regressions = sum(row['status'] == 'REGRESSION' for row in rows)
+    print(f"{len(rows)} case(s) compared, {regressions} regression(s)")
+    return regressions
+
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocessing and inference microbenchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmarks and write a JSON report')
+    run.add_argument('--output', default='benchmark.json', help='JSON report to write')
+    run.add_argument('--formats', type=_csv(str), default=list(FORMATS), help='comma separated, e.g. .wav,.mp3')
+    run.add_argument('--durations', type=_csv(float), default=[5.0, 15.0, 60.0], help='seconds, comma separated')
+    run.add_argument('--batch-sizes', type=_csv(int), default=[1, 2, 4, 8, 16])
+    run.add_argument('--repeats', type=int, default=20)
+    run.add_argument('--warmup', type=int, default=2)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--weights', default=None, help='weights to load (default: random weights, same cost)')
+    run.add_argument('--backend', default='torch', help='torch, onnx or quantized')
+    run.add_argument('--threads', type=int, default=None, help='torch threads')
+    run.add_argument('--only', type=_csv(str), default=None,
+                     help='groups to run: loader,padder,extractor,audio_processor,model,vector_index')
+    run.add_argument('--index-size', type=int, default=100_000, help='vectors in the vector_index benchmark')
+    run.add_argument('--index-nlist', type=int, default=1024)
+    run.add_argument('--nprobes', type=_csv(int), default=[8, 16, 32])
+    run.add_argument('--compare', default=None, help='baseline JSON to compare the new run against')
+    run.add_argument('--threshold', type=float, default=0.1, help='relative slowdown flagged as regression')
+    run.add_argument('--metric', default='p50_ms')
+
+    compare = commands.add_parser('compare', help='compare two JSON reports')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.1)
+    compare.add_argument('--metric', default='p50_ms')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.threads:
+            import torch
+            torch.set_num_threads(args.threads)
+        report = run_benchmarks(args)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(report['results'])} results to {args.output}")
+        if not args.compare:
+            return
+        baseline, current = _load(args.compare), report
+    else:
+        baseline, current = _load(args.baseline), _load(args.current)
+
+    regressions = print_comparison(compare_results(baseline, current, args.metric, args.threshold), args.metric)
+    # non-zero exit status so CI can fail on regressions
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
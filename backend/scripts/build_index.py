@@ -0,0 +1,126 @@
+"""
+Build the similarity index served by /similar from a catalog of audio files.
+
+Every audio file under the catalog directory is decoded (in parallel worker
+processes), embedded with the model's 256-d pooled features in batched
+forward passes, and added under its path relative to the catalog directory
+as track id. Catalogs of at least 40 tracks per IVF list are clustered
+(k-means) for approximate search, smaller ones are searched exactly. The index records the weights fingerprint:
+the server refuses an index built with other weights.
+
+Usage (from backend/):
+    python -m scripts.build_index data/catalog weights/tracks.npz --weights weights/best.pth
+    # add new tracks to an existing index (existing ids are replaced)
+    python -m scripts.build_index data/new_releases weights/tracks.npz --weights weights/best.pth --append
+Then serve it with INDEX_PATH=weights/tracks.npz.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.core.audio_processor import AudioProcessor
+from app.core.config import settings
+from app.core.model_handler import ModelHandler
+from app.core.vector_index import MIN_VECTORS_PER_LIST, VectorIndex
+
+_processor = None
+
+
+def _init_worker():
+    global _processor
+    _processor = AudioProcessor()
+
+
+def _process(path: str):
+    try:
+        return _processor.process_audio(path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def catalog_files(catalog_dir: str) -> list:
+    """(track id, path) of every supported audio file, ids are paths relative to catalog_dir"""
+    extensions = tuple(settings.allowed_extensions)
+    files = []
+    for root, _, names in os.walk(catalog_dir):
+        for name in names:
+            if name.lower().endswith(extensions):
+                path = os.path.join(root, name)
+                files.append((os.path.relpath(path, catalog_dir).replace(os.sep, '/'), path))
+    return sorted(files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed an audio catalog into the /similar track index")
+    parser.add_argument('catalog', help='directory of audio files (searched recursively)')
+    parser.add_argument('output', help='index file to write (.npz)')
+    parser.add_argument('--weights', default=settings.model_path, help='weights the server loads')
+    parser.add_argument('--append', action='store_true', help='add to the existing index at output')
+    parser.add_argument('--batch-size', type=int, default=16, help='spectrograms per forward pass')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='decoding processes')
+    parser.add_argument('--nlist', type=int, default=settings.index_nlist, help='IVF lists, 0 for exact search only')
+    parser.add_argument('--nprobe', type=int, default=settings.index_nprobe)
+    args = parser.parse_args()
+
+    handler = ModelHandler()
+    handler.load_model(args.weights, backend='torch')
+    dim = handler.model.head.in_features
+
+    if args.append and os.path.exists(args.output):
+        index = VectorIndex.load(args.output)
+        if index.fingerprint != handler.weights_fingerprint:
+            raise SystemExit(f"{args.output} was built with other weights, rebuild it without --append")
+        print(f"Appending to {args.output} ({len(index)} tracks)")
+    else:
+        # flat while embedding, the lists are trained once on the whole catalog below
+        index = VectorIndex(dim, 0, args.nprobe, handler.weights_fingerprint)
+
+    files = catalog_files(args.catalog)
+    print(f"Embedding {len(files)} tracks from {args.catalog} with {args.workers} decoding worker(s)")
+    start = time.perf_counter()
+    failed = 0
+    batch_ids, batch = [], []
+
+    def flush():
+        _, embeddings = handler.predict_with_embedding(np.concatenate(batch))
+        index.add(batch_ids, embeddings)
+        batch_ids.clear()
+        batch.clear()
+
+    # a chunk of files at a time, so only that many spectrograms are ever held
+    chunk_size = args.batch_size * max(1, args.workers) * 4
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker) as pool:
+        for offset in range(0, len(files), chunk_size):
+            chunk = files[offset:offset + chunk_size]
+            results = pool.map(_process, [path for _, path in chunk])
+            for (track_id, path), (spectrogram, error) in zip(chunk, results):
+                if error is not None:
+                    failed += 1
+                    print(f"⚠️ Skipping {path}: {error}")
+                    continue
+                batch_ids.append(track_id)
+                batch.append(spectrogram)
+                if len(batch) == args.batch_size:
+                    flush()
+            done = offset + len(chunk)
+            print(f"{done}/{len(files)} tracks, {done / (time.perf_counter() - start):.1f} tracks/s")
+        if batch:
+            flush()
+
+    if args.nlist and not index.trained:
+        # the server keeps adding to the same lists; a small catalog stays flat until it is big enough
+        index.nlist = args.nlist
+        if len(index) >= args.nlist * MIN_VECTORS_PER_LIST:
+            index.train()
+    index.save(args.output)
+    stats = index.stats()
+    print(f"✅ Indexed {len(files) - failed} tracks ({failed} failed) in {time.perf_counter() - start:.1f}s: "
+          f"{stats['vectors']} in the index, {'IVF ' + str(stats['lists']) + ' lists' if stats['trained'] else 'exact'}, "
+          f"{stats['memory_mb']} MB -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@ import torch
 import numpy as np
 import pandas as pd
 import librosa
-from model_torch import Audio2EmotionModel
+from models.torch_models import Audio2EmotionModel
+from models.preprocessing import Loader
 
 FRAME_SIZE = 512
 HOP_LENGTH = 256
@@ -48,9 +49,12 @@ def main():
         return
     model.eval()
 
-    # Load audio
-    y, sr = librosa.load(audio_path, sr=None)
-    y = librosa.resample(y.astype(np.float32), orig_sr=sr, target_sr=SAMPLE_RATE)
+    # Load audio: only the first DURATION seconds are decoded, then resampled
+    loader = Loader(SAMPLE_RATE, DURATION, MONO)
+    y = loader.load(audio_path)
+    print("Decode timings (ms): " + ", ".join(
+        f"{stage}={seconds * 1000:.1f}" for stage, seconds in loader.last_timings.items()
+    ) + f" [resampler: {loader.decoder.resampler}]")
 
     # Pad or truncate
     num_samples = int(DURATION * SAMPLE_RATE)
@@ -0,0 +1,67 @@
+"""
+Export trained Audio2EmotionModel weights to ONNX and check the exported graph
+against the torch model at several batch sizes.
+
+Usage (from backend/):
+    python -m scripts.export_onnx weights/best.pth weights/best.onnx --benchmark 10
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from models.torch_models import Audio2EmotionModel
+from models.onnx_backend import ExportWrapper, OnnxRunner, export_onnx, max_abs_difference, sample_inputs
+
+
+def time_forward(forward_fn, inputs: np.ndarray, repeats: int) -> float:
+    """Mean seconds per forward pass, after one warm-up pass"""
+    forward_fn(inputs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        forward_fn(inputs)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export Audio2EmotionModel to ONNX")
+    parser.add_argument('weights', help='trained state dict (best.pth)')
+    parser.add_argument('output', help='ONNX file to write')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='max accepted raw score difference')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime intra-op threads (0 = default)')
+    parser.add_argument('--benchmark', type=int, default=0, help='timed forward passes per backend')
+    args = parser.parse_args()
+
+    model = Audio2EmotionModel()
+    model.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    model.eval()
+
+    export_onnx(model, args.output, args.opset)
+    print(f"Exported {args.weights} -> {args.output} (opset {args.opset})")
+
+    wrapper = ExportWrapper(model).eval()
+
+    def torch_forward(inputs):
+        with torch.no_grad():
+            return wrapper(torch.from_numpy(inputs)).numpy()
+
+    runner = OnnxRunner(args.output, intra_op_threads=args.threads)
+
+    # the batch axis is dynamic: check sizes other than the one used for tracing
+    for batch_size in (1, 2, 8):
+        inputs = sample_inputs(batch_size)
+        error = max_abs_difference(torch_forward, runner, inputs)
+        status = 'OK' if error <= args.tolerance else 'MISMATCH'
+        print(f"batch {batch_size}: max abs difference {error:.2e} [{status}]")
+        if args.benchmark:
+            torch_time = time_forward(torch_forward, inputs, args.benchmark)
+            onnx_time = time_forward(runner, inputs, args.benchmark)
+            print(f"    torch {torch_time * 1000:.1f} ms, onnx {onnx_time * 1000:.1f} ms "
+                  f"({torch_time / onnx_time:.2f}x)")
+        if error > args.tolerance:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+HTTP load test of the FastAPI service.
+
+Starts app.main:app locally (random dummy weights, so no best.pth is needed,
+and the prediction cache disabled so every request does the full work) or
+targets a running server, then fires synthetic uploads at /predict/ or
+/predict/batch in steps of increasing load:
+
+- closed loop (--concurrency 1,2,4,8): N clients each sending their next
+  request as soon as the previous one returns
+- open loop (--rate 2,5,10): Poisson arrivals at the given requests/s,
+  regardless of how fast the server answers
+
+Every step reports throughput, p50/p95/p99 latency and errors by status;
+the saturation point is the first step where more load stops buying
+throughput, the error rate climbs or p99 breaks the SLO.
+
+Usage (from backend/, needs httpx):
+    python -m scripts.loadtest --concurrency 1,2,4,8,16 --duration 20 --output loadtest.json
+    python -m scripts.loadtest --rate 2,5,10,20 --workers 2 --endpoint batch --batch-files 4
+    python -m scripts.loadtest --url http://localhost:8000 --concurrency 4,8
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+from scripts.benchmark import encode, synthetic_signal, write_dummy_weights
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    """
+    app.main:app in a uvicorn subprocess with dummy weights
+
+    Args:
+        workers: uvicorn worker processes
+        env: extra settings as environment variables (e.g. {"BATCH_MAX_SIZE": "16"})
+        startup_timeout: seconds to wait for /health/ready
+    """
+    def __init__(self, workers: int = 1, env: dict = None, startup_timeout: float = 300.0) -> None:
+        self.workers = workers
+        self.extra_env = env or {}
+        self.startup_timeout = startup_timeout
+        self.url = None
+        self._process = None
+        self._tmp_dir = None
+
+    def __enter__(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        port = _free_port()
+        env = {
+            **os.environ,
+            "MODEL_PATH": write_dummy_weights(os.path.join(self._tmp_dir.name, "weights.pth")),
+            "CACHE_ENABLED": "False",
+            "JOBS_DIR": os.path.join(self._tmp_dir.name, "jobs"),
+            "LOG_LEVEL": "WARNING",
+            **self.extra_env,
+        }
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=backend_dir, env=env,
+        )
+        self.url = f"http://127.0.0.1:{port}"
+        try:
+            self._wait_ready()
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"Server exited during startup (status {self._process.returncode})")
+            try:
+                if httpx.get(f"{self.url}/health/ready", timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.5)
+        raise TimeoutError(f"Server not ready after {self.startup_timeout}s")
+
+    def __exit__(self, *exc):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+        return False
+
+
+def synthetic_uploads(count: int, seconds: float, fmt: str) -> list:
+    """`count` distinct clips, so repeated requests never hit a cache by accident"""
+    return [(f"loadtest_{i}{fmt}", encode(synthetic_signal(seconds, seed=i), fmt)) for i in range(count)]
+
+
+class LoadClient:
+    """
+    Sends uploads to one endpoint and records (latency seconds, status) per request
+
+    Args:
+        client: shared httpx.AsyncClient
+        endpoint: 'predict' or 'batch'
+        uploads: (filename, bytes) pool, used round robin
+        batch_files: files per /predict/batch request
+    """
+    def __init__(self, client: httpx.AsyncClient, endpoint: str, uploads: list, batch_files: int = 4) -> None:
+        self.client = client
+        self.endpoint = endpoint
+        self.batch_files = batch_files
+        self._uploads = itertools.cycle(uploads)
+        self.records = []
+
+    def _files(self):
+        if self.endpoint == 'batch':
+            return "/predict/batch", [("files", next(self._uploads)) for _ in range(self.batch_files)]
+        return "/predict/", {"file": next(self._uploads)}
+
+    async def send(self):
+        path, files = self._files()
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(path, files=files)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.records.append((time.perf_counter() - start, status))
+
+
+async def closed_loop(load: LoadClient, concurrency: int, duration: float):
+    """`concurrency` clients sending back-to-back requests for `duration` seconds"""
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await load.send()
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+
+
+async def open_loop(load: LoadClient, rate: float, duration: float, max_outstanding: int = 1000, seed: int = 0):
+    """Poisson arrivals at `rate` requests/s for `duration` seconds"""
+    rng = random.Random(seed)
+    tasks = set()
+    start = time.perf_counter()
+    next_arrival = start
+    while next_arrival < start + duration:
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        if len(tasks) < max_outstanding:
+            task = asyncio.create_task(load.send())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        else:
+            # the server fell that far behind: count it instead of queueing unboundedly
+            load.records.append((0.0, "dropped"))
+        next_arrival += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+
+
+def summarize(records: list, elapsed: float, items_per_request: int) -> dict:
+    """Throughput, latency percentiles and errors of one step"""
+    ok = [latency for latency, status in records if status == 200]
+    errors = {}
+    for _, status in records:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    latencies_ms = np.array(ok) * 1000 if ok else np.array([np.nan])
+    return {
+        "requests": len(records),
+        "succeeded": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "throughput_rps": round(len(ok) / elapsed, 3),
+        "throughput_files_per_s": round(len(ok) * items_per_request / elapsed, 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "max_ms": round(float(latencies_ms.max()), 2),
+    }
+
+
+def find_saturation(steps: list, slo_ms: float, max_error_rate: float, min_gain: float) -> dict:
+    """
+    First step where the service is saturated
+
+    A step is saturated when its error rate exceeds max_error_rate, its p99
+    breaks the SLO, or (closed loop) its throughput grew less than min_gain
+    over the previous step / (open loop) it served less than 1 - min_gain of
+    the offered rate.
+
+    Returns:
+        dict: the saturated step's load and reason, or None if no step saturated
+    """
+    previous = None
+    for step in steps:
+        result = step["result"]
+        reason = None
+        if result["error_rate"] > max_error_rate:
+            reason = f"error rate {result['error_rate']:.1%}"
+        elif slo_ms and result["p99_ms"] > slo_ms:
+            reason = f"p99 {result['p99_ms']:.0f}ms > SLO {slo_ms:.0f}ms"
+        elif step["mode"] == "open" and result["throughput_rps"] < step["load"] * (1 - min_gain):
+            reason = f"served {result['throughput_rps']:.2f}/s of {step['load']:g}/s offered"
+        elif step["mode"] == "closed" and previous is not None and \
+                result["throughput_rps"] < previous["throughput_rps"] * (1 + min_gain):
+            reason = f"throughput {previous['throughput_rps']:.2f} -> {result['throughput_rps']:.2f}/s"
+        if reason:
+            return {"mode": step["mode"], "load": step["load"], "reason": reason,
+                    "max_throughput_rps": max(s["result"]["throughput_rps"] for s in steps)}
+        previous = result
+    return None
+
+
+async def run_steps(url: str, args, uploads: list) -> list:
+    mode, loads = ("open", args.rate) if args.rate else ("closed", args.concurrency)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    items = args.batch_files if args.endpoint == 'batch' else 1
+    steps = []
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        for load_level in loads:
+            load = LoadClient(client, args.endpoint, uploads, args.batch_files)
+            start = time.perf_counter()
+            if mode == "open":
+                await open_loop(load, load_level, args.duration, seed=args.seed)
+            else:
+                await closed_loop(load, int(load_level), args.duration)
+            result = summarize(load.records, time.perf_counter() - start, items)
+            steps.append({"mode": mode, "load": load_level, "result": result})
+            label = f"{load_level:g} req/s" if mode == "open" else f"{int(load_level)} clients"
+            print(f"{label:>12}: {result['throughput_rps']:8.2f} req/s  p50 {result['p50_ms']:8.1f}  "
+                  f"p95 {result['p95_ms']:8.1f}  p99 {result['p99_ms']:8.1f} ms  "
+                  f"errors {result['error_rate']:.1%} {result['errors'] or ''}")
+            if args.pause:
+                await asyncio.sleep(args.pause)
+    return steps
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+
+def _env_pairs(values):
+    env = {}
+    for value in values or []:
+        key, _, setting = value.partition('=')
+        env[key] = setting
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the emotion prediction API")
+    parser.add_argument('--url', default=None, help='target a running server instead of starting one')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers of the local server')
+    parser.add_argument('--env', action='append', metavar='KEY=VALUE',
+                        help='setting for the local server, e.g. --env BATCH_MAX_SIZE=16 (repeatable)')
+    parser.add_argument('--endpoint', choices=('predict', 'batch'), default='predict')
+    parser.add_argument('--batch-files', type=int, default=4, help='files per /predict/batch request')
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=_csv(int), default=[1, 2, 4, 8, 16],
+                      help='closed loop: concurrent clients per step')
+    load.add_argument('--rate', type=_csv(float), default=None, help='open loop: requests/s per step')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per step')
+    parser.add_argument('--pause', type=float, default=1.0, help='seconds between steps')
+    parser.add_argument('--timeout', type=float, default=120.0, help='request timeout in seconds')
+    parser.add_argument('--clips', type=int, default=8, help='distinct synthetic uploads')
+    parser.add_argument('--clip-seconds', type=float, default=30.0)
+    parser.add_argument('--format', default='.mp3', help='upload format (.wav, .flac, .ogg, .mp3)')
+    parser.add_argument('--slo-ms', type=float, default=None, help='p99 latency objective')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--min-gain', type=float, default=0.05,
+                        help='throughput gain below which more load counts as saturated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write steps and saturation point as JSON')
+    args = parser.parse_args()
+
+    uploads = synthetic_uploads(args.clips, args.clip_seconds, args.format)
+    print(f"Generated {len(uploads)} {args.format} clips of {args.clip_seconds:g}s")
+
+    if args.url:
+        steps = asyncio.run(run_steps(args.url, args, uploads))
+    else:
+        with LocalServer(args.workers, _env_pairs(args.env)) as server:
+            print(f"Server ready at {server.url} ({args.workers} worker(s), dummy weights)")
+            steps = asyncio.run(run_steps(server.url, args, uploads))
+
+    saturation = find_saturation(steps, args.slo_ms, args.max_error_rate, args.min_gain)
+    if saturation:
+        print(f"Saturated at {saturation['load']:g} ({saturation['mode']} loop): {saturation['reason']}; "
+              f"max throughput {saturation['max_throughput_rps']:.2f} req/s")
+    else:
+        print("No saturation within the tested load range")
+
+    if args.output:
+        report = {
+            "target": args.url or "local",
+            "endpoint": args.endpoint,
+            "workers": None if args.url else args.workers,
+            "env": _env_pairs(args.env),
+            "clip_seconds": args.clip_seconds,
+            "format": args.format,
+            "step_seconds": args.duration,
+            "steps": steps,
+            "saturation": saturation,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Post-training static int8 quantization of trained Audio2EmotionModel weights.
+
+Calibrates on a sample of preprocessed spectrograms, saves the int8 TorchScript
+artifact served by INFERENCE_BACKEND=quantized, and reports the per-emotion
+error (in rating units, 1 ~ 7.83) and the speedup against the float model on
+held-out spectrograms.
+
+Usage (from backend/):
+    python -m scripts.quantize weights/best.pth weights/best.int8.pt \
+        --data data/spectrograms --calibration-samples 64 --eval-samples 64
+"""
+import argparse
+import json
+
+import torch
+from models.torch_models import Audio2EmotionModel
+from models.quantization import compare, load_calibration_set, load_quantized, quantize_static, save_quantized
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Int8 static quantization of Audio2EmotionModel")
+    parser.add_argument('weights', help='trained state dict (best.pth)')
+    parser.add_argument('output', help='int8 TorchScript artifact to write')
+    parser.add_argument('--data', default='data/spectrograms', help='spectrogram directory or feature store')
+    parser.add_argument('--calibration-samples', type=int, default=64)
+    parser.add_argument('--eval-samples', type=int, default=64, help='held-out samples for the error report')
+    parser.add_argument('--engine', default='x86', help="quantized engine: x86, fbgemm or qnnpack (ARM)")
+    parser.add_argument('--threads', type=int, default=None, help='torch threads for the comparison')
+    parser.add_argument('--report', default=None, help='write the comparison as JSON here')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = Audio2EmotionModel()
+    model.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    model.eval()
+
+    calibration = load_calibration_set(args.data, args.calibration_samples)
+    print(f"Calibrating on {len(calibration)} spectrograms from {args.data} ({args.engine})")
+    quantized = quantize_static(model, calibration, backend=args.engine)
+    save_quantized(quantized, args.output, backend=args.engine)
+    print(f"Saved int8 model to {args.output}")
+
+    # held-out: the samples right after the calibration ones in the same shuffled order
+    held_out = load_calibration_set(args.data, args.eval_samples, offset=args.calibration_samples)
+
+    def float_forward(inputs):
+        with torch.no_grad():
+            return model(torch.from_numpy(inputs)).reshape(len(inputs), -1).numpy()
+
+    report = compare(float_forward, load_quantized(args.output), held_out)
+    report.update(weights=args.weights, artifact=args.output, engine=args.engine,
+                  calibration_samples=len(calibration))
+
+    print(f"\nInt8 vs float on {report['samples']} held-out spectrograms (rating units):")
+    print(f"{'emotion':>10} {'mean err':>10} {'max err':>10}")
+    for label, mean_error in report['mean_abs_error'].items():
+        print(f"{label:>10} {mean_error:>10.4f} {report['max_abs_error'][label]:>10.4f}")
+    print(f"\nfloat {report['float_seconds_per_sample'] * 1000:.1f} ms/sample, "
+          f"int8 {report['int8_seconds_per_sample'] * 1000:.1f} ms/sample, speedup {report['speedup']:.2f}x")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
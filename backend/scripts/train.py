@@ -1,237 +1,538 @@
-# """
-# Author: Jeffrey Luo, Monta Vista High School, Cupertino, CA
-# Date Created: 09/2023
-# Copyright (c) 2023 Jeff Luo
-# License: MIT
-# """
-# import torch
-# import tensorboard
-# import os
-# from tqdm import tqdm
-# import torch.nn as nn
-# import torch.optim as optim
-# from torch.utils.tensorboard import SummaryWriter
-
-# from model_torch import Audio2EmotionModel
-# from datasets import build_default_dataloader
-
-# import torch
-# torch.cuda.device_count()  # This will throw an error if CUDA is not available
-# torch.device("cpu")
-# def train():
-#     """
-#     Train loop
-#     """
-#     # get all data names
-#     data_list = os.listdir('data/spectrograms')
-#     data_list = [ f.split('.')[0] for f in data_list]
-
-#     # prepare train/val data
-#     train_valid_split = 0.8
-#     cut_off = int(len(data_list)*train_valid_split)
-#     train_list = data_list[:cut_off]
-#     val_list = data_list[cut_off:]
-
-#     print(f'Training Set:{len(train_list)}, Validation Set:{len(val_list)}')
-
-#     # init train/val dataloader
-#     train_loader = build_default_dataloader(train_list)
-#     val_loader = build_default_dataloader(val_list)
-
-#     # init model
-#     model = Audio2EmotionModel()
-#     model.to('cuda')
-
-#     # loss
-#     criterion = nn.CrossEntropyLoss()
-
-#     # set up optimizer
-#     learning_rate = 0.0005
-#     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
-
-#     # Training setting
-#     num_epochs = 1000
-
-#     early_stop_patience = 50
-#     early_stop_delta = 1e-3
-#     early_stop_counter = 0
-
-#     model_save_path = 'weights/'
-#     best_loss = float('inf')
-
-#     # tensorboard support
-#     writer = SummaryWriter('train_log/')
-
-#     # train loop
-#     for epoch in range(num_epochs):
-        
-#         # set to train mode
-#         model.train()
-#         data_loop = tqdm(enumerate(train_loader), total=len(train_loader), leave=False)
-#         data_loop.set_description(f'Epoch [{epoch}/{num_epochs}]')
-#         for idx, (data, target) in data_loop:
-#             data = data.to('cuda')
-#             target = target.to('cuda')
-
-#             # loss compute
-#             pred = model(data)
-#             loss = criterion(pred, target)
-
-#             # backpropagation
-#             loss.backward()
-#             optimizer.step()
-#             optimizer.zero_grad()
-
-#             data_loop.set_postfix(loss=loss.item())
-            
-#             writer.add_scalar('Train Loss', loss.item(), idx+len(data_loop)*epoch)
-
-#         # validation loop
-#         val_loop = tqdm(val_loader, total=len(val_loader))
-#         val_loop.set_description(f'Validation [{epoch}/{num_epochs}]')
-#         val_losses = 0
-#         model.eval()
-#         with torch.no_grad():
-#             for data, target in val_loop:
-#                 data, target = data.to('cuda'), target.to('cuda')
-#                 pred = model(data)
-#                 val_losses += criterion(pred, target).item()
-                
-#         val_losses /= len(val_loader)
-#         writer.add_scalar('Val Loss', val_losses, epoch)
-
-#         # save at the end of epoch
-#         torch.save(model.state_dict(), os.path.join(model_save_path, 'last.pth'))
-            
-#         # early stop checking and saving
-#         if best_loss - val_losses > early_stop_delta:
-#             # reset counter if loss improves
-#             early_stop_counter = 0
-#             best_loss = val_losses
-#             # save the best check early stop condition
-#             torch.save(model.state_dict(), os.path.join(model_save_path, f'best.pth'))
-#         else:
-#             # if loss no improvement (best_loss - val_losses <= early_stop_delta)
-#             early_stop_counter+=1
-#             if early_stop_counter > early_stop_patience:
-#                 print(f'Early stop@epoch{epoch}')
-#                 break
-
-
-# if __name__ == '__main__':
-#     train()
-
-
-import torch
-import tensorboard
+"""
+Train Audio2EmotionModel on preprocessed spectrograms (CPU oriented).
+
+- bf16 autocast for the forward pass and loss (--bf16), fp32 weights and optimizer
+- gradient accumulation: larger effective batches without the memory (--accumulation-steps)
+- explicit intra/inter-op thread counts for torch (--threads, --interop-threads)
+- checkpoints written by a background thread, training continues while they hit the disk
+- --resume continues from a checkpoint: weights, optimizer, epoch, early-stop state and RNGs
+- per-epoch report of samples/s, data-loading stall and time blocked on checkpoints
+- --synthetic N trains on random data, to measure throughput without the dataset
+- data-parallel training (DistributedDataParallel over gloo) across processes and
+  machines, launched by torchrun or locally with --nproc
+
+best.pth is a plain state dict (what the API loads); last.ckpt holds the full
+training state for --resume.
+
+Distributed runs: every rank trains on its DistributedSampler shard with
+--batch-size samples per step (effective batch = batch size x accumulation steps
+x world size, the learning rate is not rescaled). Only rank 0 writes checkpoints
+and decides on early stopping, the decision is broadcast to all ranks.
+BatchNorm statistics stay per rank (SyncBatchNorm needs GPUs). Torch threads
+default to the cores divided by the processes on the machine. Rank 0 writes
+scaling_report.json (global and per-rank samples/s, data stall) to --save-dir.
+
+Usage (from backend/):
+    python -m scripts.train --data data/spectrograms --epochs 100 --batch-size 32 --bf16 --threads 16
+    python -m scripts.train --resume weights/last.ckpt --epochs 200
+    python -m scripts.train --synthetic 512 --epochs 2 --batch-size 16 --bf16
+    # 4 local processes (no torchrun needed)
+    python -m scripts.train --nproc 4 --synthetic 256 --synthetic-shape 64x128 --epochs 2
+    # 2 machines x 8 processes
+    torchrun --nnodes 2 --nproc-per-node 8 --rdzv-backend c10d --rdzv-endpoint host0:29500 \
+        -m scripts.train --data data/features --bf16
+"""
+import argparse
+import contextlib
+import copy
+import json
 import os
-from tqdm import tqdm
+import queue
+import random
+import socket
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.tensorboard import SummaryWriter
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
 
-from model_torch import Audio2EmotionModel
-from datasets import build_default_dataloader
-
-def train():
-    """
-    Train loop
-    """
-    # get all data names
-    data_list = os.listdir('data/spectrograms')
-    data_list = [f.split('.')[0] for f in data_list]
+from models.torch_models import Audio2EmotionModel
+from models.feature_store import FeatureStore
+from datasets import SyntheticEmotionDataset, build_default_dataloader, wrap_dataloader
 
-    # prepare train/val data
-    train_valid_split = 0.8
-    cut_off = int(len(data_list)*train_valid_split)
-    train_list = data_list[:cut_off]
-    val_list = data_list[cut_off:]
+CHECKPOINT_FORMAT = 'audio2emotion-train-v1'
 
-    print(f'Training Set:{len(train_list)}, Validation Set:{len(val_list)}')
+LOSSES = {
+    # annotations are continuous ratings: a regression loss (the old trainer used cross entropy)
+    'mse': nn.MSELoss,
+    'l1': nn.L1Loss,
+    'huber': nn.HuberLoss,
+}
 
-    # init train/val dataloader
-    train_loader = build_default_dataloader(train_list)
-    val_loader = build_default_dataloader(val_list)
 
-    # init model
-    model = Audio2EmotionModel()
-    model.to('cpu')  # Move model to CPU
-
-    # loss
-    criterion = nn.CrossEntropyLoss()
-
-    # set up optimizer
-    learning_rate = 0.0005
-    optimizer = optim.Adam(model.parameters(), lr=learning_rate)
-
-    # Training setting
-    num_epochs = 5
+class AsyncCheckpointer:
+    """
+    Writes checkpoints on a background thread. `save` only snapshots the state
+    (tensor copies in memory), serialization and disk I/O overlap with training.
+    A single pending write is kept: a newer checkpoint of the same file replaces
+    an older one that has not started yet.
+    """
+    def __init__(self) -> None:
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='checkpointer', daemon=True)
+        self._thread.start()
+
+    def save(self, state:dict, path:str):
+        if self._error is not None:
+            raise RuntimeError(f"Previous checkpoint failed: {self._error}")
+        snapshot = _snapshot(state)
+        with self._lock:
+            replaced = path in self._pending
+            self._pending[path] = snapshot
+        if not replaced:
+            self._queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            with self._lock:
+                state = self._pending.pop(path)
+            try:
+                # write then rename: a crash mid-write never leaves a truncated checkpoint
+                tmp_path = f'{path}.tmp'
+                torch.save(state, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                self._error = e
+                print(f"❌ Failed to write checkpoint {path}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk"""
+        self._queue.join()
+        if self._error is not None:
+            raise RuntimeError(f"Checkpoint failed: {self._error}")
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _snapshot(state):
+    """Copy of a (nested) state with detached tensor clones, safe to serialize while training goes on"""
+    if isinstance(state, torch.Tensor):
+        return state.detach().clone()
+    if isinstance(state, dict):
+        return {key: _snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_snapshot(value) for value in state)
+    return copy.deepcopy(state)
+
+
+def sample_names(data_path:str) -> list:
+    """Sample names of a spectrogram folder ('12' for 12.mp3.npy) or a feature store"""
+    if FeatureStore.is_store(data_path):
+        return list(FeatureStore(data_path).names)
+    # skip the preprocessing manifest/report that live next to the spectrograms
+    names = [f.split('.')[0] for f in os.listdir(data_path) if f.endswith('.npy')]
+    return sorted(names, key=lambda name: int(name) if name.isdigit() else name)
+
+
+def build_loaders(args, distributed:bool=False):
+    """Train and validation loaders, from the dataset or synthetic data, sharded across ranks if distributed"""
+    options = dict(batch_size=args.batch_size, num_workers=args.num_workers,
+                   persistent_workers=args.num_workers > 0, prefetch_factor=args.prefetch_factor,
+                   distributed=distributed, seed=args.seed)
+    if args.synthetic:
+        cut_off = int(args.synthetic * args.train_split)
+        train_set = SyntheticEmotionDataset(cut_off, args.synthetic_shape, seed=args.seed)
+        val_set = SyntheticEmotionDataset(args.synthetic - cut_off, args.synthetic_shape, seed=args.seed + cut_off)
+        return (wrap_dataloader(train_set, shuffle=True, name='train', **options),
+                wrap_dataloader(val_set, shuffle=False, name='val', **options))
+
+    data_list = sample_names(args.data)
+    # same split on every run (and on resume)
+    random.Random(args.seed).shuffle(data_list)
+    cut_off = int(len(data_list) * args.train_split)
+    anno_path = args.annotations or None
+    train_loader = build_default_dataloader(data_list[:cut_off], args.data, anno_path, shuffle=True,
+                                            lazy=args.lazy, name='train', **options)
+    val_loader = build_default_dataloader(data_list[cut_off:], args.data, anno_path, shuffle=False,
+                                          lazy=args.lazy, name='val', **options)
+    return train_loader, val_loader
+
+
+def _distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def init_distributed(timeout_minutes:float=30.0) -> tuple:
+    """
+    Join the gloo process group when started by torchrun (or --nproc), which
+    set RANK / WORLD_SIZE / MASTER_ADDR / MASTER_PORT
 
-    early_stop_patience = 50
-    early_stop_delta = 1e-3
-    early_stop_counter = 0
+    Returns:
+        tuple: (rank, world size, processes on this machine), (0, 1, 1) for a single process
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size > 1 and not _distributed():
+        dist.init_process_group('gloo', timeout=timedelta(minutes=timeout_minutes))
+    if not _distributed():
+        return 0, 1, 1
+    return dist.get_rank(), dist.get_world_size(), int(os.environ.get('LOCAL_WORLD_SIZE', dist.get_world_size()))
+
+
+def _all_reduce(values:list, op=None) -> list:
+    """Sum (or op) of per-rank values, the values themselves outside a process group"""
+    if not _distributed():
+        return list(values)
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=op or dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def _gather(values:list) -> list:
+    """Per-rank lists of values, indexed by rank"""
+    if not _distributed():
+        return [list(values)]
+    tensor = torch.tensor(values, dtype=torch.float64)
+    gathered = [torch.zeros_like(tensor) for _ in range(dist.get_world_size())]
+    dist.all_gather(gathered, tensor)
+    return [t.tolist() for t in gathered]
+
+
+def _broadcast(values:list) -> list:
+    """Values of rank 0 on every rank"""
+    if not _distributed():
+        return list(values)
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.broadcast(tensor, src=0)
+    return tensor.tolist()
+
+
+def _rng_state() -> dict:
+    return {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'python': random.getstate()}
+
+
+def _set_rng_state(state:dict):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+
+
+def _autocast(enabled:bool):
+    return torch.autocast('cpu', dtype=torch.bfloat16) if enabled else contextlib.nullcontext()
+
+
+def _compute_loss(model, criterion, data, target, args):
+    if args.channels_last:
+        data = data.contiguous(memory_format=torch.channels_last)
+    with _autocast(args.bf16):
+        pred = model(data)
+    # loss in fp32; the model squeezes away the batch dim of a single-sample batch
+    return criterion(pred.float().reshape(target.shape), target)
+
+
+def train_epoch(model, loader, criterion, optimizer, args, epoch:int, writer=None) -> float:
+    """One pass over the training data, returns the mean loss"""
+    model.train()
+    total_loss, num_batches = 0.0, 0
+    steps_per_epoch = len(loader)
+    optimizer.zero_grad(set_to_none=True)
+    for idx, (data, target) in enumerate(loader):
+        step_now = (idx + 1) % args.accumulation_steps == 0 or idx + 1 == steps_per_epoch
+        # DDP all-reduces gradients on backward: skip it until the accumulation step
+        no_sync = not step_now and isinstance(model, DistributedDataParallel)
+        with model.no_sync() if no_sync else contextlib.nullcontext():
+            loss = _compute_loss(model, criterion, data, target, args)
+            # scaled so accumulated gradients average over the effective batch
+            (loss / args.accumulation_steps).backward()
+
+        if step_now:
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+        loss_value = loss.item()
+        total_loss += loss_value
+        num_batches += 1
+        step = epoch * steps_per_epoch + idx
+        if writer is not None and step % args.log_every == 0:
+            writer.add_scalar('Train Loss', loss_value, step)
+    total_loss, num_batches = _all_reduce([total_loss, num_batches])
+    return total_loss / max(1, num_batches)
+
+
+def evaluate(model, loader, criterion, args) -> float:
+    """Mean validation loss"""
+    model.eval()
+    total_loss, num_batches = 0.0, 0
+    with torch.no_grad():
+        for data, target in loader:
+            total_loss += _compute_loss(model, criterion, data, target, args).item()
+            num_batches += 1
+    # mean over all ranks' shards (DistributedSampler pads the last one with repeated samples)
+    total_loss, num_batches = _all_reduce([total_loss, num_batches])
+    return total_loss / max(1, num_batches)
+
+
+def train(args):
+    """
+    Train loop, run by every rank of a distributed job
+    """
+    rank, world_size, local_world_size = init_distributed(args.dist_timeout)
+    is_main = rank == 0
+    log = print if is_main else (lambda *_, **__: None)
 
-    model_save_path = 'weights/'
+    # same initial weights everywhere (DDP broadcasts rank 0's anyway), per-rank dropout / augmentation RNG
+    torch.manual_seed(args.seed)
+    model = Audio2EmotionModel()
+    torch.manual_seed(args.seed + rank)
+    np.random.seed(args.seed + rank)
+    random.seed(args.seed + rank)
+
+    threads = args.threads or (max(1, (os.cpu_count() or 1) // local_world_size) if world_size > 1 else 0)
+    if threads:
+        torch.set_num_threads(threads)
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
+    if is_main:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    train_loader, val_loader = build_loaders(args, distributed=world_size > 1)
+    # stall is part of the epoch report below
+    train_loader.report = val_loader.report = False
+    log(f'Training Set:{len(train_loader.dataset)}, Validation Set:{len(val_loader.dataset)}, '
+        f'batch {args.batch_size} x {args.accumulation_steps} accumulation steps x {world_size} rank(s), '
+        f'{torch.get_num_threads()} torch threads per rank, bf16 {"on" if args.bf16 else "off"}')
+
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    criterion = LOSSES[args.loss]()
+    optimizer = optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+
+    start_epoch = 0
     best_loss = float('inf')
-
-    # tensorboard support
-    writer = SummaryWriter('train_log/')
-
-    # train loop
-    for epoch in range(num_epochs):
-        
-        # set to train mode
-        model.train()
-        data_loop = tqdm(enumerate(train_loader), total=len(train_loader), leave=False)
-        data_loop.set_description(f'Epoch [{epoch}/{num_epochs}]')
-        for idx, (data, target) in data_loop:
-            data = data.to('cpu')  # Move data to CPU
-            target = target.to('cpu')  # Move target to CPU
-
-            # loss compute
-            pred = model(data)
-            loss = criterion(pred, target)
-
-            # backpropagation
-            loss.backward()
-            optimizer.step()
-            optimizer.zero_grad()
-
-            data_loop.set_postfix(loss=loss.item())
-            
-            writer.add_scalar('Train Loss', loss.item(), idx+len(data_loop)*epoch)
-
-        # validation loop
-        val_loop = tqdm(val_loader, total=len(val_loader))
-        val_loop.set_description(f'Validation [{epoch}/{num_epochs}]')
-        val_losses = 0
-        model.eval()
-        with torch.no_grad():
-            for data, target in val_loop:
-                data, target = data.to('cpu'), target.to('cpu')  # Move data and target to CPU
-                pred = model(data)
-                val_losses += criterion(pred, target).item()
-                
-        val_losses /= len(val_loader)
-        writer.add_scalar('Val Loss', val_losses, epoch)
-
-        # save at the end of epoch
-        torch.save(model.state_dict(), os.path.join(model_save_path, 'last.pth'))
-            
-        # early stop checking and saving
-        if best_loss - val_losses > early_stop_delta:
-            # reset counter if loss improves
-            early_stop_counter = 0
-            best_loss = val_losses
-            # save the best check early stop condition
-            torch.save(model.state_dict(), os.path.join(model_save_path, f'best.pth'))
-        else:
-            # if loss no improvement (best_loss - val_losses <= early_stop_delta)
-            early_stop_counter+=1
-            if early_stop_counter > early_stop_patience:
-                print(f'Early stop@epoch{epoch}')
+    early_stop_counter = 0
+    if args.resume:
+        # every rank loads the same file, optimizer state is per rank
+        checkpoint = torch.load(args.resume, map_location='cpu', weights_only=False)
+        if checkpoint.get('format') != CHECKPOINT_FORMAT:
+            raise ValueError(f"{args.resume} is not a training checkpoint (use last.ckpt, not best.pth)")
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        start_epoch = checkpoint['epoch'] + 1
+        best_loss = checkpoint['best_loss']
+        early_stop_counter = checkpoint['early_stop_counter']
+        if world_size == 1:
+            _set_rng_state(checkpoint['rng'])
+        log(f'Resumed from {args.resume} at epoch {start_epoch} (best val loss {best_loss:.4f})')
+
+    core_model = model
+    if world_size > 1:
+        model = DistributedDataParallel(model)
+
+    writer = None
+    if args.tensorboard and is_main:
+        from torch.utils.tensorboard import SummaryWriter
+        writer = SummaryWriter(args.tensorboard)
+
+    scaling = []
+    checkpointer = AsyncCheckpointer() if is_main else None
+    try:
+        for epoch in range(start_epoch, args.epochs):
+            train_loader.set_epoch(epoch)
+            epoch_start = time.perf_counter()
+            train_loss = train_epoch(model, train_loader, criterion, optimizer, args, epoch, writer)
+            train_time = time.perf_counter() - epoch_start
+            val_loss = evaluate(model, val_loader, criterion, args)
+
+            # decided on rank 0 and broadcast, so all ranks stop in the same epoch
+            improved = stop = False
+            checkpoint_time = 0.0
+            if is_main:
+                improved = best_loss - val_loss > args.min_delta
+                if improved:
+                    # reset counter if loss improves
+                    early_stop_counter = 0
+                    best_loss = val_loss
+                else:
+                    early_stop_counter += 1
+                stop = early_stop_counter > args.patience
+
+                # only the snapshot blocks training, the write happens in the background
+                checkpoint_start = time.perf_counter()
+                if improved:
+                    checkpointer.save(core_model.state_dict(), os.path.join(args.save_dir, 'best.pth'))
+                if (epoch + 1) % args.checkpoint_every == 0 or epoch + 1 == args.epochs or stop:
+                    checkpointer.save({
+                        'format': CHECKPOINT_FORMAT,
+                        'epoch': epoch,
+                        'model': core_model.state_dict(),
+                        'optimizer': optimizer.state_dict(),
+                        'best_loss': best_loss,
+                        'early_stop_counter': early_stop_counter,
+                        'rng': _rng_state(),
+                        'args': vars(args),
+                    }, os.path.join(args.save_dir, 'last.ckpt'))
+                checkpoint_time = time.perf_counter() - checkpoint_start
+            improved, stop = (bool(flag) for flag in _broadcast([improved, stop]))
+
+            # per-rank throughput and stall, the slowest rank sets the pace of the job
+            ranks = _gather([train_loader.last_num_samples, train_time, train_loader.last_stall_time])
+            samples = sum(r[0] for r in ranks)
+            epoch_seconds = max(r[1] for r in ranks)
+            epoch_scaling = {
+                'epoch': epoch,
+                'samples_per_s': round(samples / epoch_seconds, 2),
+                'rank_samples_per_s': [round(r[0] / r[1], 2) for r in ranks],
+                'rank_stall_ratio': [round(r[2] / r[1], 4) for r in ranks],
+                'train_seconds': round(epoch_seconds, 2),
+            }
+            scaling.append(epoch_scaling)
+
+            ranks_note = ''
+            if world_size > 1:
+                ranks_note = f' ({world_size} ranks, slowest {min(epoch_scaling["rank_samples_per_s"]):.1f}/s)'
+            log(f'Epoch [{epoch}/{args.epochs}] train loss {train_loss:.4f}, val loss {val_loss:.4f}'
+                f'{" (best)" if improved else ""} | {epoch_scaling["samples_per_s"]:.1f} samples/s{ranks_note}, '
+                f'data stall {max(epoch_scaling["rank_stall_ratio"]):.1%}, '
+                f'checkpoint snapshot {checkpoint_time:.2f}s, epoch {time.perf_counter() - epoch_start:.1f}s')
+            if writer is not None:
+                writer.add_scalar('Val Loss', val_loss, epoch)
+                writer.add_scalar('Samples per Second', epoch_scaling['samples_per_s'], epoch)
+                writer.add_scalar('Data Stall Ratio', max(epoch_scaling['rank_stall_ratio']), epoch)
+
+            if stop:
+                log(f'Early stop@epoch{epoch}')
                 break
+    finally:
+        if checkpointer is not None:
+            checkpointer.close()
+        if writer is not None:
+            writer.close()
+
+    if is_main and scaling:
+        write_scaling_report(os.path.join(args.save_dir, 'scaling_report.json'), scaling, args,
+                             world_size, torch.get_num_threads())
+    if _distributed():
+        dist.barrier()
+        dist.destroy_process_group()
+    return best_loss
+
+
+def write_scaling_report(path:str, scaling:list, args, world_size:int, threads:int) -> dict:
+    """
+    Throughput of the run per epoch and overall. With --baseline-throughput
+    (samples/s of a single-process run) the scaling efficiency is
+    samples/s / (world size x baseline).
+    """
+    # the first epoch includes worker startup and allocator warm-up
+    steady = scaling[1:] or scaling
+    mean_throughput = sum(epoch['samples_per_s'] for epoch in steady) / len(steady)
+    report = {
+        'world_size': world_size,
+        'backend': 'gloo' if world_size > 1 else None,
+        'threads_per_rank': threads,
+        'batch_size_per_rank': args.batch_size,
+        'effective_batch_size': args.batch_size * args.accumulation_steps * world_size,
+        'bf16': args.bf16,
+        'samples_per_s': round(mean_throughput, 2),
+        'samples_per_s_per_rank': round(mean_throughput / world_size, 2),
+        'epochs': scaling,
+    }
+    if args.baseline_throughput:
+        report['baseline_samples_per_s'] = args.baseline_throughput
+        report['speedup'] = round(mean_throughput / args.baseline_throughput, 3)
+        report['scaling_efficiency'] = round(mean_throughput / (world_size * args.baseline_throughput), 3)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    summary = f'{report["samples_per_s"]:.1f} samples/s on {world_size} rank(s)'
+    if args.baseline_throughput:
+        summary += f', speedup {report["speedup"]:.2f}x, scaling efficiency {report["scaling_efficiency"]:.0%}'
+    print(f'Scaling report: {summary} -> {path}')
+    return report
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _spawned_rank(local_rank:int, args, nproc:int, port:int):
+    # the environment torchrun would set up for a single-machine job
+    os.environ.update(RANK=str(local_rank), LOCAL_RANK=str(local_rank), WORLD_SIZE=str(nproc),
+                      LOCAL_WORLD_SIZE=str(nproc), MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    train(args)
+
+
+def launch_local(args):
+    """Run `args.nproc` ranks as local processes, e.g. to test distributed training on one machine"""
+    mp.spawn(_spawned_rank, args=(args, args.nproc, _free_port()), nprocs=args.nproc, join=True)
+
+
+def _shape(value:str) -> tuple:
+    return tuple(int(size) for size in value.lower().split('x'))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train Audio2EmotionModel")
+    data = parser.add_argument_group('data')
+    data.add_argument('--data', default='data/spectrograms', help='spectrogram folder or feature store')
+    data.add_argument('--annotations', default='data/mean_ratings_set1.csv',
+                      help="annotation csv, '' to use a feature store's annotations")
+    data.add_argument('--synthetic', type=int, default=0, help='train on N random samples instead of --data')
+    data.add_argument('--synthetic-shape', type=_shape, default=(256, 1292),
+                      help='spectrogram shape of synthetic samples, e.g. 64x128 for quick tests')
+    data.add_argument('--train-split', type=float, default=0.8)
+    data.add_argument('--lazy', action='store_true', help='load spectrograms on demand')
+    data.add_argument('--num-workers', type=int, default=2, help='dataloader worker processes')
+    data.add_argument('--prefetch-factor', type=int, default=None)
+
+    optimization = parser.add_argument_group('optimization')
+    optimization.add_argument('--epochs', type=int, default=1000)
+    optimization.add_argument('--batch-size', type=int, default=8)
+    optimization.add_argument('--accumulation-steps', type=int, default=1,
+                              help='batches per optimizer step (effective batch = batch size x steps)')
+    optimization.add_argument('--lr', type=float, default=0.0005)
+    optimization.add_argument('--weight-decay', type=float, default=0.0)
+    optimization.add_argument('--loss', choices=sorted(LOSSES), default='mse')
+    optimization.add_argument('--patience', type=int, default=50, help='early stop patience in epochs')
+    optimization.add_argument('--min-delta', type=float, default=1e-3, help='minimum val loss improvement')
+    optimization.add_argument('--seed', type=int, default=0)
+
+    performance = parser.add_argument_group('performance')
+    performance.add_argument('--bf16', action='store_true', help='bf16 autocast on CPU')
+    performance.add_argument('--channels-last', action='store_true')
+    performance.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0 = default)')
+    performance.add_argument('--interop-threads', type=int, default=0, help='torch inter-op threads (0 = default)')
+
+    distributed = parser.add_argument_group('distributed')
+    distributed.add_argument('--nproc', type=int, default=0,
+                             help='spawn this many local ranks (gloo), instead of launching with torchrun')
+    distributed.add_argument('--dist-timeout', type=float, default=30.0, help='collective timeout in minutes')
+    distributed.add_argument('--baseline-throughput', type=float, default=None,
+                             help='single-process samples/s, for the scaling efficiency in the report')
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--save-dir', default='weights/')
+    output.add_argument('--checkpoint-every', type=int, default=1, help='epochs between last.ckpt writes')
+    output.add_argument('--resume', default=None, help='training checkpoint (last.ckpt) to continue from')
+    output.add_argument('--tensorboard', default=None, help='tensorboard log dir, off when unset')
+    output.add_argument('--log-every', type=int, default=50, help='steps between tensorboard train loss points')
+
+    args = parser.parse_args(argv)
+    args.accumulation_steps = max(1, args.accumulation_steps)
+    args.checkpoint_every = max(1, args.checkpoint_every)
+    return args
 
 
 if __name__ == '__main__':
-    train()
\ No newline at end of file
+    args = parse_args()
+    if args.nproc > 1:
+        launch_local(args)
+    else:
+        train(args)
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from app.core.batching import BatchScheduler, QueueFullError
+
+
+def _spectrogram(value):
+    return np.full((1, 4, 4), value, dtype=np.float32)
+
+
+def _recording_predict(batches):
+    def predict(inputs):
+        batches.append(len(inputs))
+        return [{"value": float(spec[0, 0, 0])} for spec in inputs]
+    return predict
+
+
+def test_requests_are_coalesced_up_to_max_batch_size():
+    batches = []
+    scheduler = BatchScheduler(_recording_predict(batches), max_batch_size=4, max_wait_ms=50)
+
+    async def run():
+        await scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(_spectrogram(i)) for i in range(10)))
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    # every caller gets its own result back
+    assert results == [{"value": float(i)} for i in range(10)]
+    assert batches == [4, 4, 2]
+    assert scheduler.stats()["batch_size_histogram"] == {"2": 1, "4": 2}
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    batches = []
+    scheduler = BatchScheduler(_recording_predict(batches), max_batch_size=8, max_wait_ms=50)
+
+    async def run():
+        await scheduler.start()
+        try:
+            start = time.perf_counter()
+            result = await scheduler.submit(_spectrogram(1))
+            return result, time.perf_counter() - start
+        finally:
+            await scheduler.stop()
+
+    result, elapsed = asyncio.run(run())
+    assert result == {"value": 1.0}
+    assert batches == [1]
+    # waited for company, but not much longer than max_wait
+    assert 0.045 <= elapsed < 1.0
+
+
+def test_failed_forward_pass_reaches_every_waiter():
+    calls = []
+
+    def predict(inputs):
+        calls.append(len(inputs))
+        raise RuntimeError("forward pass failed")
+
+    scheduler = BatchScheduler(predict, max_batch_size=3, max_wait_ms=50)
+
+    async def run():
+        await scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(_spectrogram(i)) for i in range(3)),
+                                        return_exceptions=True)
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    assert calls == [3]
+    assert all(isinstance(result, RuntimeError) and str(result) == "forward pass failed" for result in results)
+
+
+def test_full_queue_rejects_requests():
+    scheduler = BatchScheduler(_recording_predict([]), max_batch_size=1, max_wait_ms=0, max_queue_size=1)
+
+    async def run():
+        await scheduler.start()
+        try:
+            # the loop hasn't picked anything up yet: the second request finds the queue full
+            first = asyncio.ensure_future(scheduler.submit(_spectrogram(0)))
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFullError):
+                await scheduler.submit(_spectrogram(1))
+            return await first
+        finally:
+            await scheduler.stop()
+
+    assert asyncio.run(run()) == {"value": 0.0}
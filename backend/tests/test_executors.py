@@ -0,0 +1,38 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+pytest.importorskip("librosa")
+pytest.importorskip("soundfile")
+
+from app.core.executors import WorkerPool
+
+
+def test_pool_is_rebuilt_after_a_worker_crash():
+    from scripts.benchmark import encode, synthetic_signal
+
+    content = encode(synthetic_signal(2, seed=0), ".wav")
+    pool = WorkerPool(preprocess_workers=1)
+    pool.start()
+
+    async def run():
+        before = await pool.process_audio(content, ".wav")
+        for pid in list(pool._process_pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        # the broken pool is replaced and the request retried
+        after = await pool.process_audio(content, ".wav")
+        # a task that crashes every worker it runs on fails after one retry
+        with pytest.raises(RuntimeError, match="worker crashed"):
+            await pool._run_in_pool(os._exit, 1)
+        again = await pool.process_audio(content, ".wav")
+        return before, after, again
+
+    try:
+        before, after, again = asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+    assert (before == after).all() and (before == again).all()
+    assert pool.stats()["process_pool_restarts"] == 3
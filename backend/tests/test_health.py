@@ -0,0 +1,72 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("librosa")
+pytest.importorskip("soundfile")
+
+from app import main
+from app.api.routes import health, jobs, prediction
+from app.core.batching import BatchScheduler
+from app.core.config import settings
+from app.core.executors import WorkerPool
+from app.core.jobs import JobManager, JobStore
+from app.core.startup import StartupState
+from scripts.benchmark import write_dummy_weights
+
+
+@pytest.fixture
+def app_state(tmp_path, monkeypatch):
+    """Fresh startup state, in-process workers and a job store in tmp_path"""
+    state = StartupState()
+    monkeypatch.setattr(main, "startup_state", state)
+    monkeypatch.setattr(health, "startup_state", state)
+    pool = WorkerPool(preprocess_workers=0)
+    monkeypatch.setattr(prediction, "worker_pool", pool)
+    monkeypatch.setattr(prediction, "batch_scheduler", BatchScheduler(
+        prediction.model_handler.predict_batch, executor=pool.inference_executor
+    ))
+    monkeypatch.setattr(jobs, "job_manager", JobManager(JobStore(str(tmp_path / "jobs")), handlers={}))
+    monkeypatch.setattr(settings, "index_path", None)
+    return state
+
+
+def _wait_for_startup(client, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = client.get("/health/live").json()
+        if state["ready"] or state["error"]:
+            return
+        time.sleep(0.2)
+    raise TimeoutError("startup did not finish")
+
+
+def test_ready_only_after_startup(tmp_path, monkeypatch, app_state):
+    monkeypatch.setattr(settings, "model_path", write_dummy_weights(str(tmp_path / "best.pth")))
+
+    # lifespan not run yet: alive, but no traffic should be routed here
+    client = TestClient(main.app)
+    assert client.get("/health/live").status_code == 200
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "not ready"
+
+    with TestClient(main.app) as client:
+        _wait_for_startup(client)
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        state = response.json()
+        assert state["model_loaded"] and state["warmed_up"]
+        assert {"load_model", "warmup_preprocess", "warmup_inference", "warmup_timeline"} <= set(state["phases"])
+
+
+def test_failed_startup_is_not_alive(tmp_path, monkeypatch, app_state):
+    monkeypatch.setattr(settings, "model_path", str(tmp_path / "missing.pth"))
+
+    with TestClient(main.app) as client:
+        _wait_for_startup(client)
+        assert client.get("/health/ready").status_code == 503
+        response = client.get("/health/live")
+        assert response.status_code == 503
+        assert response.json()["error"]
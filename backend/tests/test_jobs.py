@@ -0,0 +1,106 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.core.jobs import CANCELLED, FAILED, QUEUED, SUCCEEDED, JobManager, JobStateError, JobStore
+
+
+async def _wait_finished(manager, job_id, timeout=10.0):
+    """Poll a job until it reaches a terminal status"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await manager.get(job_id)
+        if job["status"] in (SUCCEEDED, FAILED, CANCELLED):
+            return job
+        assert asyncio.get_running_loop().time() < deadline, f"job still {job['status']} after {timeout}s"
+        await asyncio.sleep(0.01)
+
+
+def test_jobs_run_and_cancel(tmp_path):
+    release = None
+
+    async def predict(content, file_extension, params):
+        # holds the single worker until the test lets it go
+        await release.wait()
+        return {"size": len(content), "extension": file_extension}
+
+    async def fail(content, file_extension, params):
+        raise ValueError("decode failed")
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        manager = JobManager(JobStore(str(tmp_path)), {"predict": predict, "fail": fail},
+                             concurrency=1, poll_interval=0.05)
+        await manager.start()
+        ok = await manager.submit("predict", b"audio", "a.wav", ".wav")
+        bad = await manager.submit("fail", b"audio", "b.wav", ".wav")
+        # queued behind "ok", which holds the single worker until release, so still cancellable
+        cancelled = await manager.submit("predict", b"audio", "c.wav", ".wav")
+        assert (await manager.cancel(cancelled["id"]))["status"] == CANCELLED
+        release.set()
+        finished = [await _wait_finished(manager, job["id"]) for job in (ok, bad, cancelled)]
+        await manager.stop()
+        return finished, manager
+
+    (ok, bad, cancelled), manager = asyncio.run(run())
+    assert ok["status"] == SUCCEEDED and ok["result"] == {"size": 5, "extension": ".wav"}
+    assert bad["status"] == FAILED and bad["error"] == "decode failed"
+    with pytest.raises(JobStateError):
+        asyncio.run(manager.cancel(ok["id"]))
+    assert cancelled["status"] == CANCELLED
+
+
+def test_only_expired_jobs_are_requeued(tmp_path):
+    store = JobStore(str(tmp_path))
+    store.initialize()
+    job = store.create("predict", b"audio", "a.wav", ".wav")
+    assert store.claim_next("worker-1")["id"] == job["id"]
+    assert store.claim_next("worker-2") is None
+
+    # another process starting up leaves a job with a live lease alone
+    other = JobStore(str(tmp_path))
+    other.initialize()
+    assert other.requeue_expired(lease_seconds=60) == 0
+    store.heartbeat([job["id"]], "worker-1")
+    assert other.get(job["id"])["status"] == "running"
+
+    # once its owner stops renewing it, the job goes back to the queue
+    assert other.requeue_expired(lease_seconds=0) == 1
+    assert other.get(job["id"])["status"] == QUEUED
+    assert other.claim_next("worker-2")["id"] == job["id"]
+    # the first owner finishing late doesn't overwrite the new run
+    store.finish(job["id"], {"stale": True}, owner="worker-1")
+    assert other.get(job["id"])["status"] == "running"
+    other.finish(job["id"], {"ok": True}, owner="worker-2")
+    assert other.get(job["id"])["result"] == {"ok": True}
+
+
+def test_worker_survives_locked_database(tmp_path):
+    async def predict(content, file_extension, params):
+        return {"size": len(content)}
+
+    async def run():
+        store = JobStore(str(tmp_path))
+        manager = JobManager(store, {"predict": predict}, concurrency=1, poll_interval=0.01)
+        claim_next = store.claim_next
+        failures = iter([sqlite3.OperationalError("database is locked")] * 3)
+
+        def flaky_claim(owner):
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return claim_next(owner)
+
+        store.claim_next = flaky_claim
+        await manager.start()
+        job = await manager.submit("predict", b"audio", "a.wav", ".wav")
+        finished = await _wait_finished(manager, job["id"])
+        stats = manager.stats()
+        await manager.stop()
+        return finished, stats
+
+    finished, stats = asyncio.run(run())
+    assert finished["status"] == SUCCEEDED
+    assert stats["running_workers"] == 1
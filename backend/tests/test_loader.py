@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+pytest.importorskip("librosa")
+pytest.importorskip("soundfile")
+
+from models.preprocessing import Loader
+
+
+@pytest.fixture
+def temp_files(monkeypatch):
+    """Paths of the temp files the loader creates"""
+    created = []
+    named_temporary_file = tempfile.NamedTemporaryFile
+
+    def recording(*args, **kwargs):
+        tmp_file = named_temporary_file(*args, **kwargs)
+        created.append(tmp_file.name)
+        return tmp_file
+
+    monkeypatch.setattr("models.preprocessing.tempfile.NamedTemporaryFile", recording)
+    return created
+
+
+def _wav(tmp_path, seconds=3):
+    from scripts.benchmark import encode, synthetic_signal
+    path = tmp_path / "track.wav"
+    path.write_bytes(encode(synthetic_signal(seconds, seed=0), ".wav"))
+    return path
+
+
+def test_bytes_decode_in_memory_like_the_file(tmp_path, temp_files):
+    path = _wav(tmp_path)
+    loader = Loader(22050, 2, True)
+
+    from_file = loader.load(str(path))
+    from_bytes = loader.load(path.read_bytes(), ".wav")
+
+    np.testing.assert_array_equal(from_bytes, from_file)
+    assert len(from_bytes) == 2 * 22050
+    assert temp_files == []
+    assert loader.last_timings["temp_file_io"] == 0.0
+
+
+def test_disk_only_containers_go_through_a_temp_file(tmp_path, temp_files):
+    path = _wav(tmp_path)
+    loader = Loader(22050, 2, True)
+
+    # libsndfile reads the content whatever the suffix, only the extension sends it to disk
+    signal = loader.load(path.read_bytes(), ".m4a")
+
+    np.testing.assert_array_equal(signal, loader.load(str(path)))
+    assert len(temp_files) == 1 and temp_files[0].endswith(".m4a")
+    assert not os.path.exists(temp_files[0])
+
+
+def test_undecodable_bytes_fall_back_to_a_temp_file_and_clean_it_up(temp_files):
+    loader = Loader(22050, 2, True)
+
+    with pytest.raises(Exception):
+        loader.load(b"not audio at all" * 100, ".mp3")
+
+    # in-memory decoding failed, the path based decoders got their chance
+    # (tempfile is patched globally, the decoders' own temp files are listed too)
+    assert temp_files[0].endswith(".mp3")
+    assert not any(os.path.exists(name) for name in temp_files)
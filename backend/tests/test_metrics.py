@@ -0,0 +1,38 @@
+from app.core.metrics import MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("stage_seconds", "Stage latency", ["stage"], buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 2.0):
+        histogram.labels("decode").observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'stage_seconds_bucket{stage="decode",le="0.01"} 1' in lines
+    assert 'stage_seconds_bucket{stage="decode",le="0.1"} 3' in lines
+    assert 'stage_seconds_bucket{stage="decode",le="+Inf"} 4' in lines
+    assert 'stage_seconds_count{stage="decode"} 4' in lines
+
+
+def test_counters_and_collectors_render():
+    registry = MetricsRegistry()
+    errors = registry.counter("errors", "Errors by stage", ["stage"])
+    errors.labels("preprocess").inc()
+    errors.labels("preprocess").inc()
+    registry.add_collector(lambda: [("queue_size", "gauge", "Queue depth", [({}, 3)])])
+
+    text = registry.render()
+    # the family is named like its samples, otherwise Prometheus ingests them untyped
+    assert "# TYPE errors_total counter" in text
+    assert 'errors_total{stage="preprocess"} 2.0' in text
+    assert "queue_size 3" in text
+
+
+def test_unlabelled_metrics_render_before_first_use():
+    registry = MetricsRegistry()
+    registry.gauge("in_flight", "Requests being handled")
+    registry.counter("restarts", "Restarts")
+
+    lines = registry.render().splitlines()
+    assert "in_flight 0.0" in lines
+    assert "restarts_total 0.0" in lines
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import torch
+
+from app.core.config import settings
+from app.core.model_handler import ModelHandler
+from models.onnx_backend import sample_inputs
+from scripts.benchmark import write_dummy_weights
+
+
+@pytest.fixture
+def weights(tmp_path, monkeypatch):
+    # private (not memory-mapped) weights, so the optimized model is built by folding in memory
+    monkeypatch.setattr(settings, "mmap_weights", False)
+    monkeypatch.setattr(settings, "optimize_model", True)
+    monkeypatch.setattr(settings, "inference_backend", "torch")
+    return write_dummy_weights(str(tmp_path / "best.pth"))
+
+
+def _outputs(handler):
+    inputs = torch.from_numpy(sample_inputs(2))
+    with torch.no_grad():
+        plain = handler.model(inputs).numpy()
+    return plain, handler._forward(inputs)
+
+
+def test_optimized_model_is_served_when_it_matches(weights):
+    handler = ModelHandler()
+    handler.load_model(weights)
+
+    assert handler._inference_model is not None
+    plain, served = _outputs(handler)
+    np.testing.assert_allclose(served, plain, atol=settings.parity_tolerance)
+
+
+def test_optimization_failing_parity_falls_back_to_the_plain_model(weights, monkeypatch):
+    import models.optimization
+
+    optimize_for_inference = models.optimization.optimize_for_inference
+
+    def broken(model, sample, **kwargs):
+        optimized, info = optimize_for_inference(model, sample, **kwargs)
+        # e.g. a fold that got the BatchNorm statistics wrong
+        return (lambda x: optimized(x) + 0.5), info
+
+    monkeypatch.setattr(models.optimization, "optimize_for_inference", broken)
+    handler = ModelHandler()
+    handler.load_model(weights)
+
+    assert handler._inference_model is None
+    plain, served = _outputs(handler)
+    np.testing.assert_array_equal(served, plain)
@@ -0,0 +1,51 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("librosa")
+pytest.importorskip("soundfile")
+
+from models.preprocessing import Loader, LogSpectrogramExtractor, Padder, PreprocessingPipeline, Saver
+
+
+class _CrashingLoader(Loader):
+    """Kills the worker process on one file, like a decoder segfault"""
+    def load(self, file_path):
+        if "crash" in os.path.basename(file_path):
+            os._exit(1)
+        return super().load(file_path)
+
+
+def _pipeline(save_dir):
+    pipeline = PreprocessingPipeline()
+    pipeline.loader = _CrashingLoader(22050, 2, True)
+    pipeline.padder = Padder()
+    pipeline.extractor = LogSpectrogramExtractor(512, 256)
+    pipeline.saver = Saver(str(save_dir))
+    return pipeline
+
+
+def test_crashed_worker_fails_its_files_and_the_run_goes_on(tmp_path):
+    from scripts.benchmark import encode, synthetic_signal
+
+    audio_dir, save_dir = tmp_path / "audio", tmp_path / "spectrograms"
+    audio_dir.mkdir()
+    save_dir.mkdir()
+    names = ["a.wav", "b.wav", "c_crash.wav", "d.wav", "e.wav", "f.wav"]
+    for seed, name in enumerate(names):
+        (audio_dir / name).write_bytes(encode(synthetic_signal(1, seed=seed), ".wav"))
+
+    report = _pipeline(save_dir).process(str(audio_dir), num_workers=2, resume=False, batch_size=1)
+
+    assert report["processed"] == 5
+    assert [failure["file"] for failure in report["failures"]] == [str(audio_dir / "c_crash.wav")]
+    assert "crashed" in report["failures"][0]["error"]
+    with open(save_dir / PreprocessingPipeline.MANIFEST_FILE) as f:
+        manifest = json.load(f)
+    assert sorted(os.path.basename(path) for path in manifest["files"]) == [
+        name for name in names if "crash" not in name
+    ]
+    for path, entry in manifest["files"].items():
+        assert np.load(entry["output"], allow_pickle=True).shape[0] == 256
@@ -0,0 +1,106 @@
+import asyncio
+
+from app.core.prediction_cache import PredictionCache, build_fingerprint
+
+
+def test_memory_hit_and_lru_eviction():
+    cache = PredictionCache(max_entries=2)
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        return {"valence": value}
+
+    async def run():
+        for value in (1, 2, 1, 3, 2):
+            await cache.get_or_compute(cache.key(str(value).encode()), lambda: compute(value))
+
+    asyncio.run(run())
+    # 1 and 2 are computed, 1 is a hit, 3 evicts 2, so 2 is computed again
+    assert calls == [1, 2, 3, 2]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["evictions"] == 2
+
+
+def test_concurrent_identical_uploads_computed_once():
+    cache = PredictionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"valence": 4.2}
+
+    async def run():
+        key = cache.key(b"same audio")
+        return await asyncio.gather(*(cache.get_or_compute(key, compute) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [value for value, _ in results] == [{"valence": 4.2}] * 5
+    assert [cached for _, cached in results].count(False) == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    async def compute():
+        return {"valence": 3.0}
+
+    async def lookup(cache):
+        return await cache.get_or_compute(cache.key(b"track"), compute)
+
+    assert asyncio.run(lookup(PredictionCache(disk_dir=str(tmp_path)))) == ({"valence": 3.0}, False)
+    restarted = PredictionCache(disk_dir=str(tmp_path))
+    assert asyncio.run(lookup(restarted)) == ({"valence": 3.0}, True)
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_fingerprint_changes_key():
+    cache = PredictionCache()
+    cache.set_fingerprint(build_fingerprint("weights-a", {"hop_length": 256}))
+    key_a = cache.key(b"track")
+    cache.set_fingerprint(build_fingerprint("weights-a", {"hop_length": 512}))
+    assert cache.key(b"track") != key_a
+
+
+def test_disconnect_of_first_request_does_not_fail_coalesced_ones():
+    cache = PredictionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"valence": 5.0}
+
+    async def run():
+        key = cache.key(b"shared audio")
+        owner = asyncio.create_task(cache.get_or_compute(key, compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_compute(key, compute))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return await waiter, owner
+
+    result, owner = asyncio.run(run())
+    assert owner.cancelled()
+    assert result == ({"valence": 5.0}, True)
+    assert len(calls) == 1
+
+
+def test_computation_cancelled_when_every_request_leaves():
+    cache = PredictionCache()
+    finished = []
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return {"valence": 5.0}
+
+    async def run():
+        request = asyncio.create_task(cache.get_or_compute(cache.key(b"audio"), compute))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert finished == []
+    assert not cache._inflight
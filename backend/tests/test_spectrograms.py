@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("librosa")
+
+from models.preprocessing import LogSpectrogramExtractor
+
+SAMPLE_RATE = 22050
+
+
+def _signals(seconds=2.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))
+    # loud, 40 dB quieter (its top_db floor must not come from the loud one) and silent
+    return np.stack([tone, 0.01 * tone, np.zeros_like(t)]).astype(np.float32)
+
+
+def test_extract_batch_matches_extract():
+    extractor = LogSpectrogramExtractor(frame_size=512, hop_length=256)
+    signals = _signals()
+
+    batch = extractor.extract_batch(signals)
+
+    assert batch.shape == (3, 256, 1 + signals.shape[1] // 256)
+    assert batch.dtype == np.float32
+    for signal, spectrogram in zip(signals, batch):
+        np.testing.assert_allclose(spectrogram, extractor.extract(signal), atol=1e-3)
+    # top_db is relative to each item's own peak: a batch-wide floor would clip the quiet one
+    np.testing.assert_allclose(batch[1], batch[0] - 40.0, atol=1e-2)
+    # silence sits at the AMIN floor
+    assert np.all(batch[2] == pytest.approx(20 * np.log10(LogSpectrogramExtractor.AMIN)))
+
+
+def test_process_audio_batch_matches_single_files_and_reports_bad_ones():
+    pytest.importorskip("soundfile")
+    from app.core.audio_processor import AudioProcessor
+    from scripts.benchmark import encode, synthetic_signal
+
+    processor = AudioProcessor()
+    good = [encode(synthetic_signal(seconds, seed=seconds), ".wav") for seconds in (3, 20)]
+    spectrograms, errors, timings = processor.process_audio_batch(
+        [good[0], b"RIFF\x00\x00\x00\x00WAVEjunk", good[1]], [".wav", ".wav", ".wav"]
+    )
+
+    assert spectrograms.shape == (2, 1, 256, 1292)
+    assert errors[0] is None and errors[2] is None and errors[1].startswith("Audio processing failed")
+    assert "stft" in timings[-1]
+    for content, spectrogram in zip(good, spectrograms):
+        np.testing.assert_allclose(spectrogram, processor.process_audio(content, ".wav"), atol=1e-3)
+
+
+def _chunks(signal, size):
+    return (signal[start:start + size] for start in range(0, len(signal), size))
+
+
+def test_sliding_windows_match_extract_on_the_same_samples():
+    from models.preprocessing import SlidingWindowExtractor
+
+    extractor = LogSpectrogramExtractor(frame_size=512, hop_length=256)
+    tone = _signals(seconds=3.3)[0]
+    # 1 second windows every 43 frames (~0.5 s)
+    window_frames, hop_frames = 1 + SAMPLE_RATE // 256, 43
+    sliding = SlidingWindowExtractor(extractor, window_frames, hop_frames)
+
+    # chunk sizes unrelated to the hop, so frames straddle chunk boundaries
+    windows = list(sliding.windows(_chunks(tone, 5000)))
+
+    # 285 frames: full windows start at 0..172, the one at 215 only has 70 real frames
+    total_frames = 1 + len(tone) // 256
+    assert total_frames == 285
+    assert [start for start, _ in windows] == [0, 43, 86, 129, 172, 215]
+    for start, window in windows:
+        assert window.shape == (256, window_frames)
+        reference = extractor.extract(tone[start * 256:start * 256 + SAMPLE_RATE])
+        real_frames = min(window_frames, total_frames - start)
+        # the first and last frame of extract() see zero padding instead of the neighbouring samples
+        np.testing.assert_allclose(window[:, 1:real_frames - 1], reference[:, 1:real_frames - 1], atol=1e-3)
+
+    last = windows[-1][1]
+    # padding of the trailing window is silence: the window's top_db floor
+    assert np.all(last[:, 70:] == max(last.max() - LogSpectrogramExtractor.TOP_DB,
+                                      20 * np.log10(LogSpectrogramExtractor.AMIN)))
+    assert np.all(last[:, :69].max(axis=0) > last.min())
+
+
+def test_worker_pool_streams_the_same_windows():
+    pytest.importorskip("soundfile")
+    from app.core.audio_processor import AudioProcessor
+    from app.core.executors import WorkerPool
+    from scripts.benchmark import encode, synthetic_signal
+
+    content = encode(synthetic_signal(40, seed=1), ".wav")
+    expected = list(AudioProcessor().iter_windows(content, ".wav", hop_seconds=5.0))
+    pool = WorkerPool(preprocess_workers=1)
+    pool.start()
+    try:
+        # batches of 3 windows: several blocks plus a short last one
+        windows = list(pool.iter_windows(content, ".wav", hop_seconds=5.0, batch_size=3))
+        # stopping early ends the worker and releases the blocks already sent
+        first = next(iter(pool.iter_windows(content, ".wav", hop_seconds=5.0, batch_size=3)))
+    finally:
+        pool.shutdown()
+
+    assert [(start, end) for start, end, _ in windows] == [(start, end) for start, end, _ in expected]
+    for (_, _, window), (_, _, reference) in zip(windows, expected):
+        np.testing.assert_array_equal(window, reference)
+    np.testing.assert_array_equal(first[2], expected[0][2])
@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+
+from scripts.train import launch_local, parse_args
+
+
+def test_two_local_ranks_train_and_report(tmp_path):
+    args = parse_args([
+        "--nproc", "2", "--synthetic", "16", "--synthetic-shape", "32x64", "--epochs", "2",
+        "--batch-size", "2", "--threads", "1", "--num-workers", "0", "--save-dir", str(tmp_path),
+    ])
+    launch_local(args)
+
+    report = json.loads((tmp_path / "scaling_report.json").read_text())
+    assert report["world_size"] == 2
+    assert len(report["epochs"][0]["rank_samples_per_s"]) == 2
+    assert (tmp_path / "best.pth").exists()
+    assert (tmp_path / "last.ckpt").exists()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from app.utils.upload import RequestSizeLimitMiddleware, estimate_bytes_needed, sniff_format
+
+
+def test_request_limit_depends_on_the_route():
+    app = FastAPI()
+
+    @app.post("/predict/")
+    async def predict(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    @app.post("/predict/batch")
+    async def batch(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(RequestSizeLimitMiddleware, max_bytes=10_000, path_limits={"/predict/batch": 100_000})
+    client = TestClient(app)
+
+    assert client.post("/predict/", files={"file": ("a.wav", b"x" * 5_000)}).status_code == 200
+    assert client.post("/predict/", files={"file": ("a.wav", b"x" * 50_000)}).status_code == 413
+    assert client.post("/predict/batch", files={"file": ("a.zip", b"x" * 50_000)}).status_code == 200
+    assert client.post("/predict/batch", files={"file": ("a.zip", b"x" * 200_000)}).status_code == 413
+
+
+def test_sniff_format():
+    pytest.importorskip("soundfile")
+    from scripts.benchmark import encode, synthetic_signal
+
+    signal = synthetic_signal(1)
+    for fmt in (".wav", ".flac", ".ogg", ".mp3"):
+        assert sniff_format(encode(signal, fmt)[:64]) == fmt
+    assert sniff_format(b"\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00") == ".m4a"
+    # ID3v2 tag (size 16, syncsafe) followed by an MPEG-1 layer III frame header
+    id3 = b"ID3\x04\x00\x00\x00\x00\x00\x10" + b"\x00" * 16
+    assert sniff_format(id3 + b"\xff\xfb\x90\x64" + b"\x00" * 32) == ".mp3"
+    # a tag larger than the first chunk can't be checked further
+    assert sniff_format(b"ID3\x04\x00\x00\x00\x01\x00\x00" + b"\x00" * 32) == ".mp3"
+    assert sniff_format(id3 + b"not a frame" + b"\x00" * 32) is None
+    assert sniff_format(b"<html><body>not audio</body></html>") is None
+    # reserved bitrate index: sync bits alone don't make a frame
+    assert sniff_format(b"\xff\xfb\xf0\x64" + b"\x00" * 32) is None
+
+
+@pytest.mark.parametrize("fmt", [".wav", ".flac", ".mp3"])
+def test_estimated_bytes_cover_the_analysis_window(fmt):
+    pytest.importorskip("soundfile")
+    pytest.importorskip("librosa")
+    from models.preprocessing import Loader
+    from scripts.benchmark import encode, synthetic_signal
+
+    content = encode(synthetic_signal(30), fmt)
+    needed = estimate_bytes_needed(content[:64 * 1024], fmt, 15)
+
+    assert needed is not None
+    loader = Loader(22050, 15, True)
+    # the prefix decodes to the same 15 seconds as the whole file
+    np.testing.assert_allclose(loader.load(content[:needed], fmt), loader.load(content, fmt), atol=1e-6)
+    if fmt == ".wav":
+        # 16-bit stereo at 44.1 kHz: the margin on top of 15 s of PCM, well short of the 30 s file
+        assert needed == int((44 + 15 * 44100 * 4) * 1.25) + 64 * 1024
+        assert needed < len(content)
+
+
+def test_containers_without_an_estimate_are_read_whole():
+    assert estimate_bytes_needed(b"OggS" + b"\x00" * 60, ".ogg", 15) is None
+    assert estimate_bytes_needed(b"\x00\x00\x00\x20ftypM4A ", ".m4a", 15) is None
+    # WAV header cut before the data chunk
+    assert estimate_bytes_needed(b"RIFF\x00\x00\x00\x00WAVEfmt ", ".wav", 15) is None
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from app.core.vector_index import ServingLock, TrackNotFoundError, VectorIndex
+
+
+def _clustered(count, dim=16, clusters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim))
+    return centres[rng.integers(0, clusters, count)] + 0.1 * rng.standard_normal((count, dim))
+
+
+def test_exact_search_and_incremental_updates():
+    vectors = _clustered(50)
+    index = VectorIndex(dim=16)
+    index.add([f"t{i}" for i in range(50)], vectors)
+
+    assert index.search(vectors[3], k=1)[0] == ("t3", pytest.approx(1.0))
+    assert "t3" not in [track_id for track_id, _ in index.search(vectors[3], k=5, exclude="t3")]
+
+    # replacing keeps one entry per id, removal moves the last row into the freed one
+    index.add(["t3"], -vectors[3:4])
+    assert len(index) == 50
+    assert index.search(-vectors[3], k=1)[0][0] == "t3"
+    assert index.remove("t0") and not index.remove("t0")
+    assert len(index) == 49
+    np.testing.assert_allclose(index.get("t49"), vectors[49] / np.linalg.norm(vectors[49]), rtol=1e-5)
+    with pytest.raises(TrackNotFoundError):
+        index.get("t0")
+
+
+def test_ivf_trains_on_inserts_and_survives_save(tmp_path):
+    vectors = _clustered(400)
+    ids = [f"t{i}" for i in range(400)]
+    index = VectorIndex(dim=16, nlist=8, nprobe=2)
+    index.add(ids[:300], vectors[:300])
+    # 8 lists x 40 vectors are needed before training
+    assert not index.trained
+    # training starts in the background, searches and inserts keep working meanwhile
+    index.add(ids[300:], vectors[300:])
+    assert index.join_training(timeout=30)
+    assert index.trained
+
+    queries = vectors[::40]
+    for query in queries:
+        assert index.search(query, k=5)[0][0] == index.search(query, k=5, exact=True)[0][0]
+
+    index.save(str(tmp_path / "tracks.npz"))
+    loaded = VectorIndex.load(str(tmp_path / "tracks.npz"))
+    assert len(loaded) == 400 and loaded.trained
+    for query in queries:
+        assert loaded.search(query, k=5) == index.search(query, k=5)
+    loaded.add(["new"], vectors[:1])
+    assert "new" in loaded
+
+
+def test_updates_during_training_land_in_the_new_lists(monkeypatch):
+    from app.core import vector_index
+
+    vectors = _clustered(400)
+    index = VectorIndex(dim=16, nlist=8, nprobe=2)
+    index.add([f"t{i}" for i in range(300)], vectors[:300])
+    kmeans = vector_index._kmeans
+
+    def update_then_cluster(*args):
+        # runs without the index lock: other threads can search and update
+        index.add(["t0", "late"], -vectors[:2])
+        index.remove("t1")
+        assert index.search(vectors[5], k=1)[0][0] == "t5"
+        return kmeans(*args)
+
+    monkeypatch.setattr(vector_index, "_kmeans", update_then_cluster)
+    index.train()
+
+    assert index.trained and len(index) == 300
+    assert "t1" not in index
+    for track_id, vector in (("t0", -vectors[0]), ("late", -vectors[1])):
+        assert index.search(vector, k=1, exact=True)[0][0] == track_id
+        list_no, _ = index._where[track_id]
+        assert list_no == int(np.argmax(index.centroids @ index.get(track_id)))
+
+
+def _serve(path, started, stop):
+    lock = ServingLock(path)
+    started.set()
+    stop.wait(30)
+    lock.close()
+
+
+def test_serving_lock_detects_other_processes(tmp_path):
+    import multiprocessing
+
+    path = str(tmp_path / "tracks.npz")
+    lock = ServingLock(path)
+    with lock.exclusive() as alone:
+        assert alone
+
+    context = multiprocessing.get_context("spawn")
+    started, stop = context.Event(), context.Event()
+    other = context.Process(target=_serve, args=(path, started, stop))
+    other.start()
+    try:
+        assert started.wait(30)
+        with lock.exclusive() as alone:
+            assert not alone
+    finally:
+        stop.set()
+        other.join(30)
+    # the other server is gone, changes are safe again
+    with lock.exclusive() as alone:
+        assert alone
+    lock.close()